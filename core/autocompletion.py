@@ -20,17 +20,123 @@ import logging
 logger = logging.getLogger( __name__ )
 import struct
 import csv
+import array
+import bisect
+import re
+import sys
+import unicodedata
 import os.path
 import zipfile
 import itertools
 import io
+import threading
+import time
 from core.config import Config
-csv.register_dialect( 'opengeodb', delimiter="\t", quoting=csv.QUOTE_NONE, skipinitialspace=False, quotechar='', doublequote=False )
+from core.datasetcache import DatasetCache
+csv.register_dialect( 'opengeodb', delimiter="\t", quoting=csv.QUOTE_NONE, skipinitialspace=False, quotechar=None, doublequote=False )
 csv.register_dialect( 'semicolonsep', delimiter=";", quoting=csv.QUOTE_MINIMAL, skipinitialspace=False, quotechar='"', doublequote=False )
+class InfoTable:
+    """
+    Columnar storage for the records of one tag: one list of (interned)
+    strings or one packed float64 array per field, and per indexed field a
+    sorted array of the keys together with the positions of their records.
+    This needs a fraction of the memory of one object and one dict entry per
+    record and key.
+    """
+    def __init__( self, types ):
+        """
+        __init__ function.
+        Arguments:
+            types:
+                the column types, one character ('s' for str, 'f' for float) per field
+        """
+        self._types = types
+        self._columns = [array.array( 'd' ) if column_type == 'f' else [] for column_type in types]
+        self._indexes = {}
+    def __len__( self ):
+        return len( self._columns[0] )
+    def set_columns( self, columns ):
+        """
+        Replaces all records. Float columns may be any buffer of doubles,
+        e.g. a memoryview of a DatasetCache file.
+        """
+        self._columns = [column if column_type == 'f' else [sys.intern( value ) for value in column]
+                         for column_type, column in zip( self._types, columns )]
+        self._indexes.clear()
+    def append( self, record ):
+        for i, ( column_type, value ) in enumerate( zip( self._types, record ) ):
+            if column_type == 'f' and not isinstance( self._columns[i], array.array ):
+                self._columns[i] = array.array( 'd', self._columns[i] ) # e.g. a read-only memoryview
+            self._columns[i].append( sys.intern( value ) if column_type == 's' else value )
+        self._indexes.clear()
+    def record( self, position ):
+        """
+        Returns the record at a position as tuple.
+        """
+        return tuple( column[position] for column in self._columns )
+    def get_index( self, field, normalize=None ):
+        """
+        Returns the sorted keys of a field and the positions of their records.
+        Records with equal keys keep the order in which they were added.
+        The index is built on first use.
+        Arguments:
+            field:
+                the number of the field
+            normalize:
+                optional function that is applied to the values before indexing
+        """
+        index = self._indexes.get( ( field, normalize ) )
+        if index is None:
+            column = self._columns[field]
+            if normalize is not None:
+                normalized = {} # many values occur several times, e.g. city names
+                column = [normalized[value] if value in normalized else normalized.setdefault( value, normalize( value ) ) for value in column]
+            positions = array.array( 'I', sorted( range( len( column ) ), key=column.__getitem__ ) )
+            index = ( [column[i] for i in positions], positions )
+            self._indexes[( field, normalize )] = index
+        return index
+    def find_all( self, field, value ):
+        """
+        Returns the positions of all records where field has a specific value,
+        in the order they were added.
+        """
+        keys, positions = self.get_index( field )
+        return positions[bisect.bisect_left( keys, value ):bisect.bisect_right( keys, value )].tolist()
+    def find_prefix( self, field, prefix, normalize=None ):
+        """
+        Yields the positions of the records where field starts with prefix,
+        sorted by the (normalized) value of the field.
+        """
+        keys, positions = self.get_index( field, normalize )
+        if normalize is not None:
+            prefix = normalize( prefix )
+        for i in range( bisect.bisect_left( keys, prefix ), len( keys ) ):
+            if not keys[i].startswith( prefix ):
+                break
+            yield positions[i]
+    def find( self, field, value ):
+        """
+        Returns the position of the record where field has a specific value.
+        If there are several, the one added last wins (like a dict would do).
+        Returns:
+            position or None
+        """
+        keys, positions = self.get_index( field )
+        i = bisect.bisect_right( keys, value ) - 1
+        if i >= 0 and keys[i] == value:
+            return positions[i]
+        return None
 class TaggedInfoStore:
     """
     An Object that stores objects and makes them accessible through their attributes. Should only be used through subclasses.
+    The records are stored in one InfoTable per tag, objects are only created when they are requested.
     """
+    # Attribute names and column types of the records (see InfoTable and DatasetCache), set by subclasses
+    FIELDS = None
+    CACHE_NAME = None
+    CACHE_COLUMNS = None
+    # Maps attribute names to functions that normalize values for complete()
+    NORMALIZERS = {}
     def __init__( self, keys ):
         """
         __init__ function.
@@ -40,7 +146,12 @@ class TaggedInfoStore:
         """
         self._data = {}
         self._keys = keys
-    def load( self, tag, fname, fencoding='utf-8' ):
+        self._global_indexes = {} # indexes over all tags, see AbstractBankInfoStore
+    def _get_table( self, tag ):
+        if tag not in self._data:
+            self._data[tag] = InfoTable( self.CACHE_COLUMNS )
+        return self._data[tag]
+    def load( self, tag, fname, fencoding='utf-8', cache=None ):
         """
         Opens file and loads the data into the given tag.
         Arguments:
@@ -50,8 +161,30 @@ class TaggedInfoStore:
                 The filename of the file that contains the data
             fencoding:
                 The file encoding of the file
+            cache:
+                DatasetCache that is used instead of parsing the file, if possible
+        """
+        if cache is None:
+            records = list( self.read( tag, fname, fencoding ) )
+            columns = list( zip( *records ) ) if records else [[] for column_type in self.CACHE_COLUMNS]
+        else:
+            columns = cache.load( "{}-{}".format( self.CACHE_NAME, tag ), fname, self.CACHE_COLUMNS, lambda: self.read( tag, fname, fencoding ) )
+        columns = [array.array( 'd', column ) if column_type == 'f' and isinstance( column, tuple ) else column
+                   for column_type, column in zip( self.CACHE_COLUMNS, columns )]
+        self._get_table( tag ).set_columns( columns )
+        self._global_indexes.clear()
+    def read( self, tag, fname, fencoding ):
+        """
+        Parses a file.
+        Returns:
+            an iterable of record tuples (see FIELDS)
         """
-        getattr( self, "load_{}".format( tag ) )( fname, fencoding )
+        return getattr( self, "read_{}".format( tag ) )( fname, fencoding )
+    def create( self, tag, record ):
+        """
+        Creates the object for a record tuple.
+        """
+        raise NotImplementedError
     def clear( self, tag=None ):
         """
         Clears all data. If tag is given, only clears data for this tag.
@@ -72,8 +205,8 @@ class TaggedInfoStore:
                 The tag to be cleared
         """
         if tag in self._data:
-            for key in self._data[tag].keys():
-                self._data[tag][key].clear()
+            self._data[tag] = InfoTable( self.CACHE_COLUMNS )
+            self._global_indexes.clear()
     def add( self, tag, obj ):
         """
         Adds an Object to a tag.
@@ -83,12 +216,8 @@ class TaggedInfoStore:
             tag:
                 tag for this object
         """
-        if tag not in self._data:
-            self._data[tag] = {}
-            for key in self._keys:
-                self._data[tag][key] = {}
-        for key in self._data[tag].keys():
-            self._data[tag][key][getattr( obj, key )] = obj
+        self._get_table( tag ).append( tuple( getattr( obj, field ) for field in self.FIELDS ) )
+        self._global_indexes.clear()
     def get( self, tag, key, value ):
         """
         Gets an object from tag where key has a specific value.
@@ -102,26 +231,212 @@ class TaggedInfoStore:
         Returns:
             object or None
         """
-        if tag in self._data:
-            if key in self._data[tag]:
-                if value in self._data[tag][key]:
-                    return self._data[tag][key][value]
+        ensure_data_loaded()
+        if tag in self._data and key in self._keys:
+            table = self._data[tag]
+            position = table.find( self.FIELDS.index( key ), value )
+            if position is not None:
+                return self.create( tag, table.record( position ) )
+    def get_all( self, tag, key, value ):
+        """
+        Gets all objects from tag where key has a specific value.
+        Returns:
+            a list of objects
+        """
+        ensure_data_loaded()
+        if tag in self._data and key in self._keys:
+            table = self._data[tag]
+            return [self.create( tag, table.record( position ) ) for position in table.find_all( self.FIELDS.index( key ), value )]
+        return []
+    def complete( self, tag, key, prefix, limit=10 ):
+        """
+        Gets the objects from tag where key starts with prefix, e.g. for typeahead.
+        Keys with an entry in NORMALIZERS are compared normalized.
+        Arguments:
+            tag:
+                tag to search
+            key:
+                attribute name of object
+            prefix:
+                the beginning of the attribute value
+            limit:
+                maximum number of objects to return
+        Returns:
+            a list of objects sorted by the (normalized) attribute value, without duplicate records
+        """
+        ensure_data_loaded()
+        result = []
+        if tag in self._data and key in self._keys and prefix:
+            table = self._data[tag]
+            seen = set()
+            for position in table.find_prefix( self.FIELDS.index( key ), prefix, self.NORMALIZERS.get( key ) ):
+                record = table.record( position )
+                if record not in seen:
+                    seen.add( record )
+                    result.append( self.create( tag, record ) )
+                    if len( result ) >= limit:
+                        break
+        return result
+    def build_indexes( self ):
+        """
+        Builds all indexes in advance, so that the first lookups are fast, too.
+        """
+        ensure_data_loaded()
+        for table in list( self._data.values() ):
+            for key in self._keys:
+                table.get_index( self.FIELDS.index( key ) )
+                if key in self.NORMALIZERS:
+                    table.get_index( self.FIELDS.index( key ), self.NORMALIZERS[key] )
 class AbstractBankInfoStore( TaggedInfoStore ):
+    """
+    Besides the lookups per country, banks can be found by BIC and by name
+    across all countries. These indexes number the records of all tags
+    consecutively (in the order of the sorted tags) and are built on first
+    use or by build_indexes().
+    """
     def __init__( self ):
         keys = ( 'bic', 'bankcode' )
         TaggedInfoStore.__init__( self, keys )
-    def get_by_iban( self, value ):
+    def _get_global_index( self, name, build ):
+        index = self._global_indexes.get( name )
+        if index is None:
+            ensure_data_loaded()
+            tags = sorted( self._data )
+            offsets = []
+            total = 0
+            for tag in tags:
+                offsets.append( total )
+                total += len( self._data[tag] )
+            index = self._global_indexes[name] = build( tags, offsets )
+        return index
+    def _create_global( self, index, position ):
+        """
+        Creates the object for a position of a global index.
+        """
+        tags, offsets = index[:2]
+        i = bisect.bisect_right( offsets, position ) - 1
+        return self.create( tags[i], self._data[tags[i]].record( position - offsets[i] ) )
+    def _build_bic_index( self, tags, offsets ):
+        """
+        Returns ( tags, offsets, sorted normalized BICs, their global positions ).
+        """
+        field = self.FIELDS.index( 'bic' )
+        bics = [normalize_bic( bic ) for tag in tags for bic in self._data[tag]._columns[field]]
+        positions = array.array( 'I', sorted( range( len( bics ) ), key=bics.__getitem__ ) )
+        return ( tags, offsets, [bics[i] for i in positions], positions )
+    def _build_name_index( self, tags, offsets ):
+        """
+        Returns ( tags, offsets, sorted words, their global positions,
+        normalized name and alphabetical rank per global position ).
+        """
+        name_field, name_short_field = self.FIELDS.index( 'name' ), self.FIELDS.index( 'name_short' )
+        tokenized = {} # names occur several times, e.g. for every branch of a bank
+        words, word_positions, names = [], array.array( 'I' ), []
+        for tag in tags:
+            columns = self._data[tag]._columns
+            for name, name_short in zip( columns[name_field], columns[name_short_field] ):
+                for value in ( name, name_short ):
+                    if value not in tokenized:
+                        tokenized[value] = ( normalize_name( value ), tuple( tokenize_name( value ) ) )
+                position = len( names )
+                names.append( tokenized[name][0] )
+                for word in set( tokenized[name][1] + tokenized[name_short][1] ):
+                    words.append( word )
+                    word_positions.append( position )
+        order = sorted( range( len( words ) ), key=words.__getitem__ )
+        ranks = array.array( 'I', bytes( 4 * len( names ) ) )
+        for rank, position in enumerate( sorted( range( len( names ) ), key=names.__getitem__ ) ):
+            ranks[position] = rank
+        return ( tags, offsets, [words[i] for i in order], array.array( 'I', ( word_positions[i] for i in order ) ), names, ranks )
+    def get_bankcode( self, value ):
+        """
+        Returns ( countrycode, bankcode ) of an IBAN or None if the country is not supported.
+        """
         iban = value.upper()
         countrycode = iban[:2]
         if countrycode in self.__class__.BANKCODE_FMT:
             bankcode_length = self.__class__.BANKCODE_FMT[countrycode]['length']
-            bankcode = iban[4:( 4 + bankcode_length )]
-            return self.get( countrycode, "bankcode", bankcode )
+            return countrycode, iban[4:( 4 + bankcode_length )]
+    def get_by_iban( self, value ):
+        bankcode = self.get_bankcode( value )
+        if bankcode is not None:
+            return self.get( bankcode[0], "bankcode", bankcode[1] )
+    def get_all_by_bic( self, value ):
+        """
+        Gets the banks of all countries with a BIC (with or without branch
+        code, e.g. "COBADEFF" is "COBADEFFXXX"). Several banks (e.g. the
+        branches of a bank) may share a BIC, they are returned in the order of
+        the data files. If there is no bank with the BIC of the primary office
+        of a BIC8, the banks of all branches are returned.
+        Returns:
+            a list of objects (empty for an empty BIC or None)
+        """
+        bic = normalize_bic( value )
+        if not bic:
+            return []
+        index = self._get_global_index( 'bic', self._build_bic_index )
+        tags, offsets, keys, positions = index
+        start, end = bisect.bisect_left( keys, bic ), bisect.bisect_right( keys, bic )
+        if start == end and len( bic ) == 11 and bic.endswith( 'XXX' ):
+            start = bisect.bisect_left( keys, bic[:8] )
+            end = start
+            while end < len( keys ) and keys[end].startswith( bic[:8] ):
+                end += 1
+        return [self._create_global( index, position ) for position in sorted( positions[start:end] )]
     def get_by_bic( self, value ):
-        for tag in self._data.keys():
-            obj = self.get( tag, 'bic', value )
-            if obj:
-                return obj
+        """
+        Gets the first bank with a BIC (see get_all_by_bic()) or None.
+        """
+        banks = self.get_all_by_bic( value )
+        return banks[0] if banks else None
+    def search_name( self, text, limit=10 ):
+        """
+        Searches banks of all countries by name, e.g. for typeahead: every word
+        of text has to be the beginning of a word of name or name_short
+        (ignoring case and accents). Banks whose name starts with text come
+        first, the others are sorted by name.
+        Arguments:
+            text:
+                the words to search for
+            limit:
+                maximum number of objects to return
+        Returns:
+            a list of objects, without duplicate records
+        """
+        query = tokenize_name( text )
+        if not query:
+            return []
+        index = self._get_global_index( 'name', self._build_name_index )
+        tags, offsets, words, word_positions, names, ranks = index
+        ranges = []
+        for word in set( query ):
+            start = bisect.bisect_left( words, word )
+            # All words with this prefix are less than the prefix with its last character incremented
+            end = bisect.bisect_left( words, word[:-1] + chr( ord( word[-1] ) + 1 ), start )
+            ranges.append( ( end - start, start, end ) )
+        ranges.sort()
+        candidates = set( word_positions[ranges[0][1]:ranges[0][2]] )
+        for size, start, end in ranges[1:]:
+            if not candidates:
+                break
+            candidates.intersection_update( word_positions[start:end] )
+        prefix = normalize_name( text.strip() )
+        result, seen = [], set()
+        for matches in ( [position for position in candidates if names[position].startswith( prefix )],
+                         [position for position in candidates if not names[position].startswith( prefix )] ):
+            for position in sorted( matches, key=ranks.__getitem__ ):
+                obj = self._create_global( index, position )
+                record = ( obj.bic, obj.name, obj.name_short )
+                if record not in seen:
+                    seen.add( record )
+                    result.append( obj )
+                    if len( result ) >= limit:
+                        return result
+        return result
+    def build_indexes( self ):
+        TaggedInfoStore.build_indexes( self )
+        self._get_global_index( 'bic', self._build_bic_index )
+        self._get_global_index( 'name', self._build_name_index )
     def get( self, tag, key, value ):
         if key == 'bankcode' and tag in self.__class__.BANKCODE_FMT and self.__class__.BANKCODE_FMT[tag]['can_be_shorter']:
             value = value.lstrip( '0' )
@@ -130,9 +445,12 @@ class BankInfoStore( AbstractBankInfoStore ):
     BANKCODE_FMT = { 'DE': {'length': 8, 'can_be_shorter':False},
                      'AT': {'length': 5, 'can_be_shorter':False},
                      'CH': {'length': 5, 'can_be_shorter':True} }
-    def load_DE( self, fname, fencoding='latin1' ):
-        tag = 'DE'
-        self.clear_tag( tag )
+    FIELDS = ( 'bankcode', 'bic', 'name', 'name_short' )
+    CACHE_NAME = 'banks'
+    CACHE_COLUMNS = 'ssss'
+    def create( self, tag, record ):
+        return BankInfo( *record, country=tag )
+    def read_DE( self, fname, fencoding='latin1' ):
         fieldwidths = ( 8, # BLZ
                         1, # Merkmal
                        58, # Bezeichnung
@@ -153,11 +471,8 @@ class BankInfoStore( AbstractBankInfoStore ):
                 data = parse( line )
                 bankcode, bic, name, name_short = data[0].decode( fencoding ).strip(), data[7].decode( fencoding ).strip(), data[2].decode( fencoding ).strip(), data[5].decode( fencoding ).strip()
                 if len( bankcode ) == 8 and len( bic ) == 11:
-                    obj = BankInfo( bankcode, bic, name, name_short )
-                    self.add( tag, obj )
-    def load_AT( self, fname, fencoding='latin1' ):
-        tag = 'AT'
-        self.clear_tag( tag )
+                    yield ( bankcode, bic, name, name_short )
+    def read_AT( self, fname, fencoding='latin1' ):
         with zipfile.ZipFile( fname, 'r' ) as archive:
             if len( archive.namelist() ) == 1 and archive.namelist()[0].startswith( 'SEPA-ZV-VZ_gesamt_de_' ):
                 with archive.open( archive.namelist()[0], 'r' ) as encoded_f:
@@ -189,11 +504,8 @@ class BankInfoStore( AbstractBankInfoStore ):
                         for row in itertools.islice( reader, 6, None ):
                             bankcode, bic, name, name_short = row['Bankleitzahl'].strip().zfill( 5 ), row['SWIFT-Code'].strip(), row['Bankenname'].strip(), row['Bankenname'].strip()
                             if len( bankcode ) == 5 and len( bic ) == 11:
-                                obj = BankInfo( bankcode, bic, name, name_short )
-                                self.add( tag, obj )
-    def load_CH( self, fname, fencoding='latin1' ):
-        tag = 'CH'
-        self.clear_tag( tag )
+                                yield ( bankcode, bic, name, name_short )
+    def read_CH( self, fname, fencoding='latin1' ):
         fieldwidths = ( 2, # Gruppe
                         5, # BCNr
                         4, # Filial-ID
@@ -224,14 +536,15 @@ class BankInfoStore( AbstractBankInfoStore ):
                 data = parse( line )
                 bankcode, bic, name, name_short = data[1].decode( fencoding ).strip(), data[22].decode( fencoding ).strip(), data[12].decode( fencoding ).strip(), data[11].decode( fencoding ).strip()
                 if bankcode and len( bic ) == 11:
-                    obj = BankInfo( bankcode, bic, name, name_short )
-                    self.add( tag, obj )
+                    yield ( bankcode, bic, name, name_short )
 class BankInfo:
-    def __init__( self, bankcode, bic, name, name_short ):
+    __slots__ = ( '_bankcode', '_bic', '_name', '_name_short', '_country' )
+    def __init__( self, bankcode, bic, name, name_short, country=None ):
         self._bankcode = bankcode
         self._bic = bic
         self._name = name
         self._name_short = name_short
+        self._country = country
     @property
     def bankcode( self ):
         return self._bankcode
@@ -244,13 +557,44 @@ class BankInfo:
     @property
     def name_short( self ):
         return self._name_short
+    @property
+    def country( self ):
+        return self._country
 
+def normalize_name( value ):
+    """
+    Normalizes a name for searching: case-insensitive and without accents, e.g. "Zürich" -> "zurich".
+    """
+    decomposed = unicodedata.normalize( 'NFKD', value )
+    return "".join( c for c in decomposed if not unicodedata.combining( c ) ).casefold()
+_word_re = re.compile( r"\w+" )
+def tokenize_name( value ):
+    """
+    Splits a name into normalized words for searching, e.g. "Sparkasse Köln/Bonn" -> ["sparkasse", "koln", "bonn"].
+    """
+    return _word_re.findall( normalize_name( value ) )
+def normalize_bic( value ):
+    """
+    Normalizes a BIC for lookups: upper case without spaces, a BIC8 gets the
+    branch code "XXX" of the primary office, e.g. "cobadeff" -> "COBADEFFXXX".
+    An empty value or None gives an empty string.
+    """
+    if not value:
+        return ''
+    bic = value.replace( ' ', '' ).upper()
+    return bic + 'XXX' if len( bic ) == 8 else bic
 class CityInfoStore( TaggedInfoStore ):
+    FIELDS = ( 'zipcode', 'name', 'lat', 'lon' )
+    CACHE_NAME = 'cities'
+    CACHE_COLUMNS = 'ssff'
+    NORMALIZERS = { 'name': normalize_name }
     def __init__( self ):
         keys = ( 'zipcode', 'name' )
         TaggedInfoStore.__init__( self, keys )
-    def load( self, tag, fname, fencoding='utf-8' ):
-        self.clear_tag( tag )
+    def create( self, tag, record ):
+        zipcode, name, lat, lon = record
+        return CityInfo( zipcode, name, lat, lon, tag )
+    def read( self, tag, fname, fencoding ):
         with open( fname, newline='', encoding=fencoding ) as f:
             reader = csv.DictReader( f, dialect='opengeodb' )
             for row in reader:
@@ -263,11 +607,9 @@ class CityInfoStore( TaggedInfoStore ):
                     if "," in zipcode:
                         for zipcode_single in zipcode.split( "," ):
                             if zipcode_single:
-                                obj = CityInfo( zipcode_single, name, lat, lon, tag )
-                                self.add( tag, obj )
+                                yield ( zipcode_single, name, lat, lon )
                     else:
-                        obj = CityInfo( zipcode, name, lat, lon, tag )
-                        self.add( tag, obj )
+                        yield ( zipcode, name, lat, lon )
     def iso_zipcode_split( self, iso3661zipcode ):
         if len( iso3661zipcode ) > 3 and '-' in iso3661zipcode:
             countrycode, zipcode = iso3661zipcode.split( '-', 2 )
@@ -279,7 +621,20 @@ class CityInfoStore( TaggedInfoStore ):
         if result:
             countrycode, zipcode = result
             return self.get( countrycode, 'zipcode', zipcode )
+    def complete_zipcode( self, country, prefix, limit=10 ):
+        """
+        Returns up to limit cities in country whose zipcode starts with prefix, sorted by zipcode.
+        Several cities may share a zipcode.
+        """
+        return self.complete( country, 'zipcode', prefix.strip(), limit )
+    def complete_name( self, country, prefix, limit=10 ):
+        """
+        Returns up to limit cities in country whose name starts with prefix
+        (ignoring case and accents), sorted by name.
+        """
+        return self.complete( country, 'name', prefix.strip(), limit )
 class CityInfo:
+    __slots__ = ( '_zipcode', '_name', '_lat', '_lon', '_country' )
     def __init__( self, zipcode, name, lat, lon, country ):
         self._zipcode = zipcode
         self._name = name
@@ -304,9 +659,27 @@ class CityInfo:
 
 Banks = BankInfoStore()
 Cities = CityInfoStore()
+# The data files are big, so they are not parsed at import, but on first use
+# (see ensure_data_loaded()) or in the background (see load_data_async()).
+_data_lock = threading.RLock()
+_data_loaded = False
 def reload_data():
     global Banks
     global Cities
+    global _data_loaded
+    with _data_lock:
+        _reload_data()
+        _data_loaded = True
+def get_cache():
+    """
+    Returns the DatasetCache for the data files, or None if caching is disabled.
+    """
+    if not Config.get( 'Autocompletion', 'cache_dir' ):
+        return None
+    return DatasetCache( Config.getfilepath( 'Autocompletion', 'cache_dir' ) )
+def _reload_data():
+    start = time.perf_counter()
+    cache = get_cache()
     for option in Config.options( 'Autocompletion' ):
         if option.startswith( 'bic_file_' ) or option.startswith( 'zipcode_file_' ):
             filename = Config.getfilepath( 'Autocompletion', option )
@@ -314,9 +687,33 @@ def reload_data():
                 if option.startswith( 'bic_file_' ):
                     tag = option[9:].upper()
                     Banks.clear( tag )
-                    Banks.load( tag, filename, 'latin1' )
+                    Banks.load( tag, filename, 'latin1', cache )
                 elif option.startswith( 'zipcode_file_' ):
                     tag = option[13:].upper()
                     Cities.clear( tag )
-                    Cities.load( tag, filename, 'utf-8' )
-reload_data()
+                    Cities.load( tag, filename, 'utf-8', cache )
+    logger.debug( "Autocompletion data loaded in %.1f ms", ( time.perf_counter() - start ) * 1000 )
+def ensure_data_loaded():
+    """
+    Loads the data files if this has not been done yet. If another thread is
+    already loading them, this waits until it has finished.
+    """
+    if not _data_loaded:
+        with _data_lock:
+            if not _data_loaded:
+                reload_data()
+def build_indexes():
+    """
+    Loads the data files and builds all lookup and completion indexes.
+    """
+    Banks.build_indexes()
+    Cities.build_indexes()
+def load_data_async():
+    """
+    Starts loading the data files in a background thread.
+    Returns:
+        the started thread
+    """
+    thread = threading.Thread( target=ensure_data_loaded, name="autocompletion-loader", daemon=True )
+    thread.start()
+    return thread
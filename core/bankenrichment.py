@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+    This file is part of MSM.
+
+    MSM is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    MSM is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with MSM.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import logging
+logger = logging.getLogger( __name__ )
+import collections
+import csv
+from sqlalchemy import bindparam
+import core.autocompletion
+from core.autocompletion import normalize_bic
+from core.database import Database, Bankaccount
+from core.lib import iban
+from core.lib.job import JobHandle, JobCancelled
+
+BankaccountChange = collections.namedtuple( 'BankaccountChange', ( 'id', 'iban', 'old_bic', 'new_bic', 'old_bank', 'new_bank' ) )
+
+class EnrichmentReport:
+    """
+    The result of a BankaccountEnricher run.
+    """
+    def __init__( self, dry_run ):
+        self.dry_run = dry_run
+        self.cancelled = False
+        self.total = 0
+        self.unchanged = 0
+        self.changes = [] # list of BankaccountChange
+        self.invalid = [] # list of ( bankaccount id, iban, error message )
+        self.unknown = [] # list of ( bankaccount id, iban ) without a known bank
+    @property
+    def num_filled( self ):
+        """
+        Number of changed bank accounts that had an empty BIC or bank name.
+        """
+        return sum( 1 for change in self.changes if not change.old_bic.strip() or not change.old_bank.strip() )
+    @property
+    def num_processed( self ):
+        """
+        Number of bank accounts that have been checked (less than total if the run was cancelled).
+        """
+        return len( self.changes ) + self.unchanged + len( self.invalid ) + len( self.unknown )
+    def summary( self ):
+        """
+        Formats the numbers of the report as lines of text.
+        Returns:
+            a list of strings
+        """
+        verb = "would be updated" if self.dry_run else "updated"
+        lines = ["{:<30}{:>8}".format( "bank accounts", self.total ),
+                 "{:<30}{:>8}".format( verb, len( self.changes ) ),
+                 "{:<30}{:>8}".format( "  empty fields filled", self.num_filled ),
+                 "{:<30}{:>8}".format( "  stale values corrected", len( self.changes ) - self.num_filled ),
+                 "{:<30}{:>8}".format( "unchanged", self.unchanged ),
+                 "{:<30}{:>8}".format( "invalid IBAN", len( self.invalid ) ),
+                 "{:<30}{:>8}".format( "unknown bank", len( self.unknown ) )]
+        if self.cancelled:
+            lines.append( "Cancelled after {} of {} bank accounts.".format( self.num_processed, self.total ) )
+        if self.dry_run:
+            lines.append( "Dry run, nothing was written." )
+        return lines
+    def write_csv( self, f ):
+        """
+        Writes all changes and problems to a CSV file.
+        Arguments:
+            f:
+                a file object opened in text mode with newline=''
+        """
+        writer = csv.writer( f )
+        writer.writerow( ( 'id', 'iban', 'status', 'old_bic', 'new_bic', 'old_bank', 'new_bank' ) )
+        for change in self.changes:
+            writer.writerow( ( change.id, change.iban, 'changed', change.old_bic, change.new_bic, change.old_bank, change.new_bank ) )
+        for bankaccount_id, account_iban, message in self.invalid:
+            writer.writerow( ( bankaccount_id, account_iban, 'invalid: ' + message, '', '', '', '' ) )
+        for bankaccount_id, account_iban in self.unknown:
+            writer.writerow( ( bankaccount_id, account_iban, 'unknown bank', '', '', '', '' ) )
+
+class BankaccountEnricher:
+    """
+    Fills in or corrects the BIC and the bank name of all bank accounts from
+    the bank data of the autocompletion. The bank accounts are read in chunks
+    of consecutive ids, resolved by the bank code of their IBAN (or by their
+    BIC, if the bank code is unknown) and every chunk is written with a
+    single executemany() UPDATE in its own transaction, so that a long run
+    doesn't lock the database and can be interrupted without losing the
+    chunks that are done.
+    Progress is reported to the JobHandle self.job and by calling
+    on_progress( stage, done, total ), where stage is one of STAGES. If the
+    job is cancelled, run() stops before the next chunk.
+    """
+    STAGES = ( 'enrich', )
+    def __init__( self, dry_run=False, only_empty=False, session=None, chunk_size=1000, on_progress=None, banks=None, job=None ):
+        """
+        Args:
+            dry_run:
+                only create the report, don't write anything
+            only_empty:
+                only fill empty fields, don't replace existing values
+            session:
+                the scoped session to use (defaults to a new thread-local one)
+            chunk_size:
+                number of bank accounts read and written per transaction
+            on_progress:
+                callable that is called with stage, done and total
+            banks:
+                the BankInfoStore (defaults to core.autocompletion.Banks)
+            job:
+                the JobHandle to report to (defaults to a new one)
+        """
+        self.dry_run = dry_run
+        self.only_empty = only_empty
+        self.session = session if session is not None else Database.get_scoped_session()
+        self.chunk_size = chunk_size
+        self.on_progress = on_progress
+        self.banks = banks
+        self.job = job if job is not None else JobHandle()
+        self._resolved = {}
+    def _progress( self, stage, done, total ):
+        self.job.update( stage, done, total )
+        if self.on_progress is not None:
+            self.on_progress( stage, done, total )
+    def _chunks( self ):
+        """
+        Yields lists of ( id, iban, bic, bank ) tuples, ordered by id.
+        """
+        columns = ( Bankaccount.id, Bankaccount.iban, Bankaccount.bic, Bankaccount.bank )
+        last_id = None
+        while True:
+            q = self.session.query( *columns )
+            if last_id is not None:
+                q = q.filter( Bankaccount.id > last_id )
+            rows = q.order_by( Bankaccount.id ).limit( self.chunk_size ).all()
+            if not rows:
+                return
+            yield rows
+            last_id = rows[-1][0]
+    def resolve( self, account_iban, bic ):
+        """
+        Returns the BankInfo for an IBAN (or, if its bank code is unknown, for the BIC) or None.
+        """
+        key = self.banks.get_bankcode( account_iban )
+        if key is not None:
+            if key not in self._resolved:
+                self._resolved[key] = self.banks.get_by_iban( account_iban )
+            if self._resolved[key] is not None:
+                return self._resolved[key]
+        if bic:
+            key = normalize_bic( bic )
+            if key not in self._resolved:
+                self._resolved[key] = self.banks.get_by_bic( key )
+            return self._resolved[key]
+        return None
+    def enrich( self, rows, report ):
+        """
+        Resolves the bank data of a chunk of bank accounts and adds them to the report.
+        Returns:
+            a list of BankaccountChange
+        """
+        changes = []
+        ibans = [( account_iban or '' ).replace( ' ', '' ).upper() for bankaccount_id, account_iban, bic, bank in rows]
+        for ( bankaccount_id, account_iban, bic, bank ), normalized, ( parts, err ) in zip( rows, ibans, iban.check_ibans( ibans ) ):
+            bic = bic or ''
+            bank = bank or ''
+            if err:
+                report.invalid.append( ( bankaccount_id, account_iban, err ) )
+                continue
+            bankinfo = self.resolve( normalized, bic )
+            if bankinfo is None:
+                report.unknown.append( ( bankaccount_id, account_iban ) )
+                continue
+            new_bic, new_bank = bic, bank
+            if bankinfo.bic and ( not bic.strip() or ( not self.only_empty and normalize_bic( bic ) != normalize_bic( bankinfo.bic ) ) ):
+                new_bic = bankinfo.bic
+            if bankinfo.name and ( not bank.strip() or ( not self.only_empty and bank != bankinfo.name ) ):
+                new_bank = bankinfo.name
+            if ( new_bic, new_bank ) == ( bic, bank ):
+                report.unchanged += 1
+            else:
+                changes.append( BankaccountChange( bankaccount_id, account_iban, bic, new_bic, bank, new_bank ) )
+        report.changes.extend( changes )
+        return changes
+    def save( self, changes ):
+        """
+        Writes the changes of a chunk in a single transaction.
+        """
+        if not changes:
+            return
+        table = Bankaccount.__table__
+        statement = table.update().where( table.c.id == bindparam( 'b_id' ) ).values( bic=bindparam( 'b_bic' ), bank=bindparam( 'b_bank' ) )
+        self.session.connection().execute( statement, [{ 'b_id': change.id, 'b_bic': change.new_bic, 'b_bank': change.new_bank } for change in changes] )
+        self.session.commit()
+    def run( self ):
+        """
+        Enriches all bank accounts.
+        Returns:
+            an EnrichmentReport (of the chunks that are done, if the job was cancelled)
+        """
+        try:
+            return self._run()
+        finally:
+            self.job.finish()
+    def _run( self ):
+        if self.banks is None:
+            core.autocompletion.ensure_data_loaded()
+            self.banks = core.autocompletion.Banks
+        report = EnrichmentReport( self.dry_run )
+        report.total = self.session.query( Bankaccount.id ).count()
+        self._progress( 'enrich', 0, report.total )
+        done = 0
+        try:
+            for rows in self._chunks():
+                self.job.check_cancelled()
+                changes = self.enrich( rows, report )
+                if not self.dry_run:
+                    self.save( changes )
+                done += len( rows )
+                self._progress( 'enrich', done, report.total )
+        except JobCancelled:
+            report.cancelled = True
+            logger.info( "Cancelled after %d of %d bank accounts", done, report.total )
+        if self.dry_run:
+            self.session.rollback()
+        else:
+            # The ORM objects of the session may still hold the old values
+            self.session.expire_all()
+        logger.info( "%s of %d bank accounts %s", len( report.changes ), report.total, "would be updated" if self.dry_run else "updated" )
+        return report
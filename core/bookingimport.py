@@ -18,46 +18,75 @@
 """
 import logging
 import threading
-from core.database import Contract, BookkeepingEntry
-from msmgui.widgets.base import ScopedDatabaseObject
+from core.database import Contract, BookkeepingEntry, Money, ScopedDatabaseObject
+from core.lib.job import JobHandle, JobCancelled
 
 
 class BookingImporter(threading.Thread, ScopedDatabaseObject):
-    def __init__(self, input_file, importer, update_step=25):
+    """
+    Imports bookkeeping entries from a file. The progress is reported to the
+    JobHandle self.job (stages 'read', 'resolve', 'analyse' and 'write');
+    if the job is cancelled, nothing is written.
+    """
+    def __init__(self, input_file, importer):
         threading.Thread.__init__(self)
         ScopedDatabaseObject.__init__(self)
         self.logger = logging.getLogger(__name__)
         self._input_file = input_file
         self._importer = importer
-        self._update_step = update_step
+        self.job = JobHandle()
 
     def run(self):
+        try:
+            self._import()
+        except JobCancelled:
+            self._session.rollback()
+            self.logger.info('Import abgebrochen, keine Datensätze hinzugefügt.')
+        finally:
+            self._session.expunge_all()
+            self._session.remove()
+            self.job.finish()
+
+    def _import(self):
+        self.job.start_stage('read')
         self.logger.info("Lese Datensätze aus Datei...")
-        entries = [entry for entry in self._importer.read(self._input_file) if entry is not None]
+        entries = []
+        for entry in self._importer.read(self._input_file):
+            self.job.check_cancelled()
+            if entry is not None:
+                entries.append(entry)
+                self.job.advance(len(entries))
         num_entries = len(entries)
         self.logger.info("%d Datensätze gelesen", num_entries)
+        references = ["{}-{}".format(contractnumber, invoicenumber)
+                      for date, value, description, contractnumber, invoicenumber
+                      in entries]
+        self.job.start_stage('resolve')
+        self.logger.info("Suche Verträge...")
+        resolved = Contract.resolve_references(set(references),
+                                               session=self.session)
+        self.job.start_stage('analyse', num_entries)
+        self.logger.info("Analysiere %d Datensätze...", num_entries)
         entries_added = 0
-        for i, data in enumerate(entries, start=1):
-            if (not self._update_step or
-               (i % self._update_step) == 0 or
-               i in (0, 1)):
-                self.logger.info("Analysiere Datensatz %d von %d...", i, num_entries)
+        for i, (data, reference) in enumerate(zip(entries, references), start=1):
+            self.job.check_cancelled()
+            self.job.advance(i)
             date, value, description, contractnumber, invoicenumber = data
 
             if not Contract.is_valid_refid(contractnumber):
                 self.logger.debug("Invalid contract refid '%s'" % contractnumber)
                 continue
 
-            contract = Contract.get_by_refid(contractnumber, session=self.session)
-            if not contract:
+            if reference not in resolved:
                 self.logger.debug("Cant find contract for refid '%s'" % contractnumber)
                 continue
 
-            invoices = [invoice for invoice in contract.invoices if invoice.number == invoicenumber]
-            if len(invoices) != 1:
+            contract, invoice = resolved[reference]
+            if invoice is None:
                 self.logger.debug("Cant find invoice '%s-%d'", contractnumber, invoicenumber)
-            invoice = invoices[0]
+                continue
 
+            value = Money.quantize(value)
             already_in_db = False
             for entry in invoice.entries:
                 if (entry.date == date and
@@ -71,11 +100,11 @@ class BookingImporter(threading.Thread, ScopedDatabaseObject):
 
             invoice.add_entry(date, value, description)
             entries_added += 1
+        self.job.check_cancelled()
         if entries_added:
+            self.job.start_stage('write', entries_added)
             self.logger.info('Schreibe %d von %d Datensätzen in Datenbank...', entries_added, num_entries)
             self._session.commit()
             self.logger.info('Fertig! %d von %d Datensätzen hinzugefügt (%d ignoriert)...', entries_added, num_entries, num_entries - entries_added)
         else:
             self.logger.info('Keine Datensätze hinzugefügt.')
-        self._session.expunge_all()
-        self._session.remove()
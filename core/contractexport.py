@@ -18,9 +18,10 @@
 """
 import logging
 logger = logging.getLogger( __name__ )
+import os
 import threading
-from core.database import Contract
-from msmgui.widgets.base import ScopedDatabaseObject
+from core.database import Contract, ScopedDatabaseObject
+from core.lib.job import JobHandle, JobCancelled
 
 def get_contracts( magazine=None, issue=None, date=None, session=None ):
     contracts = None
@@ -42,7 +43,12 @@ def get_contracts( magazine=None, issue=None, date=None, session=None ):
     return contracts
 
 class ContractExporter( threading.Thread, ScopedDatabaseObject ):
-    def __init__( self, output_file, formatter, magazine, issue, date, update_step=25 ):
+    """
+    Exports the contracts with a formatter. The progress is reported to the
+    JobHandle self.job (stages 'load' and 'export'); if the job is cancelled,
+    the incomplete output file is removed.
+    """
+    def __init__( self, output_file, formatter, magazine, issue, date ):
         self.logger = logging.getLogger(__name__)
         threading.Thread.__init__( self )
         ScopedDatabaseObject.__init__( self )
@@ -51,30 +57,42 @@ class ContractExporter( threading.Thread, ScopedDatabaseObject ):
         self._magazine = magazine
         self._issue = issue
         self._date = date
-        self._update_step = update_step
+        self.job = JobHandle()
 
     def run(self):
+        try:
+            self._export()
+        except JobCancelled:
+            if os.path.exists(self._output_file):
+                os.remove(self._output_file)
+            self.logger.info("Export abgebrochen.")
+        finally:
+            self._session.expunge_all()
+            self._session.remove()
+            self.job.finish()
+
+    def _export(self):
+        self.job.start_stage('load')
         self.logger.info("Hole Verträge aus Datenbank...")
         # add settings to the local session
         magazine = self._session.merge( self._magazine ) if self._magazine is not None else None
         issue = self._session.merge( self._issue ) if self._issue is not None else None
         date = self._date
         contracts = get_contracts( magazine=magazine, issue=issue, date=date, session=self.session )
-        num_contracts = len(list(contracts))
+        contracts = contracts.options( *Contract.get_loading_options( 'shipping-export' ) ).all()
+        num_contracts = len(contracts)
         self.logger.info("1 Vetrag geholt!" if num_contracts == 1 else "{} Verträge geholt!".format(num_contracts))
+        self.job.start_stage('export', num_contracts)
         self.logger.info("Exportiere Daten aus 1 Vetrag..." if num_contracts == 1 else "Exportiere Daten aus {} Veträgen...".format(num_contracts))
 
-        for work_done, output in enumerate(self._formatter.write(contracts,
-                                                         self._output_file),
-                                   start=1):
-            if (not self._update_step or
-               (work_done % self._update_step) == 0 or
-               work_done in (0, 1)):
-                self.logger.info("Exportiere %d von %s", work_done,
-                                  num_contracts)
+        work_done = 0
+        records = self._formatter.write(contracts, self._output_file)
+        try:
+            for output in self.job.track(records):
+                work_done += 1
+        finally:
+            records.close()
 
-        self._session.expunge_all()
-        self._session.remove()
         self.logger.info("Fertig! 1 Datensatz exportiert." if work_done == 1
                           else
                           "Fertig! {} Datensätze exportiert.".format(work_done))
@@ -24,17 +24,57 @@ import datetime
 import random
 import string
 import re
+import math
+import bisect
+import threading
+import functools
 import pytz
 import sqlalchemy
-from sqlalchemy import create_engine, func
-from sqlalchemy import Table, Column, Integer, Float, Boolean, String, Date, ForeignKey
-from sqlalchemy.orm import backref, relationship, sessionmaker, scoped_session, Query
+from sqlalchemy import create_engine, event, func, select, and_, or_, true
+from sqlalchemy import Table, Column, Index, Integer, Boolean, String, Date, ForeignKey
+from sqlalchemy.types import TypeDecorator
+from sqlalchemy.orm import backref, relationship, sessionmaker, scoped_session, joinedload, subqueryload, with_polymorphic, validates, Query
 from sqlalchemy.orm.session import object_session
+from sqlalchemy.orm.util import identity_key
+from sqlalchemy.pool import QueuePool
 from sqlalchemy.ext.declarative import declarative_base
+from core.config import Config
 from core.errors import InvoiceError
 from core.lib import iban
 
+class Money( TypeDecorator ):
+    """
+    Amount of money that is stored as integer cents, so that sums can be
+    calculated exactly by the database. The Python side uses decimal.Decimal.
+    """
+    impl = Integer
+    STEP = decimal.Decimal( '.01' )
+    @staticmethod
+    def quantize( value ):
+        """
+        Converts a value to a decimal.Decimal rounded to cents.
+        Args:
+            value:
+                an int, float, string or decimal.Decimal (or None)
+        Returns:
+            a decimal.Decimal with two decimal places (or None)
+        """
+        if value is None:
+            return None
+        if isinstance( value, float ):
+            value = repr( value ) # Decimal( 0.1 ) would be 0.1000000000000000055511151231257827...
+        return decimal.Decimal( value ).quantize( Money.STEP, decimal.ROUND_HALF_EVEN )
+    def process_bind_param( self, value, dialect ):
+        if value is None:
+            return None
+        return int( Money.quantize( value ).scaleb( 2 ) )
+    def process_result_value( self, value, dialect ):
+        if value is None:
+            return None
+        return decimal.Decimal( int( value ) ).scaleb( -2 )
 class DatabaseObject( object ):
+    # Maps profile names to functions that return loader options (see get_loading_options())
+    LOADING_PROFILES = {}
     def _to_dict( self ):
         d = {}
         for c in self.__table__.columns:
@@ -73,10 +113,27 @@ class DatabaseObject( object ):
         q = session.query( cls ).filter_by( id=unique_id )
         return q.first() if q else None
     @classmethod
-    def get_all( cls, session=None ):
+    def get_loading_options( cls, profile ):
+        """
+        Returns the loader options of a named loading profile, i.e. the
+        relationships that will be used by a specific read path and should
+        therefore be loaded eagerly.
+        Args:
+            profile:
+                name of the loading profile (see LOADING_PROFILES)
+        Returns:
+            a tuple of loader options that can be passed to Query.options()
+        """
+        if profile not in cls.LOADING_PROFILES:
+            raise ValueError( "Unknown loading profile '{}' for {}".format( profile, cls.__name__ ) )
+        return cls.LOADING_PROFILES[profile]()
+    @classmethod
+    def get_all( cls, session=None, profile=None ):
         logger.debug( 'get_all called for %r', cls )
         session = cls._mksession( session )
         result = session.query( cls ).order_by( cls.id )
+        if profile is not None:
+            result = result.options( *cls.get_loading_options( profile ) )
         return result
     @property
     def session( self ):
@@ -85,12 +142,24 @@ class DatabaseObject( object ):
         raise NotImplementedError
 Base = declarative_base( cls=DatabaseObject )
 Session = None
+schema_info_table = Table( 'schema_info', Base.metadata,
+    Column( 'version', Integer, nullable=False )
+ )
 
 class Database( object ):
     """
     Database object.
     """
     session_factory = None
+    # SQLite pragmas that can be set in the [Database] section of the config
+    SQLITE_PRAGMAS = ( 'journal_mode', 'synchronous', 'cache_size', 'mmap_size', 'temp_store', 'busy_timeout' )
+    # Named pragma sets, see tools/benchmark_sqlite.py for their throughput
+    SQLITE_PROFILES = {
+        'default': {},
+        'safe': { 'journal_mode': 'WAL', 'synchronous': 'FULL', 'cache_size': '-16000', 'temp_store': 'MEMORY', 'busy_timeout': '10000' },
+        'fast': { 'journal_mode': 'WAL', 'synchronous': 'NORMAL', 'cache_size': '-64000', 'mmap_size': '268435456', 'temp_store': 'MEMORY', 'busy_timeout': '10000' }
+    }
+    SQLITE_PRAGMA_VALUE_PATTERN = re.compile( r'^-?\w+$' )
     def _scopefunc( self ):
         """
         Needed as scopefunc argument for the scoped_session.
@@ -98,21 +167,102 @@ class Database( object ):
             this instance.
         """
         return self
-    def __init__( self, db_uri ):
+    def __init__( self, db_uri, sqlite_pragmas=None, pool_options=None ):
         """
         Initializes the Database.
         Args:
             db_uri:
                 db_uri of the database
+            sqlite_pragmas:
+                dict of pragmas that are set on each new SQLite connection (defaults to the configured ones, see get_sqlite_pragmas())
+            pool_options:
+                dict of connection pool options for SQLite database files (defaults to the configured ones, see get_pool_options())
         """
         global Session
         Database._uri = db_uri
         logger.debug( "Connecting to: %s", db_uri )
-        Database._engine = create_engine( self._uri )
+        url = sqlalchemy.engine.url.make_url( db_uri )
+        engine_options = {}
+        if url.get_backend_name() == 'sqlite':
+            if sqlite_pragmas is None:
+                sqlite_pragmas = Database.get_sqlite_pragmas()
+            if url.database not in ( None, '', ':memory:' ):
+                # Reuse connections instead of reopening the file (and setting
+                # the pragmas again) for each short-lived worker session
+                if pool_options is None:
+                    pool_options = Database.get_pool_options()
+                engine_options = dict( poolclass=QueuePool, connect_args={ 'check_same_thread': False }, **pool_options )
+        Database._engine = create_engine( self._uri, **engine_options )
+        if url.get_backend_name() == 'sqlite' and sqlite_pragmas:
+            event.listen( Database._engine, 'connect', functools.partial( Database._set_sqlite_pragmas, pragmas=sqlite_pragmas ) )
         metadata = Base.metadata
+        is_new_database = Customer.__tablename__ not in sqlalchemy.inspect( self._engine ).get_table_names()
         metadata.create_all( self._engine ) # create tables in database
+        self._upgrade_schema( is_new_database )
         Database.session_factory = sessionmaker( bind=self._engine, autoflush=False )
         Session = Database.get_scoped_session( self._scopefunc )
+    def _upgrade_schema( self, is_new_database=False ):
+        """
+        Brings databases created by older versions of MSM up to date by
+        running all migrations newer than the stored schema version (create_all()
+        only creates missing tables, but no missing columns or indexes).
+        Args:
+            is_new_database:
+                if True, the tables have just been created by create_all(), so no migrations are needed
+        """
+        with self._engine.begin() as connection:
+            version = connection.execute( select( [schema_info_table.c.version] ) ).scalar()
+            if version is None:
+                version = len( MIGRATIONS ) if is_new_database else 0
+                connection.execute( schema_info_table.insert().values( version=version ) )
+        for new_version, migration in enumerate( MIGRATIONS, start=1 ):
+            if version >= new_version:
+                continue
+            logger.info( "Upgrading database schema to version %d (%s)...", new_version, migration.__doc__.strip() )
+            with self._engine.begin() as connection:
+                migration( connection )
+                connection.execute( schema_info_table.update().values( version=new_version ) )
+    @staticmethod
+    def get_sqlite_pragmas( profile=None ):
+        """
+        Reads the SQLite pragmas from the [Database] section of the config.
+        Args:
+            profile:
+                name of the profile in SQLITE_PROFILES to start from (defaults to the configured one)
+        Returns:
+            a dict that maps pragma names to values
+        """
+        if profile is None:
+            profile = Config.get( "Database", "sqlite_profile" )
+        if profile not in Database.SQLITE_PROFILES:
+            raise ValueError( "Unknown SQLite profile '{}'".format( profile ) )
+        pragmas = dict( Database.SQLITE_PROFILES[profile] )
+        for name in Database.SQLITE_PRAGMAS:
+            value = Config.get( "Database", name ).strip()
+            if value:
+                pragmas[name] = value
+        return pragmas
+    @staticmethod
+    def get_pool_options():
+        """
+        Reads the connection pool options from the [Database] section of the config.
+        Returns:
+            a dict of keyword arguments for create_engine()
+        """
+        return { name: int( Config.get( "Database", name ) ) for name in ( 'pool_size', 'max_overflow', 'pool_timeout' ) }
+    @staticmethod
+    def _set_sqlite_pragmas( dbapi_connection, connection_record, pragmas ):
+        """
+        Sets the pragmas on a new SQLite connection (listener for the engine's "connect" event).
+        """
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            if name not in Database.SQLITE_PRAGMAS:
+                raise ValueError( "Unsupported SQLite pragma '{}'".format( name ) )
+            if not Database.SQLITE_PRAGMA_VALUE_PATTERN.match( str( value ) ):
+                raise ValueError( "Invalid value '{}' for SQLite pragma '{}'".format( value, name ) )
+            cursor.execute( "PRAGMA {}={}".format( name, value ) )
+        cursor.close()
     @staticmethod
     def get_scoped_session( scope_function=None ):
         """
@@ -141,6 +291,23 @@ class Database( object ):
         driver = Database._engine.driver
         version = Database._engine.dialect.server_version_info
         return ( name, driver, version )
+class ScopedDatabaseObject( object ):
+    """
+    Mixin for objects that use their own scoped session, e.g. background jobs.
+    """
+    @property
+    def session( self ):
+        return self._session
+    def _scopefunc( self ):
+        """ Needed as scopefunc argument for the scoped_session"""
+        return self
+    def __init__( self, session=None ):
+        if type( session ) is not scoped_session:
+            session = Database.get_scoped_session( self._scopefunc )
+        # Store reference to the session
+        if type( session ) is not scoped_session:
+            raise RuntimeError( "Can't __init__ without a session!" )
+        self._session = session
 class GenderType:
     """
     GenderType Enum.
@@ -223,8 +390,8 @@ class Customer( Base ):
         bankaccount = Bankaccount( iban, bic, bank, owner )
         self.bankaccounts.append( bankaccount )
         return bankaccount
-    def add_contract( self, subscription=None, startdate=None, enddate=None, value=None, paymenttype=PaymentType.Invoice, shippingaddress=None, billingaddress=None, bankaccount=None ):
-        contract = Contract( subscription, startdate, enddate, value, paymenttype, shippingaddress, billingaddress, bankaccount )
+    def add_contract( self, subscription=None, startdate=None, enddate=None, value=None, paymenttype=PaymentType.Invoice, shippingaddress=None, billingaddress=None, bankaccount=None, refid=None ):
+        contract = Contract( subscription, startdate, enddate, value, paymenttype, shippingaddress, billingaddress, bankaccount, refid )
         self.contracts.append( contract )
         return contract
     def is_valid( self ):
@@ -241,6 +408,26 @@ class Customer( Base ):
         if len( self.get_running_contracts( date ) ):
             return True
         return False
+    @staticmethod
+    def running_criterion( date=None ):
+        """
+        SQL criterion that matches all customers with at least one running contract on the given date.
+        Args:
+            date:
+                the date to check (defaults to today)
+        Returns:
+            a SQL expression that can be passed to Query.filter()
+        """
+        # Customer.contracts is a backref and does not exist before the mappers are configured
+        return Customer.id.in_( select( [Contract.customer_id] ).where( Contract.running_criterion( date ) ) )
+    @staticmethod
+    def get_running_customer_ids_by_date( date=None, session=None ):
+        """
+        Returns the set of ids of all customers with at least one running contract on the given date.
+        """
+        session = Customer._mksession( session )
+        q = session.query( Customer.id ).filter( Customer.running_criterion( date ) )
+        return set( customer_id for customer_id, in q )
 
 class Address( Base ):
     __tablename__ = 'addresses'
@@ -311,6 +498,43 @@ class Address( Base ):
                 mailing_address.append( pytz.country_names[self.countrycode] )
         return mailing_address
 
+class IssueCalendar( object ):
+    """
+    Sorted index of the issue dates of a magazine. Answers range queries
+    via bisection instead of scanning all issues.
+    """
+    def __init__( self, issues ):
+        """
+        Initializes the IssueCalendar.
+        Args:
+            issues:
+                iterable of Issue objects (issues without date are ignored)
+        """
+        self._issues = sorted( ( issue for issue in issues if issue.date is not None ), key=lambda issue: issue.date )
+        self._dates = [issue.date for issue in self._issues]
+    def _range( self, startdate=None, enddate=None ):
+        lo = bisect.bisect_left( self._dates, startdate ) if startdate is not None else 0
+        hi = bisect.bisect_right( self._dates, enddate ) if enddate is not None else len( self._dates )
+        return lo, max( lo, hi )
+    def get_issues( self, startdate=None, enddate=None, limit=None ):
+        """
+        Returns the issues between startdate and enddate (both inclusive),
+        ordered by date. If limit is set, only the first limit issues are
+        returned.
+        """
+        lo, hi = self._range( startdate, enddate )
+        if limit is not None:
+            hi = min( hi, lo + max( limit, 0 ) )
+        return self._issues[lo:hi]
+    def count_issues( self, startdate=None, enddate=None, limit=None ):
+        """
+        Like get_issues(), but only returns the number of issues.
+        """
+        lo, hi = self._range( startdate, enddate )
+        count = hi - lo
+        return count if limit is None else min( count, max( limit, 0 ) )
+    def __len__( self ):
+        return len( self._issues )
 class Magazine( Base ):
     __tablename__ = 'magazines'
     id = Column( Integer, primary_key=True )
@@ -335,31 +559,36 @@ class Magazine( Base ):
         if not self.name or not self.issues_per_year:
             return False
         return True
+    @property
+    def issue_calendar( self ):
+        """Cached IssueCalendar of this magazine (see invalidate_issue_calendar())."""
+        calendar = getattr( self, '_issue_calendar', None )
+        if calendar is None:
+            calendar = IssueCalendar( self.issues )
+            self._issue_calendar = calendar
+        return calendar
+    def invalidate_issue_calendar( self ):
+        """Discards the cached IssueCalendar, it will be rebuilt on next access."""
+        self._issue_calendar = None
     def get_issues( self, issue_id=None, startdate=None, enddate=None, limit=None ):
-        result = []
-        for issue in self.issues:
-            if issue_id is not None and issue.id != issue_id: continue
-            if startdate is not None and issue.date < startdate: continue # FIXME: use shipment_date instead
-            if enddate is not None and issue.date > enddate: continue # FIXME: use shipment_date instead
-            result.append( issue )
-        result = result[:limit] if limit is not None else result
-        return result
-    def get_contracts( self, date=None, session=None ):
+        # FIXME: use shipment_date instead of date
+        if issue_id is not None:
+            return [issue for issue in self.issue_calendar.get_issues( startdate, enddate ) if issue.id == issue_id][:limit]
+        return self.issue_calendar.get_issues( startdate, enddate, limit )
+    def count_issues( self, startdate=None, enddate=None, limit=None ):
+        return self.issue_calendar.count_issues( startdate, enddate, limit )
+    def get_contracts( self, date=None, session=None, issue_date=False ):
         if date is not None:
-            q = Contract.get_running_contracts_by_date( date=date, session=session )
+            q = Contract.get_running_contracts_by_date( date=date, session=session, issue_date=issue_date )
         else:
             q = Contract.get_all( session=session )
-        if isinstance( q, Query ):
-            return q.filter( Contract.subscription.has( magazine_id=self.id ) )
-        else:
-            logger.debug( "%r is not a Query (Possible cause: No matching contract for given criterion)", q )
-            return []
+        return q.filter( Contract.subscription.has( magazine_id=self.id ) )
 class Subscription( Base ):
     __tablename__ = 'subscriptions'
     id = Column( Integer, primary_key=True )
     magazine_id = Column( None, ForeignKey( 'magazines.id' ) )
     name = Column( String, nullable=False )
-    value = Column( Float( 2 ), nullable=False )
+    value = Column( Money, nullable=False )
     value_changeable = Column( Boolean, nullable=False, default=False )
     number_of_issues = Column( Integer, nullable=True, default=None )
     magazine = relationship( Magazine, backref=backref( 'subscriptions', order_by=id, cascade="all, delete, delete-orphan" ) )
@@ -372,12 +601,16 @@ class Subscription( Base ):
         self.value = value
         self.value_changeable = value_changeable
         self.number_of_issues = number_of_issues
+    @validates( 'value' )
+    def _validate_value( self, key, value ):
+        return Money.quantize( value )
     def is_valid( self ):
         if not self.magazine or not self.name:
             return False
         return True
 class Issue( Base ):
     __tablename__ = 'issues'
+    __table_args__ = ( Index( 'ix_issues_magazine_id_date', 'magazine_id', 'date' ), )
     id = Column( Integer, primary_key=True )
     magazine_id = Column( None, ForeignKey( 'magazines.id' ) )
     year = Column( Integer, nullable=False )
@@ -395,7 +628,30 @@ class Issue( Base ):
     def get_contracts( self, session=None ):
         if not self.date:
             raise ValueError( 'Need to set a date!' )
-        return self.magazine.get_contracts( date=self.date, session=session )
+        return self.magazine.get_contracts( date=self.date, session=session, issue_date=True )
+@event.listens_for( Issue.magazine, 'set' )
+def _issue_magazine_changed( issue, magazine, oldmagazine, initiator ):
+    # Also fired if an issue is appended to or removed from Magazine.issues
+    for obj in ( magazine, oldmagazine ):
+        if isinstance( obj, Magazine ):
+            obj.invalidate_issue_calendar()
+@event.listens_for( Magazine, 'expire' )
+@event.listens_for( Magazine, 'refresh' )
+def _magazine_reloaded( magazine, *args ):
+    if magazine is not None: # the instance may already have been garbage collected
+        magazine.invalidate_issue_calendar()
+@event.listens_for( Issue.date, 'set' )
+def _issue_date_changed( issue, value, oldvalue, initiator ):
+    # Issues loaded by Magazine.issues or a query don't have their magazine
+    # loaded, so look it up in the identity map (without a lazy load). A
+    # magazine that isn't loaded in the session has no cached calendar.
+    magazine = issue.__dict__.get( 'magazine' )
+    if magazine is None and issue.magazine_id is not None:
+        session = object_session( issue )
+        if session is not None:
+            magazine = session.identity_map.get( identity_key( Magazine, issue.magazine_id ) )
+    if magazine is not None:
+        magazine.invalidate_issue_calendar()
 class Bankaccount( Base ):
     __tablename__ = 'bankaccounts'
     id = Column( Integer, primary_key=True )
@@ -437,17 +693,24 @@ class Bankaccount( Base ):
             return False
         else:
             return True
+def _get_refid_checksum_weights( size, checksum_size ):
+    """Calculates the (pi-derived) weights used by Contract.get_refid_checksum()."""
+    weights = []
+    for i in range( 1, checksum_size + 1 ):
+        weight = tuple( map( int, str( math.floor( math.pi * pow( 10, size * i ) ) ) ) )[-size:]
+        weights.append( weight )
+    return tuple( weights )
 class Contract( Base ):
     __tablename__ = 'contracts'
     id = Column( Integer, primary_key=True )
     refid = Column( String( 8 ), unique=True, nullable=False )
-    value = Column( Float( 2 ), nullable=False )
-    startdate = Column( Date, nullable=False )
-    enddate = Column( Date )
+    value = Column( Money, nullable=False )
+    startdate = Column( Date, nullable=False, index=True )
+    enddate = Column( Date, index=True )
     paymenttype = Column( Integer )
     # Foreign Keys
-    customer_id = Column( None, ForeignKey( 'customers.id' ) )
-    subscription_id = Column( None, ForeignKey( 'subscriptions.id' ) )
+    customer_id = Column( None, ForeignKey( 'customers.id' ), index=True )
+    subscription_id = Column( None, ForeignKey( 'subscriptions.id' ), index=True )
     bankaccount_id = Column( None, ForeignKey( 'bankaccounts.id' ) )
     shippingaddress_id = Column( None, ForeignKey( 'addresses.id' ) )
     billingaddress_id = Column( None, ForeignKey( 'addresses.id' ) )
@@ -459,16 +722,18 @@ class Contract( Base ):
     billingaddress = relationship( Address, primaryjoin=( billingaddress_id == Address.id ) )
     @property
     def price_per_issue( self ):
-        val = decimal.Decimal( self.value )
-        num = decimal.Decimal( self.subscription.total_number_of_issues )
-        price = val / num
-        step = decimal.Decimal( '.01' )
-        price_rounded = price.quantize( step, decimal.ROUND_HALF_EVEN )
-        return float( price_rounded )
+        return Money.quantize( self.value / self.subscription.total_number_of_issues )
+    @validates( 'value' )
+    def _validate_value( self, key, value ):
+        return Money.quantize( value )
     REFID_SIZE = 6
     REFID_CHECKSUM_SIZE = 2
     REFID_CHARS = string.ascii_uppercase.replace( "O", "" ).replace( "I", "" ) + string.digits.replace( "0", "" )
-    def __init__( self, subscription, startdate=None, enddate=None, value=None, paymenttype=PaymentType.Invoice, shippingaddress=None, billingaddress=None, bankaccount=None ):
+    REFID_CHECKSUM_WEIGHTS = _get_refid_checksum_weights( REFID_SIZE, REFID_CHECKSUM_SIZE )
+    # Matches (overlapping) refid candidates, optionally followed by an invoice number (e.g. "ABCDEF12-3")
+    REFID_REFERENCE_PATTERN = re.compile( r'(?=([0-9A-Z]{%d})(?:-(\d+))?)' % ( REFID_SIZE + REFID_CHECKSUM_SIZE ) )
+    REFID_QUERY_CHUNK_SIZE = 500 # SQLite doesn't allow more than 999 variables per statement
+    def __init__( self, subscription, startdate=None, enddate=None, value=None, paymenttype=PaymentType.Invoice, shippingaddress=None, billingaddress=None, bankaccount=None, refid=None ):
         self.subscription = subscription
         self.startdate = startdate if startdate else datetime.date.today()
         self.enddate = enddate
@@ -477,17 +742,45 @@ class Contract( Base ):
         self.shippingaddress = shippingaddress
         self.billingaddress = billingaddress
         self.bankaccount = bankaccount
-        self.refid = Contract.generate_refid()
+        self.refid = refid if refid else Contract.generate_refid()
     @staticmethod
-    def get_running_contracts_by_date( date=datetime.date.today(), session=None ):
-        if session is None:
-            session = Session
-        else:
-            if not isinstance( session, type( Session ) ):
-                raise TypeError( "Expected {}, not {}".format( type( Session ).__name__ , type( session ).__name__ ) )
-
-        q = session().query( Contract ).filter( Contract.startdate <= date, ( ( Contract.enddate > date ) | ( Contract.enddate == None ) ) )
-        return q if q else []
+    def running_criterion( date=None, issue_date=False ):
+        """
+        SQL criterion that matches all contracts running on the given date.
+        This is the SQL equivalent of Contract.is_running(), i.e. contracts
+        with a limited number_of_issues are no longer considered to be
+        running as soon as all issues have been received.
+        Args:
+            date:
+                the date to check (defaults to today)
+            issue_date:
+                date is the date of an issue that is about to be shipped, so
+                only the issues before it count as received (otherwise a
+                contract would miss its last issue)
+        Returns:
+            a SQL expression that can be passed to Query.filter()
+        """
+        if date is None:
+            date = datetime.date.today()
+        subscriptions = Subscription.__table__
+        issues = Issue.__table__
+        contracts = Contract.__table__
+        number_of_issues = select( [subscriptions.c.number_of_issues] ).where( subscriptions.c.id == contracts.c.subscription_id ).correlate( contracts ).as_scalar()
+        issues_received = select( [func.count( issues.c.id )] ).select_from( issues.join( subscriptions, issues.c.magazine_id == subscriptions.c.magazine_id ) )
+        issues_received = issues_received.where( and_( subscriptions.c.id == contracts.c.subscription_id,
+                                                       issues.c.date >= contracts.c.startdate,
+                                                       issues.c.date < date if issue_date else issues.c.date <= date ) ).correlate( contracts ).as_scalar()
+        return and_( Contract.startdate <= date,
+                     or_( Contract.enddate > date, Contract.enddate == None ),
+                     Contract.subscription_id != None,
+                     or_( func.coalesce( number_of_issues, 0 ) == 0, number_of_issues > issues_received ) )
+    @staticmethod
+    def get_running_contracts_by_date( date=None, session=None, issue_date=False ):
+        """
+        Returns a Query for all contracts running on the given date (see Contract.running_criterion()).
+        """
+        session = Contract._mksession( session )
+        return session.query( Contract ).filter( Contract.running_criterion( date, issue_date ) )
     @staticmethod
     def get_by_refid( contract_refid, session=None ):
         if session is None:
@@ -498,14 +791,62 @@ class Contract( Base ):
         q = session().query( Contract ).filter_by( refid=contract_refid )
         return q.first() if q else None
     @staticmethod
-    def scan_refid_for_contract( reference ):
-        for needle in re.findall( "[0-9A-Z]{%d}" % ( Contract.REFID_SIZE + Contract.REFID_CHECKSUM_SIZE ), reference ):
-            if Contract.isValidRefId( needle ):
-                contract = Contract.get_by_refid( needle )
-                if contract:
-                    return contract
+    def scan_refid_for_contract( reference, session=None ):
+        result = Contract.resolve_references( [reference], session=session )
+        if reference in result:
+            contract, invoice = result[reference]
+            return contract
         return None
     @staticmethod
+    def resolve_references( references, session=None ):
+        """
+        Resolves many free-text payment references (e.g. descriptions from bank
+        statements) at once. Refid candidates are extracted and validated by
+        their checksum, then all valid candidates are looked up together.
+        Args:
+            references:
+                iterable of reference strings
+            session:
+                the session to use
+        Returns:
+            a dict that maps each reference for which a contract was found to
+            a 2-value-tuple containing the contract and the referenced invoice
+            (or None, if the reference contains no matching invoice number)
+        """
+        session = Contract._mksession( session )
+        valid_refids = {}
+        candidates = {}
+        for reference in references:
+            if reference in candidates:
+                continue
+            found = []
+            for refid, invoicenumber in Contract.REFID_REFERENCE_PATTERN.findall( reference.upper() ):
+                if refid not in valid_refids:
+                    valid_refids[refid] = ( refid[Contract.REFID_SIZE:] == Contract.get_refid_checksum( refid ) )
+                if valid_refids[refid]:
+                    found.append( ( refid, int( invoicenumber ) if invoicenumber else None ) )
+            candidates[reference] = found
+        refids = sorted( refid for refid, is_valid in valid_refids.items() if is_valid )
+        contracts = {}
+        for i in range( 0, len( refids ), Contract.REFID_QUERY_CHUNK_SIZE ):
+            chunk = refids[i:i + Contract.REFID_QUERY_CHUNK_SIZE]
+            q = session.query( Contract ).options( subqueryload( Contract.invoices ) ).filter( Contract.refid.in_( chunk ) )
+            contracts.update( ( contract.refid, contract ) for contract in q )
+        result = {}
+        for reference, found in candidates.items():
+            for refid, invoicenumber in found:
+                if refid in contracts:
+                    contract = contracts[refid]
+                    invoice = None
+                    if invoicenumber is not None:
+                        for contract_invoice in contract.invoices:
+                            if contract_invoice.number == invoicenumber:
+                                invoice = contract_invoice
+                                break
+                    result[reference] = ( contract, invoice )
+                    break
+        return result
+    @staticmethod
     def is_valid_refid( refid ):
         if not re.match( '^[A-Z0-9]{%d}$' % ( Contract.REFID_SIZE + Contract.REFID_CHECKSUM_SIZE ), refid ):
             return False
@@ -517,25 +858,25 @@ class Contract( Base ):
             return False
     @staticmethod
     def get_refid_checksum( refid ):
-        import math
         refid = refid[0:Contract.REFID_SIZE]
+        num_chars = len( Contract.REFID_CHARS )
         checksum = []
-        for i in range( 1, Contract.REFID_CHECKSUM_SIZE + 1 ):
-            weight = list( map( int, str( math.floor( math.pi * pow( 10, Contract.REFID_SIZE * i ) ) ) ) )[-Contract.REFID_SIZE:]
-            charsum = 0
-            for i, char in enumerate( refid ):
-                charsum += ord( char ) * weight[i]
-            checksum.append( charsum % len( Contract.REFID_CHARS ) )
-        return ''.join( Contract.REFID_CHARS[c] for c in checksum )
+        for weight in Contract.REFID_CHECKSUM_WEIGHTS:
+            charsum = sum( ord( char ) * w for char, w in zip( refid, weight ) )
+            checksum.append( Contract.REFID_CHARS[charsum % num_chars] )
+        return ''.join( checksum )
+    @staticmethod
+    def _generate_random_refid():
+        refid = ''.join( random.choice( Contract.REFID_CHARS ) for x in range( Contract.REFID_SIZE ) )
+        return refid + Contract.get_refid_checksum( refid )
     @staticmethod
     def generate_refid():
-        def generatorfunc( size, chars ):
-            refid = ''.join( random.choice( chars ) for x in range( size ) )
-            refid += Contract.get_refid_checksum( refid )
-            return refid
-        refid = generatorfunc( Contract.REFID_SIZE, Contract.REFID_CHARS )
+        """
+        Generates a single unused refid. Use a RefidAllocator if you need many of them.
+        """
+        refid = Contract._generate_random_refid()
         while Session().query( Contract ).filter( Contract.refid == refid ).count():
-            refid = generatorfunc( Contract.REFID_SIZE, Contract.REFID_CHARS )
+            refid = Contract._generate_random_refid()
         return refid
     def is_valid( self ):
         if not self.customer or not self.subscription or not self.billingaddress or not self.shippingaddress:
@@ -555,10 +896,16 @@ class Contract( Base ):
                 if self.subscription:
                     if not self.subscription.number_of_issues:
                         return True
-                    elif self.subscription.number_of_issues > len( self.get_issues_received( startdate=self.startdate, enddate=date ) ):
+                    elif self.subscription.number_of_issues > self.subscription.magazine.count_issues( startdate=self.startdate, enddate=date ):
                         return True
         return False
-    def get_issues_received( self, startdate=None, enddate=None ):
+    def _get_issues_received_range( self, startdate=None, enddate=None ):
+        """
+        Clamps the given period to the contract period and calculates how
+        many issues the customer can still receive in it.
+        Returns:
+            a 3-value-tuple containing startdate, enddate and limit in that order
+        """
         if self.startdate:
             startdate = self.startdate if not startdate or self.startdate > startdate else startdate
         if self.enddate:
@@ -566,12 +913,16 @@ class Contract( Base ):
         if self.subscription.number_of_issues:
             limit = self.subscription.number_of_issues
             if startdate > self.startdate:
-                issues_received_before = len( self.get_issues_received( enddate=( startdate - datetime.timedelta( days=1 ) ) ) )
-                limit -= issues_received_before
+                limit -= self.subscription.magazine.count_issues( startdate=self.startdate, enddate=( startdate - datetime.timedelta( days=1 ) ), limit=limit )
         else:
             limit = None
-        issues = self.subscription.magazine.get_issues( startdate=startdate, enddate=enddate, limit=limit )
-        return issues
+        return startdate, enddate, limit
+    def get_issues_received( self, startdate=None, enddate=None ):
+        startdate, enddate, limit = self._get_issues_received_range( startdate, enddate )
+        return self.subscription.magazine.get_issues( startdate=startdate, enddate=enddate, limit=limit )
+    def count_issues_received( self, startdate=None, enddate=None ):
+        startdate, enddate, limit = self._get_issues_received_range( startdate, enddate )
+        return self.subscription.magazine.count_issues( startdate=startdate, enddate=enddate, limit=limit )
     @property
     def invoices_open( self ):
         invoices = []
@@ -591,19 +942,46 @@ class Contract( Base ):
             maturity_date = date + maturity
         elif not isinstance( maturity_date, datetime.date ):
             raise TypeError( "maturity_date has to be of type datetime.date, not {}".format( type( maturity_date ).__name__ ) )
-        if not isinstance( accounting_enddate, datetime.date ):
-            raise TypeError( "accounting_enddate has to be of type datetime.date, not {}".format( type( maturity_date ).__name__ ) )
         if len( self.invoices ) > 0:
-            previous_invoice = self.invoices[-1]
+            previous_enddate = self.invoices[-1].accounting_enddate
         else:
-            previous_invoice = None
+            previous_enddate = None
+        accounting_startdate, accounting_enddate = self.get_accounting_period( accounting_enddate, accounting_startdate, previous_enddate )
+        # Now we can continue as everything should be fine now
+        invoice = Invoice( date=date, maturity_date=maturity_date, accounting_startdate=accounting_startdate, accounting_enddate=accounting_enddate )
+        self.invoices.append( invoice )
+        invoice.add_automatic_entries()
+        if invoice.value == 0:
+            self.invoices.remove( invoice )
+            if self.session:
+                self.session.expunge( invoice )
+            raise InvoiceError( "value is zero" )
+        invoice.assign_number()
+        return invoice
+    def get_accounting_period( self, accounting_enddate, accounting_startdate=None, previous_enddate=None ):
+        """
+        Determines the accounting period of the next invoice of this contract.
+        Args:
+            accounting_enddate:
+                the requested end of the accounting period
+            accounting_startdate:
+                the requested start of the accounting period (defaults to the day after previous_enddate or the contract's startdate)
+            previous_enddate:
+                the end of the accounting period of the previous invoice (if any)
+        Returns:
+            a 2-value-tuple containing startdate and enddate of the accounting period in that order
+        Raises:
+            InvoiceError if there is nothing to account for
+        """
+        if not isinstance( accounting_enddate, datetime.date ):
+            raise TypeError( "accounting_enddate has to be of type datetime.date, not {}".format( type( accounting_enddate ).__name__ ) )
         if not isinstance( accounting_startdate, datetime.date ):
-            if previous_invoice is not None:
-                accounting_startdate = previous_invoice.accounting_enddate + datetime.timedelta( days=1 ) # assume this invoice's accounting period starts just after the previous invoice's accounting period ended
+            if previous_enddate is not None:
+                accounting_startdate = previous_enddate + datetime.timedelta( days=1 ) # assume this invoice's accounting period starts just after the previous invoice's accounting period ended
             else:
                 accounting_startdate = self.startdate # assume this invoice's accounting period starts on the contract's startdate
         else:
-            if previous_invoice is not None and accounting_startdate <= previous_invoice.accounting_enddate: # we don't want that our customers have to pay twice
+            if previous_enddate is not None and accounting_startdate <= previous_enddate: # we don't want that our customers have to pay twice
                 raise InvoiceError( "accounting period overlaps with the accounting period of the last invoice" )
             elif accounting_startdate < self.startdate:
                 raise InvoiceError( "accounting period starts before the contract ({} < {})".format( accounting_startdate.strftime("%x"), self.startdate.strftime("%x") ) )
@@ -612,21 +990,62 @@ class Contract( Base ):
             accounting_enddate = self.enddate
         if accounting_startdate >= accounting_enddate:
             raise InvoiceError( "accounting_startdate has to be earlier than accountig_enddate ({} >= {})".format( accounting_startdate.strftime("%x"), accounting_enddate.strftime("%x") ) )
-        # Now we can continue as everything should be fine now
-        invoice = Invoice( date=date, maturity_date=maturity_date, accounting_startdate=accounting_startdate, accounting_enddate=accounting_enddate )
-        self.invoices.append( invoice )
-        invoice.add_automatic_entries()
-        if invoice.value == 0:
-            self.invoices.remove( invoice )
-            if self.session:
-                self.session.expunge( invoice )
-            raise InvoiceError( "value is zero" )
-        invoice.assign_number()
-        return invoice
+        return accounting_startdate, accounting_enddate
     def _generateContractRefNumber( self ):
         q = Session.query( func.count( Contract.id ) ).filter( Contract.customer_id == self.customer_id, Contract.id <= self.id ).order_by( Contract.id )
         return q.first()[0]
 
+class RefidAllocator( object ):
+    """
+    Allocates unused contract refids in bulk. All refids that are already in
+    use are loaded once, so reserving refids does not need any further
+    database queries.
+    The reservations are only known to this allocator, not to the database,
+    so this assumes a single writer: If another process (e.g. the GUI next to
+    tools/xmlimporter.py) adds contracts in the meantime, it may use one of
+    the reserved refids and the commit fails with an IntegrityError on the
+    unique refid column. In that case, roll back and retry with a new
+    allocator (see tools/xmlimporter.py).
+    Usage:
+        allocator = RefidAllocator( session )
+        refids = allocator.reserve( 1000 )
+    """
+    def __init__( self, session=None ):
+        self._session = DatabaseObject._mksession( session )
+        self._used_refids = None
+        self._lock = threading.Lock()
+    def load( self ):
+        """
+        (Re)loads the set of refids that are already in use from the database.
+        """
+        with self._lock:
+            self._used_refids = set( refid for refid, in self._session.query( Contract.refid ) )
+    def reserve( self, num=1 ):
+        """
+        Reserves unused refids.
+        Args:
+            num:
+                the number of refids to reserve
+        Returns:
+            a list of num refids that are neither used in the database nor reserved by this allocator
+        """
+        if self._used_refids is None:
+            self.load()
+        refids = []
+        with self._lock:
+            while len( refids ) < num:
+                refid = Contract._generate_random_refid()
+                if refid not in self._used_refids:
+                    self._used_refids.add( refid )
+                    refids.append( refid )
+        return refids
+    def release( self, refids ):
+        """
+        Releases refids that have been reserved but were not used.
+        """
+        with self._lock:
+            self._used_refids.difference_update( refids )
+
 class Letter( Base ):
     __tablename__ = 'letters'
     id = Column( Integer, primary_key=True )
@@ -673,8 +1092,8 @@ class LetterCollection( Base ):
             return "Unnamed Lettercollection ({})".format( self.creation_date.strftime("%x") )
 
 letter_association_table = Table( 'letter_association', Base.metadata,
-    Column( 'letter_id', Integer, ForeignKey( 'letters.id' ) ),
-    Column( 'letterpart_id', Integer, ForeignKey( 'letterparts.id' ) )
+    Column( 'letter_id', Integer, ForeignKey( 'letters.id' ), index=True ),
+    Column( 'letterpart_id', Integer, ForeignKey( 'letterparts.id' ), index=True )
  )
 
 class LetterPart( Base ):
@@ -700,15 +1119,15 @@ class Note( LetterPart ):
         self.template = template
 
 bkentry_association_table = Table( 'bkentry_association', Base.metadata,
-    Column( 'invoice_id', Integer, ForeignKey( 'invoices.id' ) ),
-    Column( 'bookkeepingentry_id', Integer, ForeignKey( 'bookkeeping_entries.id' ) )
+    Column( 'invoice_id', Integer, ForeignKey( 'invoices.id' ), index=True ),
+    Column( 'bookkeepingentry_id', Integer, ForeignKey( 'bookkeeping_entries.id' ), index=True )
  )
 class BookkeepingEntry( Base ):
     __tablename__ = 'bookkeeping_entries'
     id = Column( Integer, primary_key=True )
-    contract_id = Column( None, ForeignKey( 'contracts.id' ) )
+    contract_id = Column( None, ForeignKey( 'contracts.id' ), index=True )
     date = Column( Date, nullable=False )
-    value = Column( Float( 2 ), nullable=False )
+    value = Column( Money, nullable=False )
     description = Column( String )
     contract = relationship( Contract, backref=backref( 'bookkeeping_entries', order_by=date ) )
     def __init__( self, date, value, description, customer_id=None, contract_id=None ):
@@ -719,6 +1138,9 @@ class BookkeepingEntry( Base ):
             self.customer_id = customer_id
         if contract_id:
             self.contract_id = contract_id
+    @validates( 'value' )
+    def _validate_value( self, key, value ):
+        return Money.quantize( value )
     def is_valid( self ):
         if not self.customer or not self.contract or not self.date or not self.value or not self.description:
             return False
@@ -729,68 +1151,130 @@ class Invoice( LetterPart ):
         'polymorphic_identity':'invoice',
     }
     id = Column( Integer, ForeignKey( 'letterparts.id' ), primary_key=True )
-    contract_id = Column( None, ForeignKey( 'contracts.id' ) )
+    contract_id = Column( None, ForeignKey( 'contracts.id' ), index=True )
     accounting_startdate = Column( Date, nullable=False )
     accounting_enddate = Column( Date, nullable=False )
     date = Column( Date, nullable=False )
     maturity_date = Column( Date, nullable=False )
     number = Column( Integer )
+    # Balance of this invoice, kept up to date when entries are added or changed
+    value = Column( Money, nullable=False, default=0 )
+    value_paid = Column( Money, nullable=False, default=0 )
+    value_left = Column( Money, nullable=False, default=0, index=True )
     contract = relationship( Contract, backref=backref( 'invoices', order_by=date, cascade="all, delete" ) )
     entries = relationship( BookkeepingEntry, secondary=bkentry_association_table, backref="invoices", cascade="all, delete" )
-    @property
-    def value( self ):
-        value = 0
-        for entry in self.entries:
-            if entry.value > 0:
-                value += entry.value
-        return value
-    @property
-    def value_paid( self ):
-        value = 0
-        for entry in self.entries:
-            if entry.value < 0:
-                value += entry.value
-        return value
-    @property
-    def value_left( self ):
-        value = 0
-        for entry in self.entries:
-            value += entry.value
-        return value
+    def __init__( self, date, maturity_date, accounting_startdate, accounting_enddate, number=None ):
+        self.date = date
+        self.maturity_date = maturity_date
+        self.accounting_startdate = accounting_startdate
+        self.accounting_enddate = accounting_enddate
+        self.number = number
+        self.value = 0
+        self.value_paid = 0
+        self.value_left = 0
+    @validates( 'value', 'value_paid', 'value_left' )
+    def _validate_value( self, key, value ):
+        return Money.quantize( value )
+    def _apply_entry_value( self, value, sign=1 ):
+        """Adds (sign=1) or removes (sign=-1) the value of an entry to/from the stored balance."""
+        value = Money.quantize( value )
+        if not value:
+            return
+        delta = value * sign
+        self.value_left = ( self.value_left or 0 ) + delta
+        if value > 0:
+            self.value = ( self.value or 0 ) + delta
+        else:
+            self.value_paid = ( self.value_paid or 0 ) + delta
+    def update_balance( self, exclude=() ):
+        """
+        Recalculates value, value_paid and value_left from the entries of this invoice.
+        Args:
+            exclude:
+                entries that are ignored (e.g. because they are about to be deleted)
+        """
+        entries = [entry for entry in self.entries if entry not in exclude]
+        self.value = sum( entry.value for entry in entries if entry.value > 0 )
+        self.value_paid = sum( entry.value for entry in entries if entry.value < 0 )
+        self.value_left = sum( entry.value for entry in entries )
+    @staticmethod
+    def get_balance_update():
+        """
+        Returns an UPDATE statement that recalculates the stored balance of all invoices from their bookkeeping entries.
+        """
+        invoices = Invoice.__table__
+        entries = BookkeepingEntry.__table__
+        def entry_sum( criterion ):
+            q = select( [func.coalesce( func.sum( entries.c.value ), 0 )] )
+            q = q.select_from( entries.join( bkentry_association_table, bkentry_association_table.c.bookkeepingentry_id == entries.c.id ) )
+            return q.where( and_( bkentry_association_table.c.invoice_id == invoices.c.id, criterion ) ).as_scalar()
+        return invoices.update().values( value=entry_sum( entries.c.value > 0 ),
+                                         value_paid=entry_sum( entries.c.value < 0 ),
+                                         value_left=entry_sum( true() ) )
+    @staticmethod
+    def get_open_invoices( session=None ):
+        """Returns a Query for all invoices that have not been paid completely."""
+        session = Invoice._mksession( session )
+        return session.query( Invoice ).filter( Invoice.value_left > 0 )
+    @staticmethod
+    def get_totals( query=None, session=None ):
+        """
+        Sums up the balances of several invoices with a single aggregate query.
+        Args:
+            query:
+                a Query for invoices without loader options, e.g. from get_open_invoices() (defaults to all invoices)
+            session:
+                the session to use if no query is given
+        Returns:
+            a 3-value-tuple of decimal.Decimal containing the sums of value, value_paid and value_left in that order
+        """
+        if query is None:
+            query = Invoice._mksession( session ).query( Invoice )
+        totals = query.with_entities( func.coalesce( func.sum( Invoice.value ), 0 ),
+                                      func.coalesce( func.sum( Invoice.value_paid ), 0 ),
+                                      func.coalesce( func.sum( Invoice.value_left ), 0 ) ).one()
+        return tuple( Money.quantize( total ) for total in totals )
     def add_entry( self, date, value, desc ):
         entry = BookkeepingEntry( date, value, desc )
         self.entries.append( entry )
         return entry
     def add_automatic_entries( self ):
+        for date, value, desc in Invoice.get_automatic_entries( self.contract, self.accounting_startdate, self.accounting_enddate ):
+            self.add_entry( date, value, desc )
+    @staticmethod
+    def get_automatic_entries( contract, accounting_startdate, accounting_enddate ):
+        """
+        Calculates the entries of an invoice for the issues that a contract received in an accounting period (one entry per year).
+        Returns:
+            a list of 3-value-tuples containing date, value and description in that order
+        """
         dates = []
-        if self.accounting_startdate.year == self.accounting_enddate.year:
-            dates.append( ( self.accounting_startdate, self.accounting_enddate ) )
+        if accounting_startdate.year == accounting_enddate.year:
+            dates.append( ( accounting_startdate, accounting_enddate ) )
         else:
-            year = self.accounting_startdate.year
-            while year <= self.accounting_enddate.year:
+            year = accounting_startdate.year
+            while year <= accounting_enddate.year:
                 startdate = datetime.date( year, 1, 1 )
-                if self.accounting_startdate >= startdate:
-                    startdate = self.accounting_startdate
+                if accounting_startdate >= startdate:
+                    startdate = accounting_startdate
                 enddate = datetime.date( year, 12, 31 )
-                if self.accounting_enddate < enddate:
-                    enddate = self.accounting_enddate
+                if accounting_enddate < enddate:
+                    enddate = accounting_enddate
                 dates.append( ( startdate, enddate ) )
                 year += 1
-        step = decimal.Decimal( '.01' )
+        entries = []
         for startdate, enddate in dates:
-            num_issues_received = len( self.contract.get_issues_received( startdate=startdate, enddate=enddate ) )
-            num_issues_total = self.contract.subscription.magazine.issues_per_year
+            num_issues_received = contract.count_issues_received( startdate=startdate, enddate=enddate )
+            num_issues_total = contract.subscription.magazine.issues_per_year
             if num_issues_received == num_issues_total:
-                value_unrounded = decimal.Decimal( self.contract.value )
+                value = contract.value
             else:
-                price_per_issue = decimal.Decimal( self.contract.price_per_issue )
-                num_issues = decimal.Decimal( num_issues_received )
-                value_unrounded = price_per_issue * num_issues
-            value = float( value_unrounded.quantize( step, decimal.ROUND_HALF_EVEN ) )
+                value = contract.price_per_issue * num_issues_received
             if value == 0:
                 continue
-            desc = "{}, {}, {} Ausgaben ({} bis {})".format( self.contract.subscription.magazine. name, self.contract.subscription.name, num_issues_received, startdate.strftime("%x"), enddate.strftime("%x") )
-            self.add_entry( enddate, value, desc )
+            desc = "{}, {}, {} Ausgaben ({} bis {})".format( contract.subscription.magazine.name, contract.subscription.name, num_issues_received, startdate.strftime("%x"), enddate.strftime("%x") )
+            entries.append( ( enddate, value, desc ) )
+        return entries
     def assign_number( self ):
         """Get a new invoice number. The reason why we can't just use the id column is, that invoice numbers need to be ascending *per contract* (according to german law)."""
         if self.number:
@@ -810,3 +1294,87 @@ class Invoice( LetterPart ):
         if not self.contract or not self.date or not self.entries:
             return False
         return True
+@event.listens_for( Invoice.entries, 'append' )
+def _invoice_entry_added( invoice, entry, initiator ):
+    invoice._apply_entry_value( entry.value )
+@event.listens_for( Invoice.entries, 'remove' )
+def _invoice_entry_removed( invoice, entry, initiator ):
+    invoice._apply_entry_value( entry.value, -1 )
+@event.listens_for( BookkeepingEntry.value, 'set', active_history=True )
+def _bookkeepingentry_value_changed( entry, value, oldvalue, initiator ):
+    invoices = entry.__dict__.get( 'invoices' ) # don't trigger a lazy load for new entries
+    if invoices is None:
+        invoices = entry.invoices if sqlalchemy.inspect( entry ).persistent else ()
+    for invoice in invoices:
+        if isinstance( oldvalue, ( int, float, decimal.Decimal ) ):
+            invoice._apply_entry_value( oldvalue, -1 )
+        invoice._apply_entry_value( value )
+@event.listens_for( sqlalchemy.orm.Session, 'before_flush' )
+def _bookkeepingentries_deleted( session, flush_context, instances ):
+    # session.delete( entry ) doesn't fire Invoice.entries 'remove'
+    deleted = [obj for obj in session.deleted if isinstance( obj, BookkeepingEntry )]
+    if not deleted:
+        return
+    invoices = set()
+    for entry in deleted:
+        invoices.update( invoice for invoice in entry.invoices if invoice not in session.deleted )
+    for invoice in invoices:
+        invoice.update_balance( exclude=deleted )
+
+# Schema migrations (see Database._upgrade_schema()), never change the order
+def _migrate_invoice_balances( connection ):
+    """store invoice balances"""
+    invoice_columns = set( column['name'] for column in sqlalchemy.inspect( connection ).get_columns( Invoice.__tablename__ ) )
+    for name in ( 'value', 'value_paid', 'value_left' ):
+        if name not in invoice_columns:
+            connection.execute( "ALTER TABLE {} ADD COLUMN {} FLOAT NOT NULL DEFAULT 0".format( Invoice.__tablename__, name ) )
+    connection.execute( Invoice.get_balance_update() )
+def _migrate_indexes( connection ):
+    """create missing indexes"""
+    inspector = sqlalchemy.inspect( connection )
+    for table in Base.metadata.sorted_tables:
+        existing_indexes = set( index['name'] for index in inspector.get_indexes( table.name ) )
+        for index in table.indexes:
+            if index.name not in existing_indexes:
+                logger.info( "Creating index '%s'...", index.name )
+                index.create( connection )
+def _migrate_money_to_cents( connection ):
+    """store money as integer cents"""
+    # The columns keep their declared FLOAT type, but whole numbers are stored exactly
+    for table, columns in ( ( Subscription.__table__, ( 'value', ) ),
+                            ( Contract.__table__, ( 'value', ) ),
+                            ( BookkeepingEntry.__table__, ( 'value', ) ),
+                            ( Invoice.__table__, ( 'value', 'value_paid', 'value_left' ) ) ):
+        assignments = ", ".join( "{0} = CAST( ROUND( {0} * 100 ) AS INTEGER )".format( column ) for column in columns )
+        connection.execute( "UPDATE {} SET {}".format( table.name, assignments ) )
+MIGRATIONS = ( _migrate_invoice_balances,
+               _migrate_indexes,
+               _migrate_money_to_cents )
+
+# Named loading profiles (see DatabaseObject.get_loading_options())
+def _get_letter_render_options():
+    contents = with_polymorphic( LetterPart, [Invoice, Note] )
+    return ( joinedload( Letter.contract ).joinedload( Contract.customer ),
+             joinedload( Letter.contract ).joinedload( Contract.billingaddress ),
+             joinedload( Letter.contract ).joinedload( Contract.subscription ).joinedload( Subscription.magazine ),
+             subqueryload( Letter.contents.of_type( contents ) ).subqueryload( contents.Invoice.entries ) )
+Customer.LOADING_PROFILES = {
+    'customer-row': lambda: ( subqueryload( Customer.addresses ), ),
+}
+Contract.LOADING_PROFILES = {
+    'shipping-export': lambda: ( joinedload( Contract.shippingaddress ).joinedload( Address.customer ), ),
+    'invoicing': lambda: ( joinedload( Contract.subscription ).joinedload( Subscription.magazine ).subqueryload( Magazine.issues ),
+                           subqueryload( Contract.invoices ).subqueryload( Invoice.entries ) ),
+    'billing-run': lambda: ( joinedload( Contract.subscription ), joinedload( Contract.customer ) ),
+    'letter-compose': lambda: ( subqueryload( Contract.invoices ), ),
+}
+Invoice.LOADING_PROFILES = {
+    'invoice-row': lambda: ( joinedload( Invoice.contract ).joinedload( Contract.customer ), ),
+    'directdebit-export': lambda: ( joinedload( Invoice.contract ).joinedload( Contract.customer ),
+                                    joinedload( Invoice.contract ).joinedload( Contract.bankaccount ),
+                                    joinedload( Invoice.contract ).joinedload( Contract.billingaddress ),
+                                    joinedload( Invoice.contract ).joinedload( Contract.subscription ).joinedload( Subscription.magazine ) ),
+}
+Letter.LOADING_PROFILES = {
+    'letter-render': _get_letter_render_options,
+}
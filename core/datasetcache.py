@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+    This file is part of MSM.
+
+    MSM is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    MSM is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with MSM.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import logging
+logger = logging.getLogger( __name__ )
+import array
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+import tempfile
+class DatasetCache:
+    """
+    Caches parsed records of big data files (e.g. the autocompletion data) in
+    a compiled, memory-mappable binary file per source file, so that they
+    don't have to be parsed again on every start.
+
+    A cache file is valid as long as the source file has the same path, size
+    and mtime. If only the mtime differs, the SHA-1 of the content decides.
+    Otherwise the source is parsed again and the cache file is rebuilt.
+
+    File format (integers little endian, floats in native byte order):
+        8 bytes   magic "MSMDSC01"
+        uint32    length of the header
+        header    JSON object (source, size, mtime_ns, sha1, columns, count)
+        columns   for each column: uint64 length, data, padding to 8 bytes
+                  's' columns: UTF-8 strings separated by NUL bytes
+                  'f' columns: float64 array
+    Float columns are returned as memoryviews of the mapped file, so their
+    pages are shared between all processes that use the same cache.
+
+    Usage:
+        cache = DatasetCache( "/home/user/.msm/cache" )
+        bankcodes, bics = cache.load( "banks-DE", fname, "ss", parse_function )
+    """
+    MAGIC = b"MSMDSC01"
+    VERSION = 1
+    def __init__( self, directory ):
+        """
+        __init__ function.
+        Arguments:
+            directory:
+                the directory that holds the cache files
+        """
+        self._directory = directory
+    def get_filename( self, name, source ):
+        """
+        Returns the path of the cache file for a source file.
+        Arguments:
+            name:
+                name of the dataset, e.g. "banks-DE"
+            source:
+                path of the source file
+        """
+        source_hash = hashlib.sha1( os.path.abspath( source ).encode( 'utf-8' ) ).hexdigest()[:12]
+        return os.path.join( self._directory, "{}-{}.cache".format( name, source_hash ) )
+    @staticmethod
+    def get_file_hash( fname ):
+        sha1 = hashlib.sha1()
+        with open( fname, 'rb' ) as f:
+            for block in iter( lambda: f.read( 1 << 20 ), b'' ):
+                sha1.update( block )
+        return sha1.hexdigest()
+    def load( self, name, source, columns, parse ):
+        """
+        Returns the columns of the records of a source file, either from the
+        cache or by calling parse and (re)building the cache.
+        Arguments:
+            name:
+                name of the dataset, e.g. "banks-DE"
+            source:
+                path of the source file
+            columns:
+                the column types, one character ('s' for str, 'f' for float) per field
+            parse:
+                callable without arguments that returns an iterable of record tuples
+        Returns:
+            a list of columns (lists of str and memoryviews of float)
+        """
+        source = os.path.abspath( source )
+        stat = os.stat( source )
+        fname = self.get_filename( name, source )
+        header = self._read_header( fname )
+        sha1 = None
+        if header is not None and header['columns'] == columns and header['size'] == stat.st_size:
+            if header['mtime_ns'] == stat.st_mtime_ns:
+                return self._read( fname )
+            # Touched or copied, but maybe not changed
+            sha1 = self.get_file_hash( source )
+            if header['sha1'] == sha1:
+                data = self._read( fname )
+                self._write( fname, source, stat, sha1, columns, data )
+                return data
+        logger.debug( "Building cache '%s' for '%s'", fname, source )
+        records = list( parse() )
+        data = [list( column ) for column in zip( *records )] if records else [[] for column in columns]
+        for i, column_type in enumerate( columns ):
+            if column_type == 'f':
+                data[i] = memoryview( array.array( 'd', data[i] ) )
+        if sha1 is None:
+            sha1 = self.get_file_hash( source )
+        self._write( fname, source, stat, sha1, columns, data )
+        return data
+    def _read_header( self, fname ):
+        try:
+            with open( fname, 'rb' ) as f:
+                if f.read( len( self.MAGIC ) ) != self.MAGIC:
+                    return None
+                header_len, = struct.unpack( '<I', f.read( 4 ) )
+                header = json.loads( f.read( header_len ).decode( 'utf-8' ) )
+        except ( OSError, ValueError, struct.error ):
+            return None
+        if header.get( 'version' ) != self.VERSION or header.get( 'byteorder' ) != sys.byteorder:
+            return None
+        return header
+    def _read( self, fname ):
+        with open( fname, 'rb' ) as f:
+            mapped = mmap.mmap( f.fileno(), 0, access=mmap.ACCESS_READ )
+        offset = len( self.MAGIC )
+        header_len, = struct.unpack_from( '<I', mapped, offset )
+        offset += 4
+        header = json.loads( mapped[offset:offset + header_len].decode( 'utf-8' ) )
+        offset += header_len
+        offset += -offset % 8
+        view = memoryview( mapped )
+        data = []
+        for column_type in header['columns']:
+            length, = struct.unpack_from( '<Q', mapped, offset )
+            offset += 8
+            if column_type == 'f':
+                data.append( view[offset:offset + length].cast( 'd' ) )
+            elif length:
+                data.append( bytes( view[offset:offset + length] ).decode( 'utf-8' ).split( '\0' ) )
+            else:
+                data.append( [] if header['count'] == 0 else [''] )
+            offset += length
+            offset += -offset % 8
+        return data
+    def _write( self, fname, source, stat, sha1, columns, data ):
+        header = { 'version': self.VERSION,
+                   'byteorder': sys.byteorder,
+                   'source': source,
+                   'size': stat.st_size,
+                   'mtime_ns': stat.st_mtime_ns,
+                   'sha1': sha1,
+                   'columns': columns,
+                   'count': len( data[0] ) if data else 0 }
+        chunks = []
+        for column_type, column in zip( columns, data ):
+            if column_type == 'f':
+                chunks.append( bytes( column ) )
+            else:
+                if any( '\0' in value for value in column ):
+                    logger.warning( "Can't cache '%s': NUL byte in data", source )
+                    return
+                chunks.append( '\0'.join( column ).encode( 'utf-8' ) )
+        header_bytes = json.dumps( header ).encode( 'utf-8' )
+        tmpname = None
+        try:
+            os.makedirs( self._directory, exist_ok=True )
+            fd, tmpname = tempfile.mkstemp( dir=self._directory, suffix=".tmp" )
+            with os.fdopen( fd, 'wb' ) as f:
+                f.write( self.MAGIC )
+                f.write( struct.pack( '<I', len( header_bytes ) ) )
+                f.write( header_bytes )
+                f.write( b'\0' * ( -f.tell() % 8 ) )
+                for chunk in chunks:
+                    f.write( struct.pack( '<Q', len( chunk ) ) )
+                    f.write( chunk )
+                    f.write( b'\0' * ( -f.tell() % 8 ) )
+            os.replace( tmpname, fname )
+        except OSError as e:
+            # e.g. read-only config dir or the file is mapped by another process on Windows
+            logger.warning( "Can't write cache '%s': %s", fname, e )
+            if tmpname is not None and os.path.exists( tmpname ):
+                os.remove( tmpname )
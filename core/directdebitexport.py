@@ -18,46 +18,65 @@
 """
 import logging
 logger = logging.getLogger( __name__ )
+import os
 import threading
-from core.database import Invoice, PaymentType
-from msmgui.widgets.base import ScopedDatabaseObject
+from core.database import Invoice, Contract, PaymentType, ScopedDatabaseObject
+from core.lib.job import JobHandle, JobCancelled
 
 
 class DirectDebitExporter( threading.Thread, ScopedDatabaseObject ):
-    def __init__( self, output_file, formatter, update_step=25 ):
+    """
+    Exports the open direct debit invoices with a formatter. The progress is
+    reported to the JobHandle self.job (stages 'load' and 'export'); if the
+    job is cancelled, the incomplete output file is removed.
+    """
+    def __init__( self, output_file, formatter ):
         self.logger = logging.getLogger(__name__)
         threading.Thread.__init__( self )
         ScopedDatabaseObject.__init__( self )
         self._output_file = output_file
         self._formatter = formatter
-        self._update_step = update_step
+        self.job = JobHandle()
 
     def run(self):
+        try:
+            self._export()
+        except JobCancelled:
+            if os.path.exists(self._output_file):
+                os.remove(self._output_file)
+            self.logger.info("Export abgebrochen.")
+        finally:
+            self._session.expunge_all()
+            self._session.remove()
+            self.job.finish()
+
+    def _export(self):
+        self.job.start_stage('load')
         self.logger.info("Hole Rechnungen aus Datenbank...")
         # add settings to the local session
-        all_invoices = list(Invoice.get_all(session=self.session))
-        invoices = []
-        for invoice in all_invoices:
-            if (invoice.value_left > 0 and
-               invoice.contract is not None and
-               invoice.contract.bankaccount is not None and
-               invoice.contract.paymenttype == PaymentType.DirectWithdrawal):
-                invoices.append(invoice)
+        query = (Invoice.get_open_invoices(session=self.session)
+                 .join(Invoice.contract)
+                 .filter(Contract.bankaccount_id != None,
+                         Contract.paymenttype == PaymentType.DirectWithdrawal))
+        control_sum = Invoice.get_totals(query)[2]
+        invoices = (query
+                    .options(*Invoice.get_loading_options('directdebit-export'))
+                    .order_by(Invoice.id)
+                    .all())
         num_invoices = len(invoices)
         self.logger.info("1 Rechnung geholt!" if num_invoices == 1 else "{} Rechnungen geholt!".format(num_invoices))
+        self.job.start_stage('export', num_invoices)
         self.logger.info("Exportiere Daten aus 1 Rechnung..." if num_invoices == 1 else "Exportiere Daten aus {} Rechnungen...".format(num_invoices))
 
-        for work_done, output in enumerate(self._formatter.write(invoices,
-                                                         self._output_file),
-                                   start=1):
-            if (not self._update_step or
-               (work_done % self._update_step) == 0 or
-               work_done in (0, 1)):
-                self.logger.info("Exportiere %d von %s", work_done,
-                                  num_invoices)
-        
-        self._session.expunge_all()
-        self._session.remove()
+        work_done = 0
+        records = self._formatter.write(invoices, self._output_file,
+                                        control_sum)
+        try:
+            for output in self.job.track(records):
+                work_done += 1
+        finally:
+            records.close()
+
         self.logger.info("Fertig! 1 Datensatz exportiert." if work_done == 1
                           else
                           "Fertig! {} Datensätze exportiert.".format(work_done))
@@ -0,0 +1,338 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    This file is part of MSM.
+
+    MSM is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    MSM is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with MSM.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import logging
+logger = logging.getLogger( __name__ )
+import datetime
+import os
+import concurrent.futures
+import multiprocessing
+from sqlalchemy import func
+from sqlalchemy.orm import subqueryload
+from core.database import Database, Magazine, Contract, Invoice, LetterPart, BookkeepingEntry, Money, bkentry_association_table
+from core.errors import InvoiceError
+from core.lib.job import JobHandle, JobCancelled
+
+class InvoiceDraft( object ):
+    """
+    An invoice that has been calculated by the InvoicingEngine, but not
+    saved yet. It has the same attributes as Invoice, so that it can be
+    displayed like one.
+    """
+    def __init__( self, contract, number, date, maturity_date, accounting_startdate, accounting_enddate, entries ):
+        self.id = None
+        self.contract = contract
+        self.contract_id = contract.id
+        self.number = number
+        self.date = date
+        self.maturity_date = maturity_date
+        self.accounting_startdate = accounting_startdate
+        self.accounting_enddate = accounting_enddate
+        self.entries = entries # list of ( date, value, description ) tuples
+        self.value = sum( value for date, value, description in entries )
+        self.value_paid = Money.quantize( 0 )
+        self.value_left = self.value
+    def __getstate__( self ):
+        # Drafts are sent between processes without the contract, saving only needs contract_id
+        state = self.__dict__.copy()
+        state['contract'] = None
+        return state
+    def to_invoice( self ):
+        """
+        Creates an Invoice from this draft, e.g. for previews. Note that
+        the cascade of Contract.invoices adds it to the contract's session.
+        """
+        invoice = Invoice( self.date, self.maturity_date, self.accounting_startdate, self.accounting_enddate, self.number )
+        invoice.contract = self.contract
+        for date, value, description in self.entries:
+            invoice.add_entry( date, value, description )
+        return invoice
+
+class InvoicingEngine( object ):
+    """
+    Creates the invoices of a billing run. Contracts, subscriptions and
+    issues are loaded in bulk, the invoices are calculated in memory and
+    written in chunks (with executemany() inserts on SQLite, see
+    _insert_with_ids()).
+    Progress is reported to the JobHandle self.job and by calling
+    on_progress( stage, done, total ), where stage is one of STAGES. If the
+    job is cancelled, run() stops after the current chunk and rolls back.
+    """
+    STAGES = ( 'load', 'generate', 'save' )
+    def __init__( self, date=None, maturity_date=None, accounting_enddate=None, session=None, chunk_size=500, on_progress=None, job=None ):
+        """
+        Args:
+            date:
+                the date of the invoices (defaults to today)
+            maturity_date:
+                the maturity date of the invoices (defaults to date + 14 days)
+            accounting_enddate:
+                the end of the accounting period (defaults to date)
+            session:
+                the scoped session to use (defaults to a new thread-local one)
+            chunk_size:
+                number of contracts loaded/invoices written per statement
+            on_progress:
+                callable that is called with stage, done and total
+            job:
+                the JobHandle to report to (defaults to a new one)
+        """
+        self.date = date if date else datetime.date.today()
+        self.maturity_date = maturity_date if maturity_date else self.date + datetime.timedelta( days=14 )
+        self.accounting_enddate = accounting_enddate if accounting_enddate else self.date
+        self.session = session if session is not None else Database.get_scoped_session()
+        self.chunk_size = chunk_size
+        self.on_progress = on_progress
+        self.job = job if job is not None else JobHandle()
+    def _progress( self, stage, done, total ):
+        self.job.update( stage, done, total )
+        if self.on_progress is not None:
+            self.on_progress( stage, done, total )
+    def _chunks( self, items ):
+        for i in range( 0, len( items ), self.chunk_size ):
+            yield items[i:i + self.chunk_size]
+    def load( self, contract_ids=None ):
+        """
+        Loads the contracts that shall be invoiced, together with all
+        magazines and their issues.
+        Args:
+            contract_ids:
+                ids of the contracts to invoice (defaults to all contracts)
+        Returns:
+            a list of contracts
+        """
+        # All magazines and issues at once, the contracts' subscriptions find them in the identity map
+        self.session.query( Magazine ).options( subqueryload( Magazine.issues ) ).all()
+        if contract_ids is None:
+            q = self.session.query( Contract.id ).filter( Contract.startdate < self.accounting_enddate ).order_by( Contract.id )
+            contract_ids = [contract_id for contract_id, in q]
+        else:
+            contract_ids = sorted( contract_ids )
+        contracts = []
+        self._progress( 'load', 0, len( contract_ids ) )
+        for chunk in self._chunks( contract_ids ):
+            self.job.check_cancelled()
+            q = self.session.query( Contract ).options( *Contract.get_loading_options( 'billing-run' ) )
+            contracts.extend( q.filter( Contract.id.in_( chunk ) ).order_by( Contract.id ) )
+            self._progress( 'load', len( contracts ), len( contract_ids ) )
+        return contracts
+    def get_previous_invoices( self, contracts ):
+        """
+        Returns a dict that maps contract ids to the end of the last accounting period and the highest invoice number.
+        """
+        previous = {}
+        contract_ids = [contract.id for contract in contracts]
+        for chunk in self._chunks( contract_ids ):
+            q = self.session.query( Invoice.contract_id, func.max( Invoice.accounting_enddate ), func.max( Invoice.number ) )
+            q = q.filter( Invoice.contract_id.in_( chunk ) ).group_by( Invoice.contract_id )
+            for contract_id, enddate, number in q:
+                previous[contract_id] = ( enddate, number )
+        return previous
+    def generate( self, contracts ):
+        """
+        Calculates the invoices for the given contracts. Contracts without anything to invoice are skipped.
+        Returns:
+            a list of InvoiceDrafts
+        """
+        previous = self.get_previous_invoices( contracts )
+        drafts = []
+        self._progress( 'generate', 0, len( contracts ) )
+        for i, contract in enumerate( contracts, start=1 ):
+            previous_enddate, previous_number = previous.get( contract.id, ( None, None ) )
+            try:
+                startdate, enddate = contract.get_accounting_period( self.accounting_enddate, previous_enddate=previous_enddate )
+            except InvoiceError as err:
+                logger.debug( "Not invoicing contract %s: %s", contract.refid, err )
+            else:
+                entries = Invoice.get_automatic_entries( contract, startdate, enddate )
+                draft = InvoiceDraft( contract, ( previous_number or 0 ) + 1, self.date, self.maturity_date, startdate, enddate, entries )
+                if draft.value:
+                    drafts.append( draft )
+                else:
+                    logger.debug( "Not invoicing contract %s: value is zero", contract.refid )
+            if i % self.chunk_size == 0 or i == len( contracts ):
+                self._progress( 'generate', i, len( contracts ) )
+                self.job.check_cancelled()
+        return drafts
+    def save( self, drafts, commit=True ):
+        """
+        Writes the invoices and their entries to the database in a single transaction and sets the ids of the drafts.
+        Args:
+            commit:
+                commit the transaction (otherwise the caller has to commit or roll back)
+        """
+        self._progress( 'save', 0, len( drafts ) )
+        done = 0
+        for chunk in self._chunks( drafts ):
+            self.job.check_cancelled()
+            self._write( chunk )
+            done += len( chunk )
+            self._progress( 'save', done, len( drafts ) )
+        if commit:
+            self.session.commit()
+    def _write( self, drafts ):
+        """
+        Inserts a chunk of invoices and their entries and sets the ids of the drafts.
+        """
+        connection = self.session.connection()
+        entries = [( draft, entry ) for draft in drafts for entry in draft.entries]
+        invoice_ids = self._insert_with_ids( connection, LetterPart.__table__, [{ 'type': 'invoice' } for draft in drafts] )
+        entry_ids = self._insert_with_ids( connection, BookkeepingEntry.__table__, [{ 'contract_id': draft.contract_id, 'date': date, 'value': value, 'description': description } for draft, ( date, value, description ) in entries] )
+        for draft, invoice_id in zip( drafts, invoice_ids ):
+            draft.id = invoice_id
+        connection.execute( Invoice.__table__.insert(), [{ 'id': draft.id, 'contract_id': draft.contract_id, 'number': draft.number,
+                                                           'date': draft.date, 'maturity_date': draft.maturity_date,
+                                                           'accounting_startdate': draft.accounting_startdate, 'accounting_enddate': draft.accounting_enddate,
+                                                           'value': draft.value, 'value_paid': draft.value_paid, 'value_left': draft.value_left } for draft in drafts] )
+        if entries:
+            connection.execute( bkentry_association_table.insert(), [{ 'invoice_id': draft.id, 'bookkeepingentry_id': entry_id } for ( draft, entry ), entry_id in zip( entries, entry_ids )] )
+    @staticmethod
+    def _insert_with_ids( connection, table, rows ):
+        """
+        Inserts rows and returns their ids. On SQLite, the first row is
+        inserted on its own to obtain its id; from then on the transaction
+        holds the write lock of the whole database, so the following ids can
+        be assigned upfront and the remaining rows can be inserted with a
+        single executemany(). Other databases allow concurrent writers (and
+        explicit ids wouldn't advance a PostgreSQL sequence), so the rows are
+        inserted one by one there.
+        Returns:
+            the list of ids
+        """
+        if not rows:
+            return []
+        if connection.dialect.name != 'sqlite':
+            return [connection.execute( table.insert(), row ).inserted_primary_key[0] for row in rows]
+        first_id = connection.execute( table.insert(), rows[0] ).inserted_primary_key[0]
+        ids = list( range( first_id, first_id + len( rows ) ) )
+        if len( rows ) > 1:
+            connection.execute( table.insert(), [dict( row, id=row_id ) for row, row_id in zip( rows[1:], ids[1:] )] )
+        return ids
+    def run( self, contract_ids=None ):
+        """
+        Loads, generates and saves the invoices of a whole billing run.
+        Returns:
+            a list of the saved InvoiceDrafts (empty if the job was cancelled)
+        """
+        try:
+            return self._run( contract_ids )
+        except JobCancelled:
+            self.session.rollback()
+            logger.info( "Billing run cancelled, no invoices were saved" )
+            return []
+        finally:
+            self.job.finish()
+    def _run( self, contract_ids ):
+        drafts = self.generate( self.load( contract_ids ) )
+        self.save( drafts )
+        return drafts
+
+def _init_shard_worker( db_uri ):
+    """
+    Initializes the database connection of a ParallelInvoicingEngine worker process.
+    """
+    Database( db_uri )
+def _generate_shard( options, contract_ids ):
+    """
+    Calculates the invoices of a shard of contracts in a worker process.
+    Returns:
+        a list of InvoiceDrafts (without their contracts)
+    """
+    session = Database.get_scoped_session()
+    engine = InvoicingEngine( session=session, **options )
+    drafts = engine.generate( engine.load( contract_ids ) )
+    session.remove()
+    return drafts
+
+class ParallelInvoicingEngine( InvoicingEngine ):
+    """
+    Runs a billing run in several processes: The contracts are split into
+    shards of consecutive contract ids, each shard is calculated by a worker
+    process with its own InvoicingEngine, and this process writes the
+    results shard by shard in contract id order. As each contract belongs
+    to exactly one shard, invoice numbers and ids are the same as with a
+    sequential run. All shards are written in a single transaction, so a
+    failed run doesn't leave a partial billing run behind (with SQLite, the
+    workers can only keep reading during this transaction in WAL mode, see
+    Database.SQLITE_PROFILES). The progress of the shards that have been
+    calculated and written is reported as the stage 'generate'.
+    """
+    def __init__( self, date=None, maturity_date=None, accounting_enddate=None, session=None, chunk_size=500, on_progress=None, processes=None, shard_size=None, job=None ):
+        """
+        Args:
+            processes:
+                number of worker processes (defaults to the number of CPUs)
+            shard_size:
+                number of contracts per shard (defaults to splitting the contracts into 4 shards per process)
+            For the other arguments see InvoicingEngine.
+        """
+        InvoicingEngine.__init__( self, date, maturity_date, accounting_enddate, session, chunk_size, on_progress, job )
+        self.processes = processes if processes else os.cpu_count() or 1
+        self.shard_size = shard_size
+    def get_shards( self, contract_ids=None ):
+        """
+        Splits the (given or all billable) contract ids into ranges of consecutive ids.
+        Returns:
+            a list of lists of contract ids
+        """
+        if contract_ids is None:
+            q = self.session.query( Contract.id ).filter( Contract.startdate < self.accounting_enddate ).order_by( Contract.id )
+            contract_ids = [contract_id for contract_id, in q]
+        else:
+            contract_ids = sorted( contract_ids )
+        shard_size = self.shard_size
+        if not shard_size:
+            shard_size = max( 1, -( -len( contract_ids ) // ( self.processes * 4 ) ) )
+        return [contract_ids[i:i + shard_size] for i in range( 0, len( contract_ids ), shard_size )]
+    def run( self, contract_ids=None ):
+        """
+        Calculates the invoices in the worker processes and saves them.
+        The database must be a file that the workers can open, too.
+        Returns:
+            a list of the saved InvoiceDrafts (without their contracts, empty if the job was cancelled)
+        """
+        return InvoicingEngine.run( self, contract_ids )
+    def _run( self, contract_ids ):
+        shards = self.get_shards( contract_ids )
+        num_contracts = sum( len( shard ) for shard in shards )
+        options = { 'date': self.date, 'maturity_date': self.maturity_date, 'accounting_enddate': self.accounting_enddate, 'chunk_size': self.chunk_size }
+        self.session.commit() # the workers must not wait for our transaction
+        drafts = []
+        done = 0
+        self._progress( 'generate', 0, num_contracts )
+        # Don't fork, this may be called from a thread of the GUI (see core.letterrenderer.create_process_pool())
+        with concurrent.futures.ProcessPoolExecutor( self.processes, mp_context=multiprocessing.get_context( 'spawn' ), initializer=_init_shard_worker, initargs=( Database._uri, ) ) as executor:
+            futures = [executor.submit( _generate_shard, options, shard ) for shard in shards]
+            try:
+                # The results are written in the order of the shards, no matter which worker finishes first
+                for shard, future in zip( shards, futures ):
+                    shard_drafts = future.result()
+                    self.job.check_cancelled()
+                    for chunk in self._chunks( shard_drafts ):
+                        self._write( chunk )
+                    done += len( shard )
+                    self._progress( 'generate', done, num_contracts )
+                    drafts.extend( shard_drafts )
+            except Exception:
+                # Don't wait for the shards that haven't been started yet
+                for future in futures:
+                    future.cancel()
+                self.session.rollback()
+                raise
+        self.session.commit()
+        return drafts
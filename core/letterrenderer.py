@@ -27,14 +27,16 @@ import locale
 import jinja2
 import abc
 import threading
+import concurrent.futures
+import multiprocessing
+import sqlalchemy.engine.url
 import core.database
 import core.paths as paths
 from core.lib import pdflatex
 from core.lib import threadqueue
+from core.lib.job import JobHandle
 from core.config import Config
-from msmgui.widgets.base import ScopedDatabaseObject
-if sys.platform.startswith( 'linux' ):
-    from gi.repository import Gio # We need this as xdg-open replacement (see below)
+from core.database import ScopedDatabaseObject
 class LatexEnvironment( jinja2.Environment ):
     LATEX_SUBS = ( ( re.compile( r'\\' ), r'\\textbackslash' ),
                    ( re.compile( r'([{}_#%&$])' ), r'\\\1' ),
@@ -54,6 +56,7 @@ class LatexEnvironment( jinja2.Environment ):
         return newval
     def __init__( self, template_paths ):
         super().__init__( loader=jinja2.FileSystemLoader( template_paths ) )
+        self.template_paths = template_paths
         self.block_start_string = '((*'
         self.block_end_string = '*))'
         self.variable_start_string = '((('
@@ -62,29 +65,187 @@ class LatexEnvironment( jinja2.Environment ):
         self.comment_end_string = '=))'
         self.filters['escape_tex'] = self.escape_tex
         self.filters['escape_nl'] = self.escape_nl
+    def __reduce__( self ):
+        # The environment is recreated from its paths, e.g. in a worker process
+        return ( self.__class__, ( self.template_paths, ) )
 env_latex = LatexEnvironment([paths.data('templates'),
                               paths.config('templates')])
 
+BACKENDS = ( 'thread', 'process' )
+def get_num_worker_threads():
+    """
+    Returns the configured number of worker threads of the renderer and
+    composer queues, or None for one per CPU core.
+    """
+    value = Config.get( "LetterRenderer", "worker_threads" )
+    return int( value ) if value else None
+def get_chunk_size():
+    """
+    Returns the configured number of letters or contracts that a worker
+    takes at once, or None to adapt it to the time per letter.
+    """
+    value = Config.get( "LetterRenderer", "chunk_size" )
+    return int( value ) if value else None
+def get_backend():
+    """
+    Returns the configured backend of the renderer and composer queues, one
+    of BACKENDS.
+    """
+    backend = Config.get( "LetterRenderer", "backend" ) or 'thread'
+    if backend not in BACKENDS:
+        raise ValueError( "Unknown letter renderer backend '{}'".format( backend ) )
+    return backend
+def create_process_pool( num_workers, template_env=None, lettercomposition=None ):
+    """
+    Creates the worker processes for a renderer or composer queue, if the
+    process backend is configured.
+    Arguments:
+        num_workers:
+            number of processes
+        template_env:
+            the template environment that the processes render letters with
+        lettercomposition:
+            the LetterComposition that the processes compose letters with
+    Returns:
+        a ProcessPoolExecutor or None if the work has to be done in threads
+    """
+    if get_backend() != 'process':
+        return None
+    url = sqlalchemy.engine.url.make_url( core.database.Database._uri )
+    if url.get_backend_name() == 'sqlite' and url.database in ( None, '', ':memory:' ):
+        logger.warning( "An in-memory database can't be shared with worker processes, using threads" )
+        return None
+    # The pool is usually started from a worker thread of the GUI, and forking
+    # a multithreaded process can deadlock the children on inherited locks
+    return concurrent.futures.ProcessPoolExecutor( num_workers, mp_context=multiprocessing.get_context( 'spawn' ), initializer=_init_worker_process,
+                                                   initargs=( core.database.Database._uri, locale.setlocale( locale.LC_ALL ), template_env, lettercomposition ) )
+# State of a worker process, see _init_worker_process()
+_worker_template_env = None
+_worker_lettercomposition = None
+def _init_worker_process( db_uri, locale_name, template_env, lettercomposition ):
+    """
+    Initializes the locale, the database connection and the state of a
+    worker process of a renderer or composer queue.
+    """
+    global _worker_template_env, _worker_lettercomposition
+    locale.setlocale( locale.LC_ALL, locale_name )
+    core.database.Database( db_uri )
+    _worker_template_env = template_env
+    _worker_lettercomposition = lettercomposition
+def _prerender_letters( letter_ids ):
+    """
+    Prerenders a chunk of letters in a worker process.
+    Returns:
+        a list of the prerendered letters as strings (None for letters that failed)
+    """
+    session = core.database.Database.get_scoped_session()
+    try:
+        return _prerender_chunk( session, LetterPrerenderer( _worker_template_env ), letter_ids )
+    finally:
+        session.remove()
+def _compose_letters( contract_ids ):
+    """
+    Composes the letters of a chunk of contracts in a worker process.
+    Returns:
+        a list of the (unsaved and detached) Letters (None for contracts that failed)
+    """
+    session = core.database.Database.get_scoped_session()
+    try:
+        return _compose_chunk( session, _worker_lettercomposition, contract_ids )
+    finally:
+        session.expunge_all()
+        session.remove()
+def _prerender_chunk( session, prerenderer, letter_ids ):
+    """
+    Loads a chunk of saved letters (see load_letters()) and prerenders them.
+    Returns:
+        a list of the prerendered letters as strings (None for letters that failed)
+    """
+    letters = load_letters( session, letter_ids )
+    rendered_letters = []
+    for letter_id in letter_ids:
+        try:
+            rendered_letters.append( prerenderer.prerender( letters[letter_id] ) )
+        except Exception:
+            logger.exception( "Prerendering letter %d failed", letter_id )
+            rendered_letters.append( None )
+    return rendered_letters
+def _compose_chunk( session, lettercomposition, contract_ids ):
+    """
+    Loads a chunk of contracts with a single query and composes their letters.
+    Returns:
+        a list of the Letters (None for contracts that failed)
+    """
+    q = session.query( core.database.Contract ).options( *core.database.Contract.get_loading_options( 'letter-compose' ) )
+    contracts = dict( ( contract.id, contract ) for contract in q.filter( core.database.Contract.id.in_( contract_ids ) ) )
+    lettercomposition = lettercomposition.merge( session )
+    letters = []
+    for contract_id in contract_ids:
+        try:
+            letters.append( lettercomposition.compose( contracts[contract_id] ) )
+        except Exception:
+            logger.exception( "Composing the letter for contract %d failed", contract_id )
+            letters.append( None )
+    return letters
+def load_letter( session, letter ):
+    """
+    Loads a letter with everything needed for rendering in a handful of queries.
+    Arguments:
+        session:
+            the session to load the letter into
+        letter:
+            a Letter or the id of a saved letter
+    Returns:
+        the Letter in the session
+    """
+    if isinstance( letter, int ):
+        letter_id = letter
+    elif letter.id is None:
+        return session.merge( letter )
+    else:
+        letter_id = letter.id
+    q = session.query( core.database.Letter ).options( *core.database.Letter.get_loading_options( 'letter-render' ) )
+    return q.filter_by( id=letter_id ).one()
+def load_letters( session, letter_ids ):
+    """
+    Loads a chunk of saved letters with everything needed for rendering, in
+    the same handful of queries as a single letter (see load_letter()).
+    Arguments:
+        session:
+            the session to load the letters into
+        letter_ids:
+            the ids of the letters
+    Returns:
+        a dict that maps the ids to the Letters in the session (missing letters are left out)
+    """
+    q = session.query( core.database.Letter ).options( *core.database.Letter.get_loading_options( 'letter-render' ) )
+    return dict( ( letter.id, letter ) for letter in q.filter( core.database.Letter.id.in_( letter_ids ) ) )
 class AbstractRendererQueue( threadqueue.AbstractQueue ):
     __metaclass__ = abc.ABCMeta
     def __init__( self, template_env, num_worker_threads=None ):
         self._template_env = template_env
-        super().__init__( num_worker_threads )
+        if num_worker_threads is None:
+            num_worker_threads = get_num_worker_threads()
+        super().__init__( num_worker_threads, chunk_size=get_chunk_size() )
     @abc.abstractmethod
     def _create_thread( self ):
         super()._create_thread( self )
-class PrerenderThread( threadqueue.AbstractQueueThread, ScopedDatabaseObject ):
+    def _create_executor( self ):
+        # Starting processes isn't worth it for a single letter, e.g. the preview
+        if self.work_started == 1:
+            return None
+        return create_process_pool( self.num_worker_threads, template_env=self._template_env )
+class LetterPrerenderer( object ):
+    """
+    Prerenders letters, i.e. renders their parts with the templates.
+    """
     def __init__( self, template_env ):
-        threadqueue.AbstractQueueThread.__init__( self )
-        ScopedDatabaseObject.__init__( self )
         self._template_env = template_env
-    def run( self ):
-        self._session = core.database.Database.get_scoped_session()
-        super().run()
-        self._session.expunge_all() # expunge everything afterwards
-        self._session.remove()
-    def work( self, letter ):
-        letter = self._session.merge( letter )
+    def prerender( self, letter ):
+        """
+        Returns:
+            the prerendered letter as string
+        """
         return '\n'.join( list( self._prerender( letter ) ) )
     def _prerender( self, letter ):
         """ Generator function that prerenders a whole letter (yields it part by part). """
@@ -140,6 +301,27 @@ class PrerenderThread( threadqueue.AbstractQueueThread, ScopedDatabaseObject ):
         tpl_file = '/'.join(("notes", "{}.template".format(note.template)))
         template = self._template_env.get_template(tpl_file)
         return template.render( templatevars )
+class PrerenderThread( threadqueue.AbstractQueueThread, ScopedDatabaseObject ):
+    def __init__( self, template_env ):
+        threadqueue.AbstractQueueThread.__init__( self )
+        ScopedDatabaseObject.__init__( self )
+        self._prerenderer = LetterPrerenderer( template_env )
+    def run( self ):
+        self._session = core.database.Database.get_scoped_session()
+        super().run()
+        self._session.expunge_all() # expunge everything afterwards
+        self._session.remove()
+    def work( self, letter ):
+        return self._prerenderer.prerender( load_letter( self._session, letter ) )
+    def work_chunk( self, letters ):
+        letter_ids = [letter if isinstance( letter, int ) else letter.id for letter in letters]
+        if None in letter_ids: # unsaved letters, e.g. the preview
+            return super().work_chunk( letters )
+        if self.executor is None:
+            rendered_letters = _prerender_chunk( self._session, self._prerenderer, letter_ids )
+            self._session.expunge_all()
+            return rendered_letters
+        return self.execute( _prerender_letters, letter_ids )
 class PrerenderQueue( AbstractRendererQueue ):
     def _create_thread( self ):
         return PrerenderThread( self._template_env )
@@ -150,7 +332,7 @@ class Prerenderer( threadqueue.QueueWatcherThread, ScopedDatabaseObject ):
         watcher.start()
         watcher.join()
     """
-    def __init__( self, unmerged_letters ):
+    def __init__( self, unmerged_letters, job=None ):
         ScopedDatabaseObject.__init__( self )
         letters = []
         for unmerged_letter in unmerged_letters:
@@ -158,14 +340,23 @@ class Prerenderer( threadqueue.QueueWatcherThread, ScopedDatabaseObject ):
             letters.append( letter )
         self._session.expunge_all()
         self._session.remove()
-        queue = PrerenderQueue()
+        queue = PrerenderQueue( env_latex )
         queue.put_multiple( letters )
-        super().__init__( queue )
+        super().__init__( queue, job=job, stage='prerender' )
 class ComposeThread( threadqueue.AbstractQueueThread, ScopedDatabaseObject ):
     def __init__( self, lettercomposition ):
         threadqueue.AbstractQueueThread.__init__( self )
         ScopedDatabaseObject.__init__( self )
         self._lettercomposition = lettercomposition
+    def work_chunk( self, unmerged_contracts ):
+        contract_ids = [contract.id for contract in unmerged_contracts]
+        if self.executor is not None:
+            return self.execute( _compose_letters, contract_ids )
+        try:
+            return _compose_chunk( self._session, self._lettercomposition, contract_ids )
+        finally:
+            self._session.expunge_all()
+            self._session.remove()
     def work( self, unmerged_contract ):
         contract = self._session.merge( unmerged_contract ) # add them to the local session
         lettercomp = self._lettercomposition.merge( self._session )
@@ -174,61 +365,96 @@ class ComposeThread( threadqueue.AbstractQueueThread, ScopedDatabaseObject ):
         self._session.remove()
         return letter
 class ComposeQueue( threadqueue.AbstractQueue ):
-    def __init__( self, lettercomposition ):
+    def __init__( self, lettercomposition, num_worker_threads=None ):
         self._lettercomposition = lettercomposition
-        super().__init__()
+        if num_worker_threads is None:
+            num_worker_threads = get_num_worker_threads()
+        super().__init__( num_worker_threads, chunk_size=get_chunk_size() )
     def _create_thread( self ):
         return ComposeThread( self._lettercomposition )
+    def _create_executor( self ):
+        return create_process_pool( self.num_worker_threads, lettercomposition=self._lettercomposition )
 class Composer( threadqueue.QueueWatcherThread ):
-    def __init__( self, lettercomposition, contracts ):
+    def __init__( self, lettercomposition, contracts, job=None ):
         queue = ComposeQueue( lettercomposition )
         queue.put_multiple( contracts )
-        super().__init__( queue )
+        super().__init__( queue, job=job, stage='compose' )
 class AbstractRenderer( threadqueue.QueueWatcherThread ):
     __metaclass__ = abc.ABCMeta
     def _get_template_env( self, template_env ):
         return template_env if template_env is not None else env_latex
-    def __init__( self, q, template_env=None ):
+    def __init__( self, q, template_env=None, job=None ):
         self._template_env = self._get_template_env( template_env )
-        super().__init__( q )
-    def on_finished( self, rendering_results ):
+        super().__init__( q, job=job, stage='prerender' )
+    def consume( self, rendering_results ):
+        """
+        Writes the prerendered letters into a LaTeX file as soon as they are
+        done (in the order of the letters), so that only a few of them are
+        held in memory, and passes the file to on_finished().
+        """
         template = self._template_env.get_template( "{}.template".format( "base" ) )
-        rendered_letters = [rendered_letter for rendered_letter in rendering_results if rendered_letter is not None]
-        if len( rendered_letters ) == 0:
-            raise ValueError( "No rendered letters" )
         lco_template = Config.get("LetterRenderer", "lco_template")
         if not lco_template:
             lco_template = "a4paper"
-        rendered_document = template.render( {'lco_template': lco_template, 'prerendered_letters':rendered_letters} )
-
+        num_letters = 0
+        def rendered_letters():
+            nonlocal num_letters
+            for rendered_letter in rendering_results:
+                if rendered_letter is not None:
+                    num_letters += 1
+                    yield rendered_letter
+        f = tempfile.NamedTemporaryFile( mode='w', encoding='utf-8', suffix=os.extsep + "tex", delete=False )
+        try:
+            with f:
+                for chunk in template.generate( {'lco_template': lco_template, 'prerendered_letters':rendered_letters()} ):
+                    f.write( chunk )
+            if num_letters == 0:
+                raise ValueError( "No rendered letters" )
+        except BaseException: # also if the job was cancelled
+            os.remove( f.name )
+            raise
+        self.on_finished( f.name )
+    def on_finished( self, latex_file ):
+        """
+        Compiles the LaTeX file written by consume() and removes it.
+        """
         dirs = [paths.config('templates', 'latex'),
                 paths.config('images'),
                 paths.data('templates', 'latex'),
                 paths.data('images')]
         textinputs = [dir for dir in dirs if os.path.exists(dir)]
-        pdflatex.compile_str(rendered_document, self._output_file, textinputs)
+        self.job.start_stage( 'compile' )
+        try:
+            pdflatex.compile_file(latex_file, self._output_file, textinputs)
+        finally:
+            os.remove( latex_file )
 class LetterRenderer( AbstractRenderer ):
-    def __init__( self, letters, output_file, _template_env=None ):
+    """
+    Renders letters (Letter objects or ids of saved letters) into a PDF file.
+    """
+    def __init__( self, letters, output_file, _template_env=None, job=None ):
         template_env = self._get_template_env( _template_env )
         queue = PrerenderQueue( template_env )
         queue.put_multiple( letters )
-        super().__init__( queue, template_env )
+        super().__init__( queue, template_env, job )
         self._output_file = output_file
 class LetterCollectionRenderer( threading.Thread, ScopedDatabaseObject ):
     class SubLetterRenderer( LetterRenderer ):
         def __init__( self, parent, letters, output_file, template_env=None ):
-            super().__init__( letters, output_file, template_env )
+            super().__init__( letters, output_file, template_env, parent.job )
             self._parent = parent
+        def on_cancelled( self ):
+            self._parent.on_cancelled()
         def on_start( self, work_left ):
             self._parent.on_rendering_start( self.work_started )
             super().on_start( work_left )
-        def on_output( self, work_left, output ):
-            self._parent.on_rendering_output( self.work_done, self.work_started )
-            super().on_output( work_left, output )
-        def on_finished( self, output_list ):
+        def on_progress( self, work_done, work_started ):
+            self._parent.on_rendering_output( work_done, work_started )
+            super().on_progress( work_done, work_started )
+        def on_finished( self, latex_file ):
             self._parent.on_rendering_finished( self.work_done )
             self._parent.on_compilation_start( self.work_done )
-            super().on_finished( output_list )
+            super().on_finished( latex_file )
             self._parent.on_compilation_finished( self.work_done )
     def __init__( self, lettercollection, output_file, template_env=None ):
         threading.Thread.__init__( self )
@@ -237,8 +463,10 @@ class LetterCollectionRenderer( threading.Thread, ScopedDatabaseObject ):
         self._output_file = output_file
         self._template_env = template_env
         self._letterrenderer = None
+        self.job = JobHandle()
     def run( self ):
         self.on_init_start()
+        self.job.start_stage( 'load' )
         lettercollection = self.session.merge( self._lettercollection )
         letters = []
         for letter in lettercollection.letters:
@@ -248,16 +476,25 @@ class LetterCollectionRenderer( threading.Thread, ScopedDatabaseObject ):
         self.session.close()
         self._letterrenderer = self.__class__.SubLetterRenderer( self, letters, self._output_file )
         self.on_init_finished( num_letters )
-        self._letterrenderer.start()
-        self._letterrenderer.join()
-    def on_init_start( self, num_letters_to_save ):
+        if self.job.cancelled:
+            self.on_cancelled()
+        else:
+            self._letterrenderer.start()
+            self._letterrenderer.join()
+        self.job.finish()
+    def on_cancelled( self ):
         """
-        Called when saving starts
+        Called when the job was cancelled (nothing was compiled)
         """
         pass
-    def on_init_finished( self, num_letters_saved ):
+    def on_init_start( self ):
         """
-        Called when saving has finished
+        Called when loading the letters starts
+        """
+        pass
+    def on_init_finished( self, num_letters ):
+        """
+        Called when loading the letters has finished
         """
         pass
     def on_rendering_start( self, work_started ):
@@ -266,7 +503,7 @@ class LetterCollectionRenderer( threading.Thread, ScopedDatabaseObject ):
         """
     def on_rendering_output( self, work_done, work_started ):
         """
-        Called when rendering produces output
+        Called while rendering produces output (throttled, see QueueWatcherThread.on_progress)
         """
         pass
     def on_rendering_finished( self, work_done ):
@@ -274,6 +511,11 @@ class LetterCollectionRenderer( threading.Thread, ScopedDatabaseObject ):
         Called when rendering has finished
         """
         pass
+    def on_compilation_start( self, work_done ):
+        """
+        Called when compilation starts
+        """
+        pass
     def on_compilation_finished( self, work_done ):
         """
         Called when rendering has finished
@@ -282,32 +524,36 @@ class LetterCollectionRenderer( threading.Thread, ScopedDatabaseObject ):
 class ComposingRenderer( threading.Thread, ScopedDatabaseObject ):
     class SubComposer( Composer ):
         def __init__( self, parent, lettercomposition, contracts ):
-            super().__init__( lettercomposition, contracts )
+            super().__init__( lettercomposition, contracts, parent.job )
             self._parent = parent
+        def on_cancelled( self ):
+            self._parent.on_cancelled()
         def on_start( self, work_left ):
             self._parent.on_composing_start( work_left )
             super().on_start( work_left )
-        def on_output( self, work_left, output ):
-            self._parent.on_composing_output( self.work_done, self.work_started )
-            super().on_output( work_left, output )
+        def on_progress( self, work_done, work_started ):
+            self._parent.on_composing_output( work_done, work_started )
+            super().on_progress( work_done, work_started )
         def on_finished( self, output_list ):
             letters = [letter for letter in output_list if letter is not None and letter.has_contents()]
             self._parent.on_composing_finished( len( letters ) )
             self._parent._save( letters )
     class SubLetterRenderer( LetterRenderer ):
         def __init__( self, parent, letters, output_file, template_env=None ):
-            super().__init__( letters, output_file, template_env )
+            super().__init__( letters, output_file, template_env, parent.job )
             self._parent = parent
+        def on_cancelled( self ):
+            self._parent.on_cancelled()
         def on_start( self, work_left ):
             self._parent.on_rendering_start( self.work_started )
             super().on_start( work_left )
-        def on_output( self, work_left, output ):
-            self._parent.on_rendering_output( self.work_done, self.work_started )
-            super().on_output( work_left, output )
-        def on_finished( self, output_list ):
+        def on_progress( self, work_done, work_started ):
+            self._parent.on_rendering_output( work_done, work_started )
+            super().on_progress( work_done, work_started )
+        def on_finished( self, latex_file ):
             self._parent.on_rendering_finished( self.work_done )
             self._parent.on_compilation_start( self.work_done )
-            super().on_finished( output_list )
+            super().on_finished( latex_file )
             self._parent.on_compilation_finished( self.work_done )
     def __init__( self, lettercomposition, contracts, output_file, collectionname, template_env=None ):
         threading.Thread.__init__( self )
@@ -317,13 +563,17 @@ class ComposingRenderer( threading.Thread, ScopedDatabaseObject ):
         self._collectionname = collectionname
         self._output_file = output_file
         self._template_env = template_env
+        self.job = JobHandle()
         self._composer = self.__class__.SubComposer( self, self._lettercomposition, self._contracts )
         self._letterrenderer = None
     def run( self ):
         self._composer.start()
         self._composer.join()
+        self.job.finish()
     def _save( self, letters ):
+        self.job.check_cancelled()
         num_letters = len( letters )
+        self.job.start_stage( 'save', num_letters )
         self.on_saving_start( num_letters )
         merged_letters = []
         lettercomposition = self._lettercomposition.merge( self._session )
@@ -333,15 +583,22 @@ class ComposingRenderer( threading.Thread, ScopedDatabaseObject ):
             merged_letter = self.session.merge( unmerged_letter )
             lettercollection.add_letter( merged_letter )
             merged_letters.append( merged_letter )
-        # Save merged Letters
+        # Save merged Letters, they are rendered by their ids
+        self._session.flush()
+        letter_ids = [letter.id for letter in merged_letters]
         self._session.commit()
         self._session.remove()
         self.on_saving_finished( num_letters )
-        self._render( letters )
+        self._render( letter_ids )
     def _render( self, letters ):
         self._letterrenderer = self.__class__.SubLetterRenderer( self, letters, self._output_file )
         self._letterrenderer.start()
         self._letterrenderer.join()
+    def on_cancelled( self ):
+        """
+        Called when the job was cancelled (nothing is compiled, the letters are saved if composing was done)
+        """
+        pass
     def on_composing_start( self, work_started ):
         """
         Called when rendering starts
@@ -349,7 +606,7 @@ class ComposingRenderer( threading.Thread, ScopedDatabaseObject ):
         pass
     def on_composing_output( self, work_done, work_started ):
         """
-        Called when composing produces output
+        Called while composing produces output (throttled, see QueueWatcherThread.on_progress)
         """
         pass
     def on_composing_finished( self, num_letters ):
@@ -373,7 +630,7 @@ class ComposingRenderer( threading.Thread, ScopedDatabaseObject ):
         """
     def on_rendering_output( self, work_done, work_started ):
         """
-        Called when rendering produces output
+        Called while rendering produces output (throttled, see QueueWatcherThread.on_progress)
         """
         pass
     def on_rendering_finished( self, work_done ):
@@ -381,6 +638,11 @@ class ComposingRenderer( threading.Thread, ScopedDatabaseObject ):
         Called when rendering has finished
         """
         pass
+    def on_compilation_start( self, work_done ):
+        """
+        Called when compilation starts
+        """
+        pass
     def on_compilation_finished( self, work_done ):
         """
         Called when rendering has finished
@@ -412,6 +674,7 @@ class LetterPreviewRenderer( LetterRenderer ):
         if sys.platform.startswith( 'darwin' ):
             subprocess.call( ["open", "-W", filepath], stdout=FNULL, stderr=FNULL )
         elif sys.platform.startswith( 'linux' ):
+            from gi.repository import Gio # imported here, so that rendering works without a display stack
             # FIXME: On Linux, we need to use gi.repository.Gio, because I don't want to parse all that fucking XDG info, just coz it doesn't have a WAIT option
             mime_type, must_support_uris = Gio.content_type_guess( filepath )
             app_info = Gio.AppInfo.get_default_for_type( mime_type, must_support_uris )
@@ -425,6 +688,6 @@ class LetterPreviewRenderer( LetterRenderer ):
             subprocess.call( ["start", "/WAIT", filepath], stdout=FNULL, stderr=FNULL, shell=True )
         if delete_file_after:
             os.remove( filepath )
-    def on_finished( self, rendered_letters ):
-        super().on_finished( rendered_letters )
+    def on_finished( self, latex_file ):
+        super().on_finished( latex_file )
         self.__class__.show_viewer( self._output_file, delete_file_after=True )
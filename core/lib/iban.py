@@ -39,9 +39,17 @@ Usage as module:
     else:
         print( "  Correct IBAN: %s >> %s %s %s %s" % (iban, code, checksum, )
                                                      bank, account)
+
+    # Many IBANs at once (no exceptions, one result per IBAN)
+    for parts, err in check_ibans( ibans ):
+        ...
 """
 
-__all__ = ["create_iban", "check_iban", "IBANError"]
+import functools
+import re
+import string
+
+__all__ = ["create_iban", "check_iban", "check_ibans", "IBANError"]
 
 usage = \
 """Create or check International Bank Account Numbers (IBAN).
@@ -67,8 +75,14 @@ Information about IBAN are from European Committee for Banking Standards
 (www.ecbs.org/iban.htm). IBAN is an ISO standard (ISO 13616: 1997).
 """
 
+_part_patterns = { "n": "[0-9]", "a": "[A-Z]", "c": "[0-9A-Za-z]" }
+
 class Country:
-    """Class for country specific iban data."""
+    """Class for country specific iban data.
+
+    The lengths and the syntax patterns of the parts are computed once, so
+    that checking an IBAN is just a dict lookup and a regular expression.
+    """
 
     def __init__( self, name, code, bank_form, acc_form ):
         """Constructor for Country objects.
@@ -83,21 +97,31 @@ class Country:
         self.code = code
         self.bank = self._decode_format( bank_form )
         self.acc = self._decode_format( acc_form )
+        self._bank_lng = sum( lng for lng, typ in self.bank )
+        self._acc_lng = sum( lng for lng, typ in self.acc )
+        self._total_lng = 4 + self._bank_lng + self._acc_lng
+        bank_pattern = self._compile_format( self.bank )
+        acc_pattern = self._compile_format( self.acc )
+        self.bank_re = re.compile( bank_pattern )
+        self.acc_re = re.compile( acc_pattern )
+        # Checksum and BBAN, matched from position 2 of the IBAN
+        self.iban_re = re.compile( "[0-9]{2}" + bank_pattern + acc_pattern )
+        # Country code as digits for the checksum (A = 10, ..., Z = 35)
+        self.code_digits = "".join( str( ord( ch ) - ord( "A" ) + 10 ) for ch in code )
 
     def bank_lng( self ):
-        total = 0
-        for part in self.bank:
-            total += part[0]
-        return total
+        return self._bank_lng
 
     def acc_lng( self ):
-        total = 0
-        for part in self.acc:
-            total += part[0]
-        return total
+        return self._acc_lng
 
     def total_lng( self ):
-        return 4 + self.bank_lng() + self.acc_lng()
+        return self._total_lng
+
+    @staticmethod
+    def _compile_format( form_list ):
+        """Convert a decoded format to a regular expression (for fullmatch)."""
+        return "".join( "%s{%d}" % ( _part_patterns[typ], lng ) for lng, typ in form_list if lng )
 
     def _decode_format( self, form ):
         form_list = []
@@ -170,23 +194,21 @@ iban_data = ( Country( "Andorra", "AD", "0  4n 4n", "0  12   0 " ),
              Country( "Tunisia", "TN", "0  2n 3n", "0  13n  2n" ),
              Country( "Turkey", "TR", "0  5n 0 ", "1  16   0 " ) )
 
+iban_countries = dict( ( country.code, country ) for country in iban_data )
+
 def country_data( code ):
     """Search the country code in the iban_data list."""
-    for country in iban_data:
-        if country.code == code:
-            return country
-    return None
+    return iban_countries.get( code )
 
 def mod97( digit_string ):
-    """Modulo 97 for huge numbers given as digit strings.
+    """Modulo 97 for huge numbers given as digit strings."""
+    return int( digit_string ) % 97
 
-    This function is a prototype for a JavaScript implementation.
-    In Python this can be done much easier: long(digit_string) % 97.
-    """
-    m = 0
-    for d in digit_string:
-        m = ( m * 10 + int( d ) ) % 97
-    return m
+_checksum_re = re.compile( "[0-9]{2}" )
+
+# Letters are replaced by two digits (A = 10, ..., Z = 35)
+_letter_digits = str.maketrans( dict( ( ch, str( ord( ch ) - ord( "A" ) + 10 ) )
+                                      for ch in string.ascii_uppercase ) )
 
 def fill0( s, l ):
     """Fill the string with leading zeros until length is reached."""
@@ -204,33 +226,13 @@ def strcmp( s1, s2 ):
 
 def country_index_table():
     """Create an index table of the iban_data list sorted by country names."""
-    tab = range( len( iban_data ) )
-    for i in range( len( tab ) - 1, 0, -1 ):
-        for j in range( i ):
-            if strcmp( iban_data[tab[j]].name, iban_data[tab[j + 1]].name ) > 0:
-                t = tab[j]; tab[j] = tab[j + 1]; tab[j + 1] = t
-    return tab
+    key = functools.cmp_to_key( lambda i, j: strcmp( iban_data[i].name, iban_data[j].name ) )
+    return sorted( range( len( iban_data ) ), key=key )
 
 def checksum_iban( iban ):
     """Calculate 2-digit checksum of an IBAN."""
-    code = iban[:2]
-    checksum = iban[2:4]
-    bban = iban[4:]
-
-    # Assemble digit string
-    digits = ""
-    for ch in bban.upper():
-        if ch.isdigit():
-            digits += ch
-        else:
-            digits += str( ord( ch ) - ord( "A" ) + 10 )
-    for ch in code:
-        digits += str( ord( ch ) - ord( "A" ) + 10 )
-    digits += checksum
-
-    # Calculate checksum
-    checksum = 98 - mod97( digits )
-    return fill0( str( checksum ), 2 )
+    digits = ( iban[4:].upper() + iban[:4] ).translate( _letter_digits )
+    return "%02d" % ( 98 - int( digits ) % 97 )
 
 def fill_account( country, account ):
     """Fill the account number part of IBAN with leading zeros."""
@@ -241,26 +243,20 @@ def invalid_part( form_list, iban_part ):
     for lng, typ in form_list:
         if lng > len( iban_part ):
             lng = len( iban_part )
-        for ch in iban_part[:lng]:
-            a = ( "A" <= ch <= "Z" )
-            n = ch.isdigit()
-            c = n or a or ( "a" <= ch <= "z" )
-            if ( not c and typ == "c" ) or \
-               ( not a and typ == "a" ) or \
-               ( not n and typ == "n" ):
-                return 1
+        if lng and not re.fullmatch( "%s{%d}" % ( _part_patterns[typ], lng ), iban_part[:lng] ):
+            return 1
         iban_part = iban_part[lng:]
     return 0
 
 def invalid_bank( country, bank ):
     """Check if syntax of the bank/branch code part of IBAN is invalid."""
     return len( bank ) != country.bank_lng() or \
-           invalid_part( country.bank, bank )
+           not country.bank_re.fullmatch( bank )
 
 def invalid_account( country, account ):
     """Check if syntax of the account number part of IBAN is invalid."""
     return len( account ) > country.acc_lng() or \
-           invalid_part( country.acc, fill_account( country, account ) )
+           not country.acc_re.fullmatch( fill_account( country, account ) )
 
 def calc_iban( country, bank, account, alternative=0 ):
     """Calculate the checksum and assemble the IBAN."""
@@ -305,41 +301,70 @@ def create_iban( code, bank, account, alternative=0 ):
         raise IBANError( err )
     return calc_iban( country, bank, account, alternative )
 
-def check_iban( iban ):
+def _check_iban( iban ):
     """Check the syntax and the checksum of an IBAN.
 
-    Return the parts of the IBAN: Country Code, Checksum, Bank/Branch Code and
-    Account number.
-    Raise an IBANError exception if the input is not correct.
+    Return a tuple of the parts of the IBAN (or None) and an error message
+    (or None). Shared by check_iban() and check_ibans().
     """
     err = None
     code = iban[:2]
     checksum = iban[2:4]
     bban = iban[4:]
-    country = country_data( code )
+    country = iban_countries.get( code )
     if not country:
         err = "Unknown Country Code: %s" % code
-    elif len( iban ) != country.total_lng():
+    elif len( iban ) != country._total_lng:
         err = "IBAN length %s is not correct for %s (%s)" % \
-              ( len( iban ), country.name, country.total_lng() )
+              ( len( iban ), country.name, country._total_lng )
     else:
-        bank_lng = country.bank_lng()
+        bank_lng = country._bank_lng
         bank = bban[:bank_lng]
         account = bban[bank_lng:]
+        if country.iban_re.fullmatch( iban, 2 ):
+            # The common case: the syntax is correct, so only the checksum
+            # is left. Most BBANs have only digits and need no translation.
+            if bban.isdigit():
+                digits = bban + country.code_digits + checksum
+            else:
+                digits = bban.upper().translate( _letter_digits ) + country.code_digits + checksum
+            if int( digits ) % 97 == 1:
+                return ( code, checksum, bank, account ), None
         if invalid_bank( country, bank ):
             err = "Bank/Branch Code %s is not correct for %s" % \
                   ( bank, country.name )
         elif invalid_account( country, account ):
             err = "Account Number %s is not correct for %s" % \
                   ( account, country.name )
-        elif not( checksum.isdigit() ):
+        elif not _checksum_re.fullmatch( checksum ):
             err = "IBAN Checksum %s is not numeric" % checksum
         elif not iban_okay( iban ):
             err = "Incorrect IBAN: %s >> %s %s %s %s" % \
                   ( iban, code, checksum, bank, account )
+    return None, err
+
+def check_iban( iban ):
+    """Check the syntax and the checksum of an IBAN.
+
+    Return the parts of the IBAN: Country Code, Checksum, Bank/Branch Code and
+    Account number.
+    Raise an IBANError exception if the input is not correct.
+    """
+    parts, err = _check_iban( iban )
     if err:
         raise IBANError( err )
-    return code, checksum, bank, account
+    return parts
+
+def check_ibans( ibans ):
+    """Check the syntax and the checksum of many IBANs.
+
+    Return a list with a tuple ( parts, error message ) for each IBAN, where
+    parts are the parts returned by check_iban() and None if the IBAN is not
+    correct, and the error message is None if the IBAN is correct.
+    Doesn't raise IBANError, so that a batch with invalid IBANs is as fast as
+    a batch of correct ones.
+    """
+    return [_check_iban( iban ) for iban in ibans]
 
 def print_new_iban( code, bank, account ):
     """Check the input, calculate the checksum, assemble and print the IBAN."""
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+    This file is part of MSM.
+
+    MSM is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    MSM is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with MSM.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import collections
+import threading
+import time
+from core.lib.timing import PhaseTimer
+class JobCancelled( Exception ):
+    """
+    Raised by JobHandle.check_cancelled() when the job was cancelled.
+    """
+    pass
+def format_duration( seconds ):
+    """
+    Formats a number of seconds as "m:ss" or "h:mm:ss".
+    """
+    minutes, seconds = divmod( int( round( seconds ) ), 60 )
+    hours, minutes = divmod( minutes, 60 )
+    if hours:
+        return "{}:{:02d}:{:02d}".format( hours, minutes, seconds )
+    return "{}:{:02d}".format( minutes, seconds )
+class JobStatus( collections.namedtuple( 'JobStatus', ( 'stage', 'done', 'total', 'items_per_second', 'eta', 'elapsed', 'stage_times', 'cancelled', 'finished' ) ) ):
+    """
+    Snapshot of the state of a job, see JobHandle.status().
+        stage: name of the current stage (or None before the first one)
+        done, total: progress of the current stage (total may be None)
+        items_per_second: moving average of the throughput of the current stage (or None)
+        eta: estimated seconds until the current stage is done (None when unknown or finished)
+        elapsed: seconds since the job was started
+        stage_times: list of ( stage, seconds ) tuples, including the current stage
+        cancelled, finished: bool
+    """
+    __slots__ = ()
+    def format( self ):
+        """
+        Formats the progress of the current stage, e.g. "render: 120/300, 35.2/s, ETA 0:05".
+        """
+        if self.stage is None:
+            return ""
+        text = "{}: {}".format( self.stage, self.done )
+        if self.total is not None:
+            text += "/{}".format( self.total )
+        if self.items_per_second is not None:
+            text += ", {:.1f}/s".format( self.items_per_second )
+        if self.eta is not None:
+            text += ", ETA {}".format( format_duration( self.eta ) )
+        return text
+class JobHandle:
+    """
+    Common handle of a background job: The job reports its stages and
+    progress to it and checks it for cancellation, while other threads (the
+    GUI, the CLI) read its status or are notified by listeners.
+    Usage:
+        # in the job
+        job.start_stage( "export", total=len( contracts ) )
+        for i, contract in enumerate( contracts, start=1 ):
+            job.check_cancelled()
+            ...
+            job.advance( i )
+        job.finish()
+        # elsewhere
+        job.add_listener( lambda job: print( job.status().format() ) )
+        job.cancel()
+    Cancellation is cooperative: cancel() only sets a flag, the job stops at
+    its next check_cancelled() and raises JobCancelled.
+    """
+    SAMPLE_INTERVAL = 0.5 # minimum seconds between two throughput samples
+    SMOOTHING = 0.3 # weight of the latest sample in the moving average
+    def __init__( self, listener_interval=0.2 ):
+        """
+        __init__ function.
+        Arguments:
+            listener_interval:
+                minimum seconds between two progress notifications of the
+                listeners (stage changes and the end are always notified)
+        """
+        self._lock = threading.Lock()
+        self._cancel_event = threading.Event()
+        self._listeners = []
+        self._listener_interval = listener_interval
+        self._last_notified = None
+        self._start = time.perf_counter()
+        self._timer = PhaseTimer( self._start )
+        self._stage = None
+        self._stage_start = self._start
+        self._end = None # time of finish()
+        self._done = 0
+        self._total = None
+        self._rate = None
+        self._sample = ( self._start, 0 )
+        self._finished = False
+    # Cancellation
+    def cancel( self ):
+        """
+        Asks the job to stop at its next check_cancelled(). Can be called from any thread.
+        """
+        self._cancel_event.set()
+        self._notify( force=True )
+    @property
+    def cancelled( self ):
+        return self._cancel_event.is_set()
+    def check_cancelled( self ):
+        """
+        Raises:
+            JobCancelled if cancel() was called
+        """
+        if self._cancel_event.is_set():
+            raise JobCancelled()
+    # Progress reporting (called by the job)
+    def start_stage( self, name, total=None ):
+        """
+        Ends the current stage and starts a new one.
+        """
+        now = time.perf_counter()
+        with self._lock:
+            if self._stage is not None:
+                self._timer.add( self._stage, now - self._stage_start )
+            self._stage = name
+            self._stage_start = now
+            self._done = 0
+            self._total = total
+            self._rate = None
+            self._sample = ( now, 0 )
+        self._notify( force=True )
+    def advance( self, done, total=None ):
+        """
+        Sets the number of items of the current stage that are done (and the total, if it is known now).
+        """
+        now = time.perf_counter()
+        with self._lock:
+            self._done = done
+            if total is not None:
+                self._total = total
+            sample_time, sample_done = self._sample
+            if now - sample_time >= self.SAMPLE_INTERVAL:
+                rate = ( done - sample_done ) / ( now - sample_time )
+                self._rate = rate if self._rate is None else self._rate + self.SMOOTHING * ( rate - self._rate )
+                self._sample = ( now, done )
+        self._notify()
+    def update( self, stage, done, total=None ):
+        """
+        Reports progress like the on_progress( stage, done, total ) callbacks
+        of the InvoicingEngine, i.e. starts the stage if it is a new one.
+        """
+        if stage != self._stage:
+            self.start_stage( stage, total )
+        self.advance( done, total )
+    def track( self, iterable ):
+        """
+        Generator that yields the items of iterable, checks for cancellation
+        before each one and advances the current stage after each one.
+        """
+        done = 0
+        for item in iterable:
+            self.check_cancelled()
+            yield item
+            done += 1
+            self.advance( done )
+    def finish( self ):
+        """
+        Ends the current stage and the job.
+        """
+        now = time.perf_counter()
+        with self._lock:
+            if self._finished:
+                return
+            if self._stage is not None:
+                self._timer.add( self._stage, now - self._stage_start )
+            self._end = now
+            self._finished = True
+        self._notify( force=True )
+    # Reading (from any thread)
+    @property
+    def finished( self ):
+        with self._lock:
+            return self._finished
+    def status( self ):
+        """
+        Returns:
+            a JobStatus snapshot
+        """
+        with self._lock:
+            now = self._end if self._end is not None else time.perf_counter() # frozen by finish()
+            stage_times = self._timer.phases
+            if self._stage is not None and not self._finished:
+                stage_times.append( ( self._stage, now - self._stage_start ) )
+            rate = self._rate
+            if rate is None and now - self._stage_start > 0 and self._done:
+                rate = self._done / ( now - self._stage_start ) # until the first sample
+            eta = None
+            if rate and self._total is not None and not self._finished:
+                eta = max( 0.0, ( self._total - self._done ) / rate )
+            return JobStatus( self._stage, self._done, self._total, rate, eta, now - self._start,
+                              stage_times, self._cancel_event.is_set(), self._finished )
+    def add_listener( self, callback ):
+        """
+        Adds a callable that is called with this JobHandle (in the thread of
+        the job) when the stage or the progress changes, the job is
+        cancelled or finished.
+        """
+        self._listeners.append( callback )
+    def remove_listener( self, callback ):
+        self._listeners.remove( callback )
+    def _notify( self, force=False ):
+        if not self._listeners:
+            return
+        now = time.perf_counter()
+        with self._lock:
+            if not force and self._last_notified is not None and now - self._last_notified < self._listener_interval:
+                return
+            self._last_notified = now
+        for callback in list( self._listeners ):
+            callback( self )
@@ -1,10 +1,43 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
+import logging
+logger = logging.getLogger( __name__ )
 import abc
+import os
 import threading
+import time
 import queue
+from core.lib.job import JobHandle, JobCancelled
+# Sentinel that is passed through the queues: in the input queue it tells a
+# worker thread to exit, in the output queue it tells that a worker exited.
+_STOP = object()
+def default_num_worker_threads():
+    """
+    Returns the default size of the thread pool: the number of CPU cores.
+    """
+    return os.cpu_count() or 1
 class AbstractQueue:
     """
+    A pool of worker threads with a bounded input and a bounded output queue.
+    The inputs are fed into the input queue by a feeder thread, so that at
+    most queue_size of them are waiting for a worker at any time, and the
+    workers block when the consumer doesn't keep up with taking outputs.
+    When all inputs are fed, one stop sentinel per worker is put into the
+    input queue; each worker passes it on to the output queue when it exits,
+    so nothing has to be polled.
+    The inputs are passed to the workers in numbered chunks and each worker
+    returns the outputs of a chunk at once, so that cheap work isn't
+    dominated by the queue overhead. Unless a chunk_size is given, the
+    chunk size is adapted to the measured time per input, so that a chunk
+    takes about TARGET_CHUNK_TIME seconds, and chunks get smaller towards
+    the end to keep all workers busy.
+    The chunk numbers let outputs(ordered=True) return the outputs in the
+    order of the inputs. At most window chunks are fed before their outputs
+    have been taken, which bounds the memory that is needed for reordering,
+    no matter how many inputs there are.
+    Subclasses can override _create_executor() to let the worker threads pass
+    their work to a concurrent.futures.Executor, e.g. a process pool for CPU
+    bound work (see AbstractQueueThread.execute()).
     Usage:
         class InheritedQueue(AbstractQueue):
             def _create_thread(self):
@@ -12,23 +45,51 @@ class AbstractQueue:
         q = InheritedQueue()
         q.put_multiple(obj)
         q.start()
-        while not q.work_finished:
-            # Blocking 'get' from a Queue.
-            output = q.get()
+        for output in q.outputs():
             print(output)
         q.join()
     """
     __metaclass__ = abc.ABCMeta
-    def __init__( self, num_worker_threads=None ):
+    TARGET_CHUNK_TIME = 0.05 # seconds
+    MAX_CHUNK_SIZE = 64
+    ITEM_TIME_SMOOTHING = 0.3 # weight of the latest chunk in the moving average
+    def __init__( self, num_worker_threads=None, queue_size=None, window=None, chunk_size=None ):
+        """
+        __init__ function.
+        Arguments:
+            num_worker_threads:
+                size of the thread pool (default: number of CPU cores)
+            queue_size:
+                maximum number of waiting input and output chunks (default: twice the pool size)
+            window:
+                maximum number of chunks whose outputs haven't been taken yet (default: twice the queue size)
+            chunk_size:
+                number of inputs per chunk (default: adapted to the time per input)
+        """
+        if num_worker_threads is None:
+            num_worker_threads = default_num_worker_threads()
+        if queue_size is None:
+            queue_size = 2 * num_worker_threads
+        if window is None:
+            window = 2 * queue_size
         # Create a single input and a single output queue for all threads.
-        self._input_queue = queue.Queue()
-        self._output_queue = queue.Queue()
-        self._work_left = 0 # How much work is left
-        self._work_started = 0
+        self._input_queue = queue.Queue( queue_size )
+        self._output_queue = queue.Queue( queue_size )
+        self._inputs = [] # iterables that will be fed to the input queue
+        self._lock = threading.Lock()
+        self._window = threading.Semaphore( window )
+        self._work_started = 0 # number of inputs
+        self._work_done = 0 # number of outputs taken by get()
+        self._chunk_size = chunk_size
+        self._item_time = None # moving average of the seconds per input
+        self._unordered_outputs = None # generator used by get()
+        self._threads_running = num_worker_threads
+        self._started = False
+        self._cancelled = threading.Event()
+        self._executor = None
+        self._feeder = threading.Thread( target=self._feed, daemon=True )
         # Create the "thread pool"
         self._pool = []
-        if num_worker_threads is None:
-            num_worker_threads = 4
         for i in range( num_worker_threads ):
             thread = self._create_thread()
             thread.set_input_queue( self._input_queue )
@@ -37,68 +98,306 @@ class AbstractQueue:
     @abc.abstractmethod
     def _create_thread( self ):
         pass
+    def _create_executor( self ):
+        """
+        Called by start().
+        Returns:
+            the executor that the worker threads pass their work to, or None
+            if they do the work themselves
+        """
+        return None
+    @property
+    def num_worker_threads( self ):
+        return len( self._pool )
     @property
     def work_left( self ):
-        return self._work_left
+        with self._lock:
+            return self._work_started - self._work_done
     @property
     def work_started( self ):
-        return self._work_started
+        with self._lock:
+            return self._work_started
     @property
     def work_done( self ):
-        return ( self.work_started - self.work_left )
+        with self._lock:
+            return self._work_done
+    @property
+    def item_time( self ):
+        """
+        Moving average of the seconds that a worker needs per input, or None
+        if no chunk is done yet.
+        """
+        with self._lock:
+            return self._item_time
+    @property
+    def work_finished( self ):
+        """
+        True when all workers have exited and all outputs have been taken.
+        """
+        with self._lock:
+            return self._threads_running == 0 and self._output_queue.empty()
     def start( self ):
-        self._work_started = self._work_left
-        # Start all threads
+        """
+        Starts the worker threads and feeding the inputs.
+        """
+        self._started = True
+        self._executor = self._create_executor()
         for thread in self._pool:
+            thread.set_executor( self._executor )
             thread.start()
+        self._feeder.start()
+    def cancel( self ):
+        """
+        Stops feeding inputs to the workers. The chunks that were already fed
+        are still processed, then the outputs end.
+        """
+        self._cancelled.set()
+    @property
+    def cancelled( self ):
+        return self._cancelled.is_set()
+    def _feed( self ):
+        try:
+            for chunk_no, chunk in enumerate( self._chunks() ):
+                self._window.acquire()
+                if self._cancelled.is_set():
+                    break
+                self._input_queue.put( ( chunk_no, chunk ) )
+        except Exception:
+            logger.exception( "Reading the inputs failed" )
+        finally:
+            self._inputs = []
+            # The workers must always be stopped, otherwise get() would wait forever
+            for thread in self._pool:
+                self._input_queue.put( _STOP )
+    def _chunks( self ):
+        """
+        Generator that yields the inputs in lists of get_chunk_size() inputs.
+        """
+        all_sized = all( hasattr( inputs, '__len__' ) for inputs in self._inputs )
+        num_fed = 0
+        chunk = []
+        chunk_size = self.get_chunk_size( 0 if all_sized else None )
+        for inputs in self._inputs:
+            sized = hasattr( inputs, '__len__' )
+            for obj in inputs:
+                if not sized:
+                    with self._lock:
+                        self._work_started += 1
+                chunk.append( obj )
+                if len( chunk ) >= chunk_size:
+                    num_fed += len( chunk )
+                    yield chunk
+                    chunk = []
+                    chunk_size = self.get_chunk_size( num_fed if all_sized else None )
+        if chunk:
+            yield chunk
+    def get_chunk_size( self, num_fed=None ):
+        """
+        Returns the size of the next chunk.
+        Arguments:
+            num_fed:
+                number of inputs fed so far, or None if the total number of inputs isn't known
+        """
+        if self._chunk_size:
+            return self._chunk_size
+        with self._lock:
+            item_time = self._item_time
+            work_started = self._work_started
+        if item_time is None:
+            return 1 # nothing measured yet
+        chunk_size = self.MAX_CHUNK_SIZE
+        if item_time > 0:
+            chunk_size = min( chunk_size, int( self.TARGET_CHUNK_TIME / item_time ) )
+        if num_fed is not None:
+            # Leave enough chunks for all workers until the end
+            chunk_size = min( chunk_size, ( work_started - num_fed ) // ( 2 * self.num_worker_threads ) )
+        return max( 1, chunk_size )
     def put( self, obj ):
         """
-        Puts an input object into the input queue. The object will be passed to the worker threads.
+        Adds an input object. The object will be passed to the worker threads.
         """
-        self._input_queue.put( obj )
-        self._work_left += 1
+        self.put_multiple( ( obj, ) )
     def put_multiple( self, obj_list ):
         """
-        Convenience method put multiple inputs into the input queue at once (preserving the order).
+        Adds multiple inputs (preserving the order). obj_list may also be an
+        iterator, it is consumed while the workers run.
         """
-        for obj in obj_list:
-            self.put( obj )
+        if self._started:
+            raise RuntimeError( "inputs have to be added before the queue is started" )
+        self._inputs.append( obj_list )
+        if hasattr( obj_list, '__len__' ):
+            with self._lock:
+                self._work_started += len( obj_list )
+    def _get_chunk( self ):
+        """
+        Returns:
+            the next ( chunk number, outputs ) tuple in completion order
+        Raises:
+            queue.Empty if all workers have exited and there is no output left
+        """
+        while True:
+            with self._lock:
+                if self._threads_running == 0 and self._output_queue.empty():
+                    raise queue.Empty()
+            item = self._output_queue.get()
+            if item is _STOP:
+                with self._lock:
+                    self._threads_running -= 1
+                continue
+            chunk_no, output_objs, elapsed = item
+            if output_objs:
+                with self._lock:
+                    item_time = elapsed / len( output_objs )
+                    if self._item_time is None:
+                        self._item_time = item_time
+                    else:
+                        self._item_time += self.ITEM_TIME_SMOOTHING * ( item_time - self._item_time )
+            return chunk_no, output_objs
+    def _output_chunks( self, ordered ):
+        """
+        Generator that yields the output lists of the chunks, in completion or in input order.
+        """
+        if ordered:
+            ready = []
+            sink = OrderedSink( ready.append )
+        while True:
+            try:
+                chunk_no, output_objs = self._get_chunk()
+            except queue.Empty:
+                return
+            if not ordered:
+                self._window.release()
+                yield output_objs
+                continue
+            sink.put( chunk_no, output_objs )
+            for output_objs in ready:
+                self._window.release()
+                yield output_objs
+            ready.clear()
     def get( self ):
         """
         Gets an output from the output_queue.
         Returns:
-            the next output from the output queue
+            the next output in completion order
+        Raises:
+            queue.Empty if all workers have exited and there is no output left
+        """
+        if self._unordered_outputs is None:
+            self._unordered_outputs = self.outputs()
+        try:
+            return next( self._unordered_outputs )
+        except StopIteration:
+            raise queue.Empty()
+    def outputs( self, ordered=False ):
+        """
+        Generator that yields the outputs until all workers have exited.
+        Arguments:
+            ordered:
+                yield the outputs in the order of the inputs instead of the
+                completion order (each output as soon as all outputs of
+                the inputs before it are done)
         """
-        obj = self._output_queue.get()
-        self._work_left -= 1
-        return obj
+        for output_objs in self._output_chunks( ordered ):
+            for obj in output_objs:
+                with self._lock:
+                    self._work_done += 1
+                yield obj
     def join( self ):
         """
-        Ask threads to die and wait for them to do it
+        Waits for the feeder and the worker threads to exit and shuts the
+        executor down.
         """
+        self._feeder.join()
         for thread in self._pool:
             thread.join()
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+class OrderedSink:
+    """
+    Reorder buffer: takes objects with their sequence numbers in any order
+    and passes them to the consumer in the order of the sequence numbers, as
+    soon as they are contiguous. Only the objects that wait for an earlier
+    one are held.
+    Usage:
+        sink = OrderedSink( f.write )
+        sink.put( 1, "b" )
+        sink.put( 0, "a" ) # writes "a" and "b"
+    """
+    def __init__( self, consumer, first_seq=0 ):
+        """
+        __init__ function.
+        Arguments:
+            consumer:
+                callable that is called with each object, in order
+            first_seq:
+                sequence number of the first object
+        """
+        self._consumer = consumer
+        self._next_seq = first_seq
+        self._pending = {}
+    @property
+    def next_seq( self ):
+        return self._next_seq
+    @property
+    def num_pending( self ):
+        return len( self._pending )
+    def put( self, seq, obj ):
+        """
+        Adds an object and passes it and all following contiguous objects to the consumer.
+        """
+        if seq < self._next_seq or seq in self._pending:
+            raise ValueError( "sequence number {} was already put".format( seq ) )
+        self._pending[seq] = obj
+        while self._next_seq in self._pending:
+            self._consumer( self._pending.pop( self._next_seq ) )
+            self._next_seq += 1
 class AbstractQueueThread( threading.Thread ):
-    """ A worker thread that takes directory names from a queue, finds all
-        files in them recursively and reports the result.
-
-        Input is done by placing directory names (as strings) into the
-        Queue passed in dir_q.
-
-        Output is done by placing tuples into the Queue passed in result_q.
-        Each tuple is (thread name, dirname, [list of files]).
-
-        Ask the thread to stop by calling its join() method.
+    """
+    A worker thread that takes chunks of inputs from the input queue, passes
+    them to work_chunk() and puts the outputs into the output queue, until it
+    takes the stop sentinel. By default, work_chunk() calls work() for each
+    input; if work() raises an exception, it is logged and the output is None.
     """
     __metaclass__ = abc.ABCMeta
     def __init__( self ):
-        super().__init__()
+        super().__init__( daemon=True )
         self._input_queue = None
         self._output_queue = None
-        self._stoprequest = threading.Event()
+        self._executor = None
     @abc.abstractmethod
     def work( self, input_obj ):
         pass
+    def work_chunk( self, input_objs ):
+        """
+        Processes a chunk of inputs. Subclasses can override this to process
+        the whole chunk at once, e.g. in a single call to execute().
+        Returns:
+            a list with one output per input
+        """
+        output_objs = []
+        for input_obj in input_objs:
+            try:
+                output_objs.append( self.work( input_obj ) )
+            except Exception:
+                logger.exception( "%s failed to process %r", self.name, input_obj )
+                output_objs.append( None )
+        return output_objs
+    @property
+    def executor( self ):
+        return self._executor
+    def set_executor( self, executor ):
+        self._executor = executor
+    def execute( self, fn, *args ):
+        """
+        Calls fn( *args ) in the executor of the queue and waits for the
+        result, or calls it directly if the queue has no executor. With a
+        process pool, fn has to be a module level function and its arguments
+        and return value have to be picklable.
+        """
+        if self._executor is None:
+            return fn( *args )
+        return self._executor.submit( fn, *args ).result()
     def set_input_queue( self, input_queue ):
         if self._input_queue is not None:
             raise RuntimeWarning( 'thread {} already has an input queue'.format( self ) )
@@ -108,27 +407,48 @@ class AbstractQueueThread( threading.Thread ):
             raise RuntimeWarning( 'thread {} already has an output queue'.format( self ) )
         self._output_queue = output_queue
     def run( self ):
-        # As long as we weren't asked to stop, try to take new tasks from the
-        # queue. The tasks are taken with a blocking 'get', so no CPU
-        # cycles are wasted while waiting.
-        # Also, 'get' is given a timeout, so stoprequest is always checked,
-        # even if there's nothing in the queue.
-        while not self._stoprequest.isSet():
-            try:
-                input_obj = self._input_queue.get( True, 0.05 )
-            except queue.Empty:
-                continue
-            else:
-                output_obj = self.work( input_obj )
-                self._output_queue.put( output_obj )
-    def join( self, timeout=None ):
-        self._stoprequest.set()
-        super().join( timeout )
+        # Blocking 'get's, the thread sleeps until there is work or the stop sentinel.
+        try:
+            while True:
+                item = self._input_queue.get()
+                if item is _STOP:
+                    break
+                chunk_no, input_objs = item
+                start_time = time.perf_counter()
+                try:
+                    output_objs = self.work_chunk( input_objs )
+                except Exception:
+                    logger.exception( "%s failed to process a chunk of %d inputs", self.name, len( input_objs ) )
+                    output_objs = [None] * len( input_objs )
+                self._output_queue.put( ( chunk_no, output_objs, time.perf_counter() - start_time ) )
+        finally:
+            self._output_queue.put( _STOP )
 class QueueWatcherThread( threading.Thread ):
+    """
+    Starts a queue and passes its outputs to the callbacks:
+        on_start( work_left ) before the queue is started,
+        on_output( work_left, output ) for every output,
+        on_progress( work_done, work_started ) at most every progress_interval
+            seconds while outputs come in, and after the last output,
+        on_finished( output_list ) with all outputs when all workers have exited.
+        on_cancelled() instead of on_finished() if the job was cancelled.
+    The outputs come in the order of the inputs, unless ordered is False.
+    Subclasses can override consume() to stream the outputs instead of
+    collecting them.
+    The progress is also reported to the JobHandle self.job as the given
+    stage; cancelling the job cancels the queue. If no job is given, the
+    watcher creates and finishes its own.
+    """
     __metaclass__ = abc.ABCMeta
-    def __init__( self, q ):
+    def __init__( self, q, ordered=True, progress_interval=0.1, job=None, stage='work' ):
         super().__init__()
         self._queue = q
+        self._ordered = ordered
+        self._progress_interval = progress_interval
+        self._owns_job = job is None
+        self.job = job if job is not None else JobHandle()
+        self._stage = stage
+        self._queue_outputs = None # generator of the queue's outputs, see _outputs()
     @property
     def work_left( self ):
         return self._queue.work_left
@@ -140,18 +460,68 @@ class QueueWatcherThread( threading.Thread ):
         return self._queue.work_done
     def run( self ):
         self.on_start( self.work_left )
+        self.job.start_stage( self._stage, self.work_started or None )
         self._queue.start()
-        output_list = []
-        while self.work_left:
-            # Blocking 'get' from a Queue.
-            output = self._queue.get()
-            output_list.append( output )
+        try:
+            self.consume( self._outputs() )
+        except JobCancelled:
+            self.on_cancelled()
+        except Exception:
+            # Don't leave the feeder and the workers blocked on the full queues
+            self._stop_queue()
+            raise
+        finally:
+            if self._owns_job:
+                self.job.finish()
+    def _stop_queue( self ):
+        """
+        Cancels the queue, lets the workers finish the chunks that were
+        already fed (discarding their outputs) and waits for them to exit.
+        """
+        self._queue.cancel()
+        if self._queue_outputs is None:
+            self._queue_outputs = self._queue.outputs( self._ordered )
+        for output in self._queue_outputs:
+            pass
+        self._queue.join()
+    def _outputs( self ):
+        last_progress = None
+        progress_pending = False # the last output wasn't reported by on_progress()
+        self._queue_outputs = outputs = self._queue.outputs( self._ordered )
+        for output in outputs:
+            if self.job.cancelled:
+                break
             self.on_output( self.work_left, output )
+            now = time.monotonic()
+            progress_pending = last_progress is not None and now - last_progress < self._progress_interval
+            if not progress_pending:
+                last_progress = now
+                self._progress()
+            yield output
+        if self.job.cancelled:
+            self._stop_queue()
+            self._progress()
+            raise JobCancelled()
+        if progress_pending:
+            self._progress()
         self._queue.join()
-        self.on_finished( output_list )
+    def _progress( self ):
+        work_done, work_started = self.work_done, self.work_started
+        self.job.advance( work_done, work_started )
+        self.on_progress( work_done, work_started )
+    def consume( self, outputs ):
+        """
+        Takes all outputs from the generator outputs while they are
+        produced. By default they are collected and passed to on_finished().
+        """
+        self.on_finished( list( outputs ) )
     def on_start( self, work_left ):
         pass
     def on_output( self, work_left, output ):
         pass
+    def on_progress( self, work_done, work_started ):
+        pass
+    def on_cancelled( self ):
+        pass
     def on_finished( self, output_list ):
         pass
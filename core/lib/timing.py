@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+    This file is part of MSM.
+
+    MSM is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    MSM is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with MSM.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import contextlib
+import threading
+import time
+class PhaseTimer:
+    """
+    Records the durations of named phases, e.g. of the application startup.
+    Usage:
+        timer = PhaseTimer()
+        with timer.phase( "database" ):
+            database = Database( db_uri )
+        timer.mark( "first window" )
+        for line in timer.report():
+            print( line )
+    Phases may also be recorded from other threads (e.g. background loading).
+    """
+    def __init__( self, start=None ):
+        """
+        __init__ function.
+        Arguments:
+            start:
+                time.perf_counter() value where the timer starts (default: now)
+        """
+        self._start = start if start is not None else time.perf_counter()
+        self._last = self._start
+        self._phases = []
+        self._lock = threading.Lock()
+    def add( self, name, duration ):
+        """
+        Adds a phase with a known duration.
+        """
+        with self._lock:
+            self._phases.append( ( name, duration ) )
+    def mark( self, name ):
+        """
+        Adds a phase that lasted from the previous mark (or the start) until now.
+        Returns:
+            the duration of the phase in seconds
+        """
+        now = time.perf_counter()
+        with self._lock:
+            duration = now - self._last
+            self._last = now
+            self._phases.append( ( name, duration ) )
+        return duration
+    @contextlib.contextmanager
+    def phase( self, name ):
+        """
+        Context manager that adds a phase for the enclosed block.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add( name, time.perf_counter() - start )
+    @property
+    def phases( self ):
+        """
+        A list of ( name, duration ) tuples in the order they were recorded.
+        """
+        with self._lock:
+            return list( self._phases )
+    @property
+    def elapsed( self ):
+        """
+        Seconds since the timer was started.
+        """
+        return time.perf_counter() - self._start
+    def report( self, budget=None ):
+        """
+        Formats the recorded phases as lines of text.
+        Arguments:
+            budget:
+                optional time budget in seconds for the total
+        Returns:
+            a list of strings
+        """
+        phases = self.phases
+        lines = ["{:<30}{:>10.1f} ms".format( name, duration * 1000 ) for name, duration in phases]
+        total = self.elapsed
+        if budget is None:
+            lines.append( "{:<30}{:>10.1f} ms".format( "total", total * 1000 ) )
+        else:
+            status = "OK" if total <= budget else "OVER BUDGET"
+            lines.append( "{:<30}{:>10.1f} ms (budget {:.1f} ms, {})".format( "total", total * 1000, budget * 1000, status ) )
+        return lines
@@ -4,6 +4,7 @@ import operator
 import imp
 from distutils.spawn import find_executable
 import configparser
+import threading
 
 from core import plugintypes
 from yapsy.PluginManager import PluginManager
@@ -167,12 +168,43 @@ class MSMPluginManager(PluginManager):
 
 
 class MSMFilteredPluginManager(FilteredPluginManager):
+    """
+    Plugin manager that only offers available plugins. Plugins are collected
+    on first access (or by calling ensurePluginsCollected() in a background
+    thread), because locating and importing them slows down startup.
+    """
+    def __init__(self, *args, **kwargs):
+        super(MSMFilteredPluginManager, self).__init__(*args, **kwargs)
+        self._collect_lock = threading.RLock()
+        self._collect_started = False
+
     def isPluginOk(self, info):
         return info.is_available
 
+    def ensurePluginsCollected(self):
+        """
+        Collects the plugins unless this has already been done. Blocks while
+        another thread is collecting them.
+        """
+        with self._collect_lock:
+            if not self._collect_started:
+                self._collect_started = True
+                self.collectPlugins()
+
+    def getPluginsOfCategory(self, category_name):
+        self.ensurePluginsCollected()
+        return self._component.getPluginsOfCategory(category_name)
+
+    def getPluginBySlug(self, slug, category="Default"):
+        self.ensurePluginsCollected()
+        return self._component.getPluginBySlug(slug, category)
+
+    def getAllPlugins(self):
+        self.ensurePluginsCollected()
+        return self._component.getAllPlugins()
+
 # Singleton
 PluginManagerSingleton = MSMFilteredPluginManager(MSMPluginManager())
-PluginManagerSingleton.collectPlugins()
 
 if __name__ == "__main__":
     for plugin in PluginManagerSingleton.getAllPlugins():
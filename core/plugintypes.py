@@ -42,7 +42,8 @@ class DirectDebitExportFormatter(AbstractMSMPlugin):
         super(AbstractMSMPlugin, self).__init__()
 
     @abstractmethod
-    def write(self, invoices, output_file, encoding='utf-8'):
+    def write(self, invoices, output_file, control_sum=None):
+        """control_sum is the exact sum of the open balances (if known)."""
         pass
 
     def write_all(self, *args, **kwargs):
@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+    This file is part of MSM.
+
+    MSM is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    MSM is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with MSM.  If not, see <http://www.gnu.org/licenses/>.
+
+    Distance queries over the coordinates of the autocompletion city data,
+    e.g. "subscribers within 20 km of Heidelberg" or "group the shipping
+    addresses by the nearest distribution hub". Needs NumPy.
+"""
+import logging
+logger = logging.getLogger( __name__ )
+import numpy
+import core.autocompletion
+from core.autocompletion import normalize_name
+from core.database import Address, Customer
+EARTH_RADIUS_KM = 6371.0088
+def distance_km( lat1, lon1, lat2, lon2 ):
+    """
+    Great-circle distance (haversine formula) in km. All arguments are in
+    degrees and may be scalars or NumPy arrays (which are broadcast).
+    """
+    lat1, lon1, lat2, lon2 = ( numpy.radians( value ) for value in ( lat1, lon1, lat2, lon2 ) )
+    a = numpy.sin( ( lat2 - lat1 ) / 2 ) ** 2 + numpy.cos( lat1 ) * numpy.cos( lat2 ) * numpy.sin( ( lon2 - lon1 ) / 2 ) ** 2
+    return 2 * EARTH_RADIUS_KM * numpy.arcsin( numpy.sqrt( numpy.minimum( a, 1.0 ) ) )
+class CityGrid:
+    """
+    Spatial index over the cities of a CityInfoStore: the cities are sorted
+    into grid cells of cell_size degrees, so that a query only computes the
+    distances to the cities of the cells near the query point.
+    Usage:
+        grid = CityGrid()
+        for city, distance in grid.within( 49.41, 8.69, 20 ):
+            print( city.zipcode, city.name, distance )
+    """
+    def __init__( self, store=None, countries=None, cell_size=0.25 ):
+        """
+        __init__ function.
+        Arguments:
+            store:
+                the CityInfoStore (default: core.autocompletion.Cities)
+            countries:
+                the tags of the countries to index (default: all)
+            cell_size:
+                edge length of a grid cell in degrees
+        """
+        if store is None:
+            core.autocompletion.ensure_data_loaded()
+            store = core.autocompletion.Cities
+        self._store = store
+        self._cell_size = cell_size
+        self._records = [] # ( tag, position ) per city
+        lats, lons = [], []
+        for tag, table in sorted( store._data.items() ):
+            if countries is not None and tag not in countries:
+                continue
+            lat_column, lon_column = ( table._columns[store.FIELDS.index( field )] for field in ( 'lat', 'lon' ) )
+            lats.append( numpy.frombuffer( lat_column, dtype=numpy.float64 ) )
+            lons.append( numpy.frombuffer( lon_column, dtype=numpy.float64 ) )
+            self._records.extend( ( tag, position ) for position in range( len( table ) ) )
+        self.lat = numpy.concatenate( lats ) if lats else numpy.empty( 0 )
+        self.lon = numpy.concatenate( lons ) if lons else numpy.empty( 0 )
+        # Sort the cities by cell, so that every cell is a slice of self._order
+        rows, cols = self._cells( self.lat, self.lon )
+        self._order = numpy.lexsort( ( cols, rows ) )
+        keys = list( zip( rows[self._order].tolist(), cols[self._order].tolist() ) )
+        self._cell_slices = {}
+        start = 0
+        for i in range( 1, len( keys ) + 1 ):
+            if i == len( keys ) or keys[i] != keys[start]:
+                self._cell_slices[keys[start]] = ( start, i )
+                start = i
+    def __len__( self ):
+        return len( self._records )
+    def _cells( self, lat, lon ):
+        return ( numpy.floor( numpy.asarray( lat ) / self._cell_size ).astype( numpy.int64 ),
+                 numpy.floor( numpy.asarray( lon ) / self._cell_size ).astype( numpy.int64 ) )
+    def get_city( self, index ):
+        """
+        Returns the CityInfo of a city in this grid.
+        """
+        tag, position = self._records[index]
+        return self._store.create( tag, self._store._data[tag].record( position ) )
+    def _candidates( self, lat, lon, radius_km ):
+        """
+        Returns the indexes of the cities in the cells that may contain cities within radius_km.
+        """
+        dlat = numpy.degrees( radius_km / EARTH_RADIUS_KM )
+        coslat = numpy.cos( numpy.radians( min( abs( lat ) + dlat, 89.9 ) ) )
+        dlon = min( dlat / coslat, 180.0 )
+        row_min, col_min = ( int( value ) for value in self._cells( lat - dlat, lon - dlon ) )
+        row_max, col_max = ( int( value ) for value in self._cells( lat + dlat, lon + dlon ) )
+        slices = [self._cell_slices[( row, col )] for row in range( row_min, row_max + 1 ) for col in range( col_min, col_max + 1 ) if ( row, col ) in self._cell_slices]
+        if not slices:
+            return numpy.empty( 0, dtype=numpy.int64 )
+        return numpy.concatenate( [self._order[start:end] for start, end in slices] )
+    def within( self, lat, lon, radius_km ):
+        """
+        Returns the cities within radius_km of a point.
+        Returns:
+            a list of ( CityInfo, distance in km ), sorted by distance
+        """
+        candidates = self._candidates( lat, lon, radius_km )
+        distances = distance_km( lat, lon, self.lat[candidates], self.lon[candidates] )
+        found = numpy.nonzero( distances <= radius_km )[0]
+        found = found[numpy.argsort( distances[found], kind='stable' )]
+        return [( self.get_city( int( candidates[i] ) ), float( distances[i] ) ) for i in found]
+    def nearest( self, lat, lon, k=1 ):
+        """
+        Returns the k nearest cities of a point.
+        Returns:
+            a list of ( CityInfo, distance in km ), sorted by distance
+        """
+        k = min( k, len( self ) )
+        radius_km = self._cell_size * 111.0
+        while True:
+            if radius_km > numpy.pi * EARTH_RADIUS_KM:
+                candidates = numpy.arange( len( self ) ) # the whole earth
+            else:
+                candidates = self._candidates( lat, lon, radius_km )
+            distances = distance_km( lat, lon, self.lat[candidates], self.lon[candidates] )
+            best = numpy.argsort( distances, kind='stable' )[:k]
+            # Cities outside of the searched radius may be missing, so their order isn't known yet
+            if len( best ) == k and ( k == 0 or distances[best[-1]] <= radius_km or radius_km > numpy.pi * EARTH_RADIUS_KM ):
+                return [( self.get_city( int( candidates[i] ) ), float( distances[i] ) ) for i in best]
+            radius_km *= 2
+class AddressPoints:
+    """
+    The coordinates of many Address rows, looked up in bulk by country and
+    zipcode in the city data (if several places share a zipcode, the one with
+    the address's city name is preferred). Addresses without a known zipcode
+    get NaN coordinates and are never found by the queries.
+    Usage:
+        points = AddressPoints.from_session( session )
+        address_ids = points.within( 49.41, 8.69, 20 )
+    """
+    def __init__( self, rows, store=None ):
+        """
+        __init__ function.
+        Arguments:
+            rows:
+                iterable of ( address id, customer id, countrycode, zipcode, city )
+            store:
+                the CityInfoStore (default: core.autocompletion.Cities)
+        """
+        if store is None:
+            core.autocompletion.ensure_data_loaded()
+            store = core.autocompletion.Cities
+        coordinates, ambiguous = self.get_zipcode_coordinates( store )
+        ids, customer_ids, lats, lons = [], [], [], []
+        nan = ( float( 'nan' ), float( 'nan' ) )
+        normalized = {} # many addresses share a city name
+        for address_id, customer_id, countrycode, zipcode, city in rows:
+            key = ( ( countrycode or 'DE' ).upper(), ( zipcode or '' ).strip() )
+            point = None
+            if key in ambiguous:
+                city = city or ''
+                name = normalized.get( city )
+                if name is None:
+                    name = normalized[city] = normalize_name( city )
+                point = ambiguous[key].get( name )
+            if point is None:
+                point = coordinates.get( key, nan )
+            ids.append( address_id )
+            customer_ids.append( customer_id if customer_id is not None else -1 )
+            lats.append( point[0] )
+            lons.append( point[1] )
+        self.ids = numpy.array( ids, dtype=numpy.int64 )
+        self.customer_ids = numpy.array( customer_ids, dtype=numpy.int64 )
+        self.lat = numpy.array( lats, dtype=numpy.float64 )
+        self.lon = numpy.array( lons, dtype=numpy.float64 )
+    @staticmethod
+    def get_zipcode_coordinates( store ):
+        """
+        Returns a dict that maps ( country, zipcode ) to ( lat, lon ) and a dict
+        that maps the zipcodes of several places to dicts of normalized name -> ( lat, lon ).
+        """
+        coordinates = {}
+        names = {}
+        zipcode_field, name_field, lat_field, lon_field = ( store.FIELDS.index( field ) for field in ( 'zipcode', 'name', 'lat', 'lon' ) )
+        for tag, table in store._data.items():
+            columns = table._columns
+            for zipcode, name, lat, lon in zip( columns[zipcode_field], columns[name_field], columns[lat_field], columns[lon_field] ):
+                key = ( tag, zipcode )
+                coordinates.setdefault( key, ( lat, lon ) )
+                names.setdefault( key, {} ).setdefault( name, ( lat, lon ) )
+        ambiguous = dict( ( key, dict( ( normalize_name( name ), point ) for name, point in places.items() ) )
+                          for key, places in names.items() if len( places ) > 1 )
+        return coordinates, ambiguous
+    @classmethod
+    def from_session( cls, session, query=None, store=None ):
+        """
+        Loads the coordinates of all addresses (or the addresses of query) with a single query.
+        """
+        if query is None:
+            query = session.query( Address )
+        rows = query.with_entities( Address.id, Address.customer_id, Address.countrycode, Address.zipcode, Address.city )
+        return cls( rows, store )
+    def __len__( self ):
+        return len( self.ids )
+    @property
+    def located( self ):
+        """
+        Boolean array that is True for the addresses with known coordinates.
+        """
+        return ~numpy.isnan( self.lat )
+    def distances( self, lat, lon ):
+        """
+        Returns the distances of all addresses to a point in km (NaN if unknown).
+        """
+        return distance_km( lat, lon, self.lat, self.lon )
+    def _within( self, lat, lon, radius_km ):
+        # Cheap latitude band filter first, then the exact distance
+        dlat = numpy.degrees( radius_km / EARTH_RADIUS_KM )
+        candidates = numpy.nonzero( numpy.abs( self.lat - lat ) <= dlat )[0]
+        distances = distance_km( lat, lon, self.lat[candidates], self.lon[candidates] )
+        return candidates[distances <= radius_km]
+    def within( self, lat, lon, radius_km ):
+        """
+        Returns the ids of the addresses within radius_km of a point.
+        """
+        return self.ids[self._within( lat, lon, radius_km )]
+    def customers_within( self, lat, lon, radius_km ):
+        """
+        Returns the sorted ids of the customers with an address within radius_km of a point.
+        """
+        customer_ids = numpy.unique( self.customer_ids[self._within( lat, lon, radius_km )] )
+        return customer_ids[customer_ids >= 0]
+    def nearest_hub( self, hubs, chunk_size=65536 ):
+        """
+        Assigns every address to the nearest of some points, e.g. distribution hubs.
+        Arguments:
+            hubs:
+                a list of ( lat, lon )
+            chunk_size:
+                number of addresses per distance matrix
+        Returns:
+            an array with the index of the nearest hub per address (-1 if unknown) and an array of the distances
+        """
+        hubs = numpy.asarray( hubs, dtype=numpy.float64 ).reshape( -1, 2 )
+        result = numpy.full( len( self ), -1, dtype=numpy.int64 )
+        result_distances = numpy.full( len( self ), numpy.nan )
+        if len( hubs ) == 0:
+            return result, result_distances
+        for start in range( 0, len( self ), chunk_size ):
+            end = start + chunk_size
+            distances = distance_km( self.lat[start:end, None], self.lon[start:end, None], hubs[None, :, 0], hubs[None, :, 1] )
+            located = ~numpy.isnan( self.lat[start:end] )
+            nearest = numpy.argmin( numpy.where( numpy.isnan( distances ), numpy.inf, distances ), axis=1 )
+            result[start:end] = numpy.where( located, nearest, -1 )
+            result_distances[start:end] = distances[numpy.arange( len( nearest ) ), nearest]
+        return result, result_distances
+    def group_by_hub( self, hubs ):
+        """
+        Returns a dict that maps the index of each hub to the ids of the addresses
+        that are nearest to it (-1 for the addresses without coordinates).
+        """
+        nearest, distances = self.nearest_hub( hubs )
+        return dict( ( int( hub ), self.ids[nearest == hub] ) for hub in numpy.unique( nearest ) )
+def get_city_coordinates( country, name=None, zipcode=None ):
+    """
+    Returns the ( lat, lon ) of a city by name (ignoring case and accents) or zipcode, or None if it is unknown.
+    """
+    store = core.autocompletion.Cities
+    if zipcode:
+        cities = store.get_all( country, 'zipcode', zipcode )
+    else:
+        cities = store.get_all( country, 'name', name )
+        if not cities:
+            cities = [city for city in store.complete_name( country, name, 1000 ) if normalize_name( city.name ) == normalize_name( name )]
+    if not cities:
+        return None
+    # Big cities have many zipcodes, use their median
+    return ( float( numpy.median( [city.lat for city in cities] ) ), float( numpy.median( [city.lon for city in cities] ) ) )
+def get_customers_near( session, lat, lon, radius_km, points=None, chunk_size=500 ):
+    """
+    Returns the customers that have an address within radius_km of a point.
+    Arguments:
+        points:
+            AddressPoints to use (default: all addresses)
+        chunk_size:
+            number of customers loaded per query
+    Returns:
+        a list of Customers, ordered by id
+    """
+    if points is None:
+        points = AddressPoints.from_session( session )
+    customer_ids = points.customers_within( lat, lon, radius_km ).tolist()
+    customers = []
+    for start in range( 0, len( customer_ids ), chunk_size ):
+        chunk = customer_ids[start:start + chunk_size]
+        customers.extend( session.query( Customer ).filter( Customer.id.in_( chunk ) ).order_by( Customer.id ) )
+    return customers
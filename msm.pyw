@@ -16,6 +16,8 @@
     You should have received a copy of the GNU General Public License
     along with MSM.  If not, see <http://www.gnu.org/licenses/>.
 """
+import time
+startup_time = time.perf_counter()
 import logging
 import logging.config
 import os.path
@@ -25,19 +27,28 @@ def logging_init():
 logging_init()
 logger = logging.getLogger()
 import sys
-from gi.repository import Gtk, Gio, GObject
+import threading
+from core.lib.timing import PhaseTimer
+startup_timer = PhaseTimer( startup_time )
+from gi.repository import Gtk, Gio, GObject, GLib
 from gi.repository.GLib import GError
 import msmgui.main
 from core.config import Config
 from core.database import Database
 import msmgui.lib.exceptionhook
-from msmgui.dialogs.preferences import PreferencesDialog
+startup_timer.mark( "imports" )
 
 class MagazineSubscriptionManager( Gtk.Application ):
-    def __init__( self ):
+    def __init__( self, startup_report=False ):
         """
         __init__ function.
+        Arguments:
+            startup_report:
+                if True, print the startup timing report and quit as soon as the MainWindow is visible
         """
+        self._startup_report = startup_report
+        self.exit_status = 0
+        self._preferencesdialog = None
         Gtk.Application.__init__( self,
                                   application_id="apps.holzhaus.magazinesubscriptionmanager",
                                   flags=Gio.ApplicationFlags.FLAGS_NONE )
@@ -66,6 +77,7 @@ class MagazineSubscriptionManager( Gtk.Application ):
         self.config = Config
         db_uri = self.config.get( "Database", "db_uri" )
         self.database = Database( db_uri )
+        startup_timer.mark( "database" )
         # Start building the GUI
         builder = Gtk.Builder()
         builder.add_from_file( "data/ui/menu.ui" )
@@ -73,9 +85,10 @@ class MagazineSubscriptionManager( Gtk.Application ):
         # add the menubar to the application (Note: NOT the window!)
         self.set_menubar( builder.get_object( "menubar" ) )
         self.set_app_menu( builder.get_object( "appmenu" ) )
+        startup_timer.mark( "menus" )
         self._mainwindow = msmgui.main.MainWindow( self )
-        self._preferencesdialog = PreferencesDialog( self._mainwindow )
         self.add_window( self._mainwindow )
+        startup_timer.mark( "main window" )
         # AppMenu Actions
         settings_action = Gio.SimpleAction.new( "settings", None )
         settings_action.connect( "activate", self.settings_cb )
@@ -85,7 +98,52 @@ class MagazineSubscriptionManager( Gtk.Application ):
         self.add_action( quit_action )
         self._mainwindow.show_all()
         self._mainwindow.present()
+        startup_timer.mark( "show main window" )
         logger.debug( 'Startup finished, presenting MainWindow...' )
+        # Runs as soon as the main loop is idle, i.e. after the window has been drawn
+        GLib.idle_add( self.first_idle_cb )
+    def first_idle_cb( self ):
+        """
+        Called once the MainWindow is visible. Reports the startup timing and
+        loads the data that is not needed for the first window in the background.
+        """
+        startup_timer.mark( "first frame" )
+        budget = float( self.config.get( "Startup", "time_budget" ) )
+        report = startup_timer.report( budget )
+        if startup_timer.elapsed > budget:
+            logger.warning( "Startup took longer than the budget of %.1f s", budget )
+        if self._startup_report:
+            print( "\n".join( report ) )
+            self.exit_status = 0 if startup_timer.elapsed <= budget else 1
+            self.quit()
+            return False
+        for line in report:
+            logger.info( "Startup: %s", line )
+        import core.autocompletion
+        import core.pluginmanager
+        self.preload( "autocompletion data", core.autocompletion.build_indexes )
+        self.preload( "plugins", core.pluginmanager.PluginManagerSingleton.ensurePluginsCollected )
+        return False
+    def preload( self, name, function ):
+        """
+        Calls function in a background thread and logs how long it took.
+        Arguments:
+            name:
+                name of the startup phase
+            function:
+                the function to call
+        """
+        def run():
+            with startup_timer.phase( name ):
+                function()
+            logger.info( "Startup: %s loaded in the background after %.1f ms", name, startup_timer.elapsed * 1000 )
+        threading.Thread( target=run, name="preload-{}".format( name ), daemon=True ).start()
+    @property
+    def preferencesdialog( self ):
+        if self._preferencesdialog is None:
+            from msmgui.dialogs.preferences import PreferencesDialog
+            self._preferencesdialog = PreferencesDialog( self._mainwindow )
+        return self._preferencesdialog
     # Callbacks for AppMenu Actions
     def settings_cb( self, action, parameter ):
         """
@@ -97,7 +155,7 @@ class MagazineSubscriptionManager( Gtk.Application ):
             parameter:
                 the parameter to the activation
         """
-        self._preferencesdialog.show()
+        self.preferencesdialog.show()
     def quit_cb( self, action, parameter ):
         """
         Callback for the "quit"-action of the AppMenu.
@@ -116,6 +174,7 @@ if __name__ == "__main__":
     logger.debug( 'Initializing' )
     msmgui.lib.exceptionhook.install()
     GObject.threads_init() # Yup, we use threading in this application ;-)
-    msmapp = MagazineSubscriptionManager()
+    msmapp = MagazineSubscriptionManager( startup_report="--startup-report" in sys.argv[1:] )
     logger.debug( 'Running app...' )
     msmapp.run( None )
+    sys.exit( msmapp.exit_status )
@@ -24,6 +24,7 @@ from core.pluginmanager import PluginManagerSingleton as pluginmanager, pluginty
 from core.database import Magazine, Issue
 from core.bookingimport import BookingImporter
 from msmgui.assistants.genericimport import GenericImportAssistant, GenericImportSettings
+from msmgui.assistants.genericexport import format_job_progress
 
 
 class GuiLogHandler(logging.Handler):
@@ -47,6 +48,7 @@ class GuiImporter(threading.Thread):
         handler = GuiLogHandler(self._gui_label, level=logging.INFO)
         guilogger = self._importer.logger
         guilogger.addHandler(handler)
+        self._importer.job.add_listener(self._job_update)
         GLib.idle_add(self._gui_spinner.start)
         self._importer.start()
         self._importer.join()
@@ -54,6 +56,14 @@ class GuiImporter(threading.Thread):
         GLib.idle_add(self._gui_assistant.set_page_complete, self._gui_page,
                       True)
         guilogger.removeHandler(handler)
+        self._importer.job.remove_listener(self._job_update)
+
+    def _job_update(self, job):
+        status = job.status()
+        if status.stage == 'analyse' and status.total and not status.finished:
+            text = format_job_progress("Analysiere Datensatz {} von {}...".format(status.done, status.total),
+                                       status)
+            GLib.idle_add(self._gui_label.set_text, text)
 
 
 class FileFormatPluginWrapper(Gtk.FileFilter):
@@ -99,6 +109,7 @@ class BookingImportAssistant(GenericImportAssistant):
         # Start the Thread
         importformat = self.input_filter.plugin_info.plugin_object
         importer = BookingImporter(input_file, importformat)
+        self.set_job(importer.job)
         watcher = GuiImporter(importer, gui_objects)
         watcher.start()
 
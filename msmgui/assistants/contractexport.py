@@ -26,7 +26,7 @@ from core import paths
 from core.pluginmanager import PluginManagerSingleton as pluginmanager, plugintypes
 from core.database import Magazine, Issue
 from core.contractexport import ContractExporter
-from msmgui.assistants.genericexport import GenericExportAssistant, GenericExportSettings
+from msmgui.assistants.genericexport import GenericExportAssistant, GenericExportSettings, format_job_progress
 
 
 class GuiLogHandler(logging.Handler):
@@ -50,6 +50,7 @@ class GuiExporter(threading.Thread):
         handler = GuiLogHandler(self._gui_label, level=logging.INFO)
         guilogger = self._exporter.logger
         guilogger.addHandler(handler)
+        self._exporter.job.add_listener(self._job_update)
         GLib.idle_add(self._gui_spinner.start)
         self._exporter.start()
         self._exporter.join()
@@ -57,6 +58,14 @@ class GuiExporter(threading.Thread):
         GLib.idle_add(self._gui_assistant.set_page_complete, self._gui_page,
                       True)
         guilogger.removeHandler(handler)
+        self._exporter.job.remove_listener(self._job_update)
+
+    def _job_update(self, job):
+        status = job.status()
+        if status.stage == 'export' and status.total and not status.finished:
+            text = format_job_progress("Exportiere {} von {}".format(status.done, status.total),
+                                       status)
+            GLib.idle_add(self._gui_label.set_text, text)
 
 
 class FileFormatPluginWrapper(Gtk.FileFilter):
@@ -117,6 +126,7 @@ class ContractExportAssistant(GenericExportAssistant):
         # Start the Thread
         formatter = self.output_filter.plugin_info.plugin_object
         exporter = ContractExporter(output_file, formatter, magazine, issue, date)
+        self.set_job(exporter.job)
         watcher = GuiExporter(exporter, gui_objects)
         watcher.start()
 class ContractExportSettings( GenericExportSettings ):
@@ -21,6 +21,17 @@ logger = logging.getLogger( __name__ )
 from gi.repository import Gtk, GObject
 from msmgui.widgets.base import ScopedDatabaseObject
 from core import paths
+from core.lib.job import format_duration
+def format_job_progress( text, status ):
+    """
+    Appends the throughput and the estimated remaining time of a JobStatus to a progress text.
+    """
+    details = []
+    if status.items_per_second:
+        details.append( "{:.1f}/s".format( status.items_per_second ) )
+    if status.eta is not None:
+        details.append( "noch {}".format( format_duration( status.eta ) ) )
+    return "{} ({})".format( text, ", ".join( details ) ) if details else text
 class GenericExportAssistant( GObject.GObject, ScopedDatabaseObject ):
     class Page:
         """
@@ -55,6 +66,7 @@ class GenericExportAssistant( GObject.GObject, ScopedDatabaseObject ):
         ScopedDatabaseObject.__init__( self )
         GObject.GObject.__init__( self )
         self.filefilters = filefilters.copy()
+        self._job = None
         # Build GUI
         self.builder = Gtk.Builder()
         self.builder.add_from_file( paths.data("ui","assistants","genericexport.glade" ))
@@ -65,6 +77,11 @@ class GenericExportAssistant( GObject.GObject, ScopedDatabaseObject ):
             self.set_settingswidget( exportsettingswidget )
         # Connect Signals
         self.builder.connect_signals( self )
+    def set_job( self, job ):
+        """
+        Sets the JobHandle of the running export, so that it is cancelled with the assistant.
+        """
+        self._job = job
     def set_settingswidget( self, widget ):
         settingsbox = self.builder.get_object( "exportsettingsbox" )
         for widget in settingsbox.get_children():
@@ -199,11 +216,13 @@ class GenericExportAssistant( GObject.GObject, ScopedDatabaseObject ):
     def cancel_cb( self, assistant ):
         """
         Callback for the "cancel"-signal of the Gtk.Assistant.
-        Hides the assistant.coputer black white
+        Cancels the running job and hides the assistant.
         Arguments:
             assistant:
                 the Gtk.Assistant that emitted the signal
         """
+        if self._job is not None and not self._job.finished:
+            self._job.cancel()
         assistant.hide()
     def apply_cb( self, assistant ):
         # FIXME: What to do here?
@@ -55,6 +55,7 @@ class GenericImportAssistant( GObject.GObject, ScopedDatabaseObject ):
         ScopedDatabaseObject.__init__( self )
         GObject.GObject.__init__( self )
         self.filefilters = filefilters.copy()
+        self._job = None
         # Build GUI
         self.builder = Gtk.Builder()
         self.builder.add_from_file( paths.data("ui","assistants","genericimport.glade" ))
@@ -65,6 +66,11 @@ class GenericImportAssistant( GObject.GObject, ScopedDatabaseObject ):
             self.set_settingswidget( importsettingswidget )
         # Connect Signals
         self.builder.connect_signals( self )
+    def set_job( self, job ):
+        """
+        Sets the JobHandle of the running import, so that it is cancelled with the assistant.
+        """
+        self._job = job
     def set_settingswidget( self, widget ):
         settingsbox = self.builder.get_object( "importsettingsbox" )
         for widget in settingsbox.get_children():
@@ -200,11 +206,13 @@ class GenericImportAssistant( GObject.GObject, ScopedDatabaseObject ):
     def cancel_cb( self, assistant ):
         """
         Callback for the "cancel"-signal of the Gtk.Assistant.
-        Hides the assistant.coputer black white
+        Cancels the running job and hides the assistant.
         Arguments:
             assistant:
                 the Gtk.Assistant that emitted the signal
         """
+        if self._job is not None and not self._job.finished:
+            self._job.cancel()
         assistant.hide()
     def apply_cb( self, assistant ):
         # FIXME: What to do here?
@@ -24,7 +24,7 @@ import dateutil.parser
 from gi.repository import Gtk, GObject, GLib
 from core import paths
 import core.database
-from core.errors import InvoiceError
+from core.invoicing import InvoicingEngine
 import msmgui.widgets.invoicetable
 from msmgui.widgets.base import ScopedDatabaseObject
 class InvoicingAssistant( GObject.GObject, ScopedDatabaseObject ):
@@ -81,48 +81,39 @@ class InvoicingAssistant( GObject.GObject, ScopedDatabaseObject ):
                         'start': ( GObject.SIGNAL_RUN_FIRST, None, () ),
                         'stop': ( GObject.SIGNAL_RUN_FIRST, None, ( int, int ) )
             }
-            def __init__( self, contracts, invoice_options, gui_objects ):
+            def __init__( self, invoice_options, gui_objects ):
                 GObject.GObject.__init__( self )
                 threading.Thread.__init__( self )
-                self.contracts = contracts
                 self.invoice_options = invoice_options
                 self.gui_objects = gui_objects
                 self.invoices = []
             def run( self ):
                 GLib.idle_add( self._gui_start )
                 local_session = core.database.Database.get_scoped_session()
-                i = 1
-                num_contracts = len( self.contracts )
-                for unmerged_contract in self.contracts:
-                    contract = local_session.merge( unmerged_contract ) # add them to the local session
-                    try:
-                        invoice = contract.add_invoice( **self.invoice_options )
-                    except InvoiceError as err:
-                        logger.critical( "Error adding invoice: %r", err )
-                        invoice = None
-                    if invoice is not None:
-                        self.invoices.append( invoice )
-                    i += 1
-                    GLib.idle_add( self._gui_update, i, num_contracts )
+                engine = InvoicingEngine( session=local_session, on_progress=self._progress, **self.invoice_options )
+                contracts = engine.load()
+                self.invoices = engine.generate( contracts )
                 local_session.expunge_all() # expunge everything afterwards
                 local_session.remove()
-                GLib.idle_add( self._gui_stop, len( self.invoices ), num_contracts )
+                GLib.idle_add( self._gui_stop, len( self.invoices ), len( contracts ) )
+            def _progress( self, stage, done, total ):
+                GLib.idle_add( self._gui_update, stage, done, total )
             def _gui_start( self ):
                 invoicingassistant, spinner, label, assistant, page, invoicetable = self.gui_objects
                 label.set_text( "Generiere Rechnungen..." )
                 spinner.start()
-            def _gui_update( self, contract_current, contract_total ):
+            def _gui_update( self, stage, done, total ):
                 invoicingassistant, spinner, label, assistant, page, invoicetable = self.gui_objects
-                label.set_text( "Generiere Rechnungen... (Vertrag {}/{})".format( contract_current, contract_total ) )
+                if stage == 'load':
+                    label.set_text( "Lade Verträge... ({}/{})".format( done, total ) )
+                else:
+                    label.set_text( "Generiere Rechnungen... (Vertrag {}/{})".format( done, total ) )
             def _gui_stop( self, num_invoices, num_contracts ):
                 invoicingassistant, spinner, label, assistant, page, invoicetable = self.gui_objects
-                merged_contracts = []
-                for unmerged_contract in self.contracts:
-                    contract = invoicingassistant.session.merge( unmerged_contract ) # Readd the object to the main thread session
-                    merged_contracts.append( contract )
-                self.contracts = merged_contracts
+                for invoice in self.invoices:
+                    invoice.contract = invoicingassistant.session.merge( invoice.contract, load=False ) # Readd the object to the main thread session
                 invoicetable.clear()
-                def gen( invoicetable, invoices, session, step=10 ):
+                def gen( invoicetable, invoices, step=10 ):
                     treeview = invoicetable.builder.get_object( "invoices_treeview" )
                     model = invoicetable.builder.get_object( "invoices_liststore" )
                     treeview.freeze_child_notify()
@@ -130,8 +121,7 @@ class InvoicingAssistant( GObject.GObject, ScopedDatabaseObject ):
                     model.set_default_sort_func( lambda *unused: 0 )
                     model.set_sort_column_id( -1, Gtk.SortType.ASCENDING )
                     i = 0
-                    for unmerged_invoice in invoices:
-                        invoice = session.merge( unmerged_invoice )
+                    for invoice in invoices:
                         invoicetable.add_invoice( invoice )
                         i += 1
                         # change something
@@ -143,7 +133,7 @@ class InvoicingAssistant( GObject.GObject, ScopedDatabaseObject ):
                         model.set_sort_column_id( *sort_settings )
                     treeview.thaw_child_notify()
                     yield False
-                g = gen( invoicetable, self.invoices, invoicingassistant.session )
+                g = gen( invoicetable, self.invoices )
                 if next( g ): # run once now, remaining iterations when idle
                     GLib.idle_add( next, g )
                 label.set_text( "Fertig! {} Rechnungen aus {} Verträgen generiert.".format( num_invoices, num_contracts ) )
@@ -163,8 +153,6 @@ class InvoicingAssistant( GObject.GObject, ScopedDatabaseObject ):
         label = self.builder.get_object( "generate_label" )
         gui_objects = ( self, spinner, label, assistant, page, self._invoicetable )
         self._session.close()
-        contracts = core.database.Contract.get_all( session=self.session ) # We expunge everything, use it inside the thread and readd it later
-        self._session.expunge_all()
         invoice_date = parse_date( self.builder.get_object( "invoice_date_entry" ).get_text().strip() )
         if not invoice_date:
             invoice_date = datetime.date.today()
@@ -174,7 +162,7 @@ class InvoicingAssistant( GObject.GObject, ScopedDatabaseObject ):
         accounting_enddate = parse_date( self.builder.get_object( "invoice_accountingenddate_entry" ).get_text().strip() )
         if not accounting_enddate:
             accounting_enddate = invoice_date
-        self.invoice_generator_threadobj = ThreadObject( contracts, {"date":invoice_date, "maturity_date":maturity_date, "accounting_enddate": accounting_enddate}, gui_objects )
+        self.invoice_generator_threadobj = ThreadObject( {"date":invoice_date, "maturity_date":maturity_date, "accounting_enddate": accounting_enddate}, gui_objects )
         self.invoice_generator_threadobj.start()
     def page_save_prepare_func( self, assistant, page ):
         class ThreadObject( GObject.GObject, threading.Thread ):
@@ -190,15 +178,18 @@ class InvoicingAssistant( GObject.GObject, ScopedDatabaseObject ):
             def run( self ):
                 GLib.idle_add( lambda: self._gui_start() )
                 local_session = core.database.Database.get_scoped_session()
-                for invoice in self.invoices:
-                    local_session.add( invoice ) # add them to the local session
-                local_session.commit()
+                InvoicingEngine( session=local_session, on_progress=self._progress ).save( self.invoices )
                 local_session.remove() # expunge everything afterwards
                 GLib.idle_add( lambda: self._gui_stop( len( self.invoices ) ) )
+            def _progress( self, stage, done, total ):
+                GLib.idle_add( self._gui_update, done, total )
             def _gui_start( self ):
                 spinner, label, assistant, page, window = self.gui_objects
                 label.set_text( "Speichere Rechnungen..." )
                 spinner.start()
+            def _gui_update( self, done, total ):
+                spinner, label, assistant, page, window = self.gui_objects
+                label.set_text( "Speichere Rechnungen... ({}/{})".format( done, total ) )
             def _gui_stop( self, num_invoices ):
                 spinner, label, assistant, page, window = self.gui_objects
                 assistant.commit()
@@ -26,20 +26,16 @@ import core.database
 from core.letterrenderer import ComposingRenderer, LetterCollectionRenderer
 from core.lettercomposition import ContractLetterComposition
 import msmgui.widgets.lettercompositor
-from msmgui.assistants.genericexport import GenericExportAssistant, GenericExportSettings
+from msmgui.assistants.genericexport import GenericExportAssistant, GenericExportSettings, format_job_progress
 class BaseRendererGUI( object ):
-    def __init__( self, gui_objects, update_step ):
+    def __init__( self, gui_objects ):
         self._gui_spinner, self._gui_label, self._gui_assistant, self._gui_page = gui_objects
-        self._update_step = update_step
     def on_rendering_start( self, work_started ):
         text = "Starte Rendering..."
         GLib.idle_add( self._gui_start )
         GLib.idle_add( self._gui_update, text )
     def on_rendering_output( self, work_done, work_started ):
-        if self._update_step is not None:
-            if not ( work_done % self._update_step == 0 or work_done == 1 ):
-                return
-        text = "Rendere Briefe... ({}/{})".format( work_done, work_started )
+        text = format_job_progress( "Rendere Briefe... ({}/{})".format( work_done, work_started ), self.job.status() )
         GLib.idle_add( self._gui_update, text )
     def on_rendering_finished( self, work_done ):
         text = "1 Brief gerendert!".format( work_done ) if work_done == 1 else "{} Briefe gerendert!".format( work_done )
@@ -51,6 +47,9 @@ class BaseRendererGUI( object ):
         text = "Fertig! 1 Brief kompiliert!".format( work_done ) if work_done == 1 else "Fertig! {} Briefe kompiliert!".format( work_done )
         GLib.idle_add( self._gui_update, text )
         GLib.idle_add( self._gui_stop )
+    def on_cancelled( self ):
+        GLib.idle_add( self._gui_update, "Abgebrochen." )
+        GLib.idle_add( self._gui_stop )
     def _gui_start( self ):
         self._gui_spinner.start()
     def _gui_update( self, text ):
@@ -59,18 +58,15 @@ class BaseRendererGUI( object ):
         self._gui_spinner.stop()
         self._gui_assistant.set_page_complete( self._gui_page, True )
 class ComposingRendererGUI( BaseRendererGUI, ComposingRenderer ):
-    def __init__( self, lettercomposition, contracts, collectionname, output_file, gui_objects, update_step=25 ):
-        BaseRendererGUI.__init__( self, gui_objects, update_step )
+    def __init__( self, lettercomposition, contracts, collectionname, output_file, gui_objects ):
+        BaseRendererGUI.__init__( self, gui_objects )
         ComposingRenderer.__init__( self, lettercomposition, contracts, collectionname, output_file )
     def on_composing_start( self, work_started ):
         text = "Starte Zusammenstellung..."
         GLib.idle_add( self._gui_start )
         GLib.idle_add( self._gui_update, text )
     def on_composing_output( self, work_done, work_started ):
-        if self._update_step is not None:
-            if not ( work_done % self._update_step == 0 or work_done == 1 ):
-                return
-        text = "Stelle Briefe für Verträge zusammen... ({}/{})".format( work_done, work_started )
+        text = format_job_progress( "Stelle Briefe für Verträge zusammen... ({}/{})".format( work_done, work_started ), self.job.status() )
         GLib.idle_add( self._gui_update, text )
     def on_composing_finished( self, num_letters ):
         text = "1 Brief zusammengestellt!" if num_letters == 1 else "{} Briefe zusammengestellt!".format( num_letters )
@@ -82,8 +78,8 @@ class ComposingRendererGUI( BaseRendererGUI, ComposingRenderer ):
         text = "1 Brief in der Datenbank gespeichert!" if num_letters == 1 else "{} Briefe in der Datenbank gespeichert!".format( num_letters )
         GLib.idle_add( self._gui_update, text )
 class LetterCollectionRendererGUI( BaseRendererGUI, LetterCollectionRenderer ):
-    def __init__( self, lettercollection, output_file, gui_objects, update_step=25 ):
-        BaseRendererGUI.__init__( self, gui_objects, update_step )
+    def __init__( self, lettercollection, output_file, gui_objects ):
+        BaseRendererGUI.__init__( self, gui_objects )
         LetterCollectionRenderer.__init__( self, lettercollection, output_file )
     def on_init_start( self ):
         text = "Hole Briefe aus der Datenbank..."
@@ -143,6 +139,7 @@ class LetterExportAssistant( GenericExportAssistant ):
         # Remove stuff from the session so that it can be re-added in the thread
         self._session.close()
         # Start the Thread
+        self.set_job( watcher.job )
         watcher.start()
 class LetterExportSettings( GenericExportSettings ):
     def __init__( self, session=None ):
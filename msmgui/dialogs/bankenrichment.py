@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    This file is part of MSM.
+
+    MSM is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    MSM is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with MSM.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import logging
+logger = logging.getLogger( __name__ )
+import threading
+from gi.repository import Gtk, GLib
+from core import paths
+import core.database
+from core.bankenrichment import BankaccountEnricher
+class BankEnrichmentDialog( object ):
+    """
+    Runs the BankaccountEnricher (as dry run or for real) in a background
+    thread and shows its progress and report.
+    """
+    class Response:
+        """ Response Enum """
+        DryRun, Apply = 1, 2
+    MAX_CHANGES_SHOWN = 200
+    def __init__( self, parent ):
+        """
+        __init__ function.
+        Arguments:
+            parent:
+                the parent window of this dialog.
+        """
+        self._parent = parent
+        self._thread = None
+        # Build GUI
+        self.builder = Gtk.Builder()
+        self.builder.add_from_file( paths.data( "ui", "dialogs", "bankenrichment.glade" ) )
+        self.builder.get_object( "content" ).set_transient_for( self._parent )
+        self.builder.get_object( "content" ).set_modal( True )
+        # Connect Signals
+        self.builder.connect_signals( self )
+    def show( self ):
+        """
+        Shows the dialog.
+        """
+        self.builder.get_object( "content" ).show_all()
+    def hide( self ):
+        """
+        Hides the dialog.
+        """
+        self.builder.get_object( "content" ).hide()
+    def start( self, dry_run ):
+        """
+        Starts the enrichment in a background thread.
+        Arguments:
+            dry_run:
+                only create the report, don't write anything
+        """
+        only_empty = self.builder.get_object( "only_empty_checkbutton" ).get_active()
+        self._set_running( True )
+        self.builder.get_object( "report_textview" ).get_buffer().set_text( "" )
+        self._thread = threading.Thread( target=self._run, args=( dry_run, only_empty ), daemon=True )
+        self._thread.start()
+    def _run( self, dry_run, only_empty ):
+        session = core.database.Database.get_scoped_session()
+        try:
+            report = BankaccountEnricher( dry_run=dry_run, only_empty=only_empty, session=session, on_progress=self._progress ).run()
+        except Exception as e:
+            logger.exception( "Bank data enrichment failed" )
+            GLib.idle_add( self._gui_stop, None, str( e ) )
+        else:
+            GLib.idle_add( self._gui_stop, report, None )
+        finally:
+            session.remove()
+    def _progress( self, stage, done, total ):
+        GLib.idle_add( self._gui_update, done, total )
+    def _set_running( self, running ):
+        for name in ( "dryrun_button", "apply_button", "close_button", "only_empty_checkbutton" ):
+            self.builder.get_object( name ).set_sensitive( not running )
+    def _gui_update( self, done, total ):
+        progressbar = self.builder.get_object( "progressbar" )
+        progressbar.set_fraction( done / total if total else 1.0 )
+        progressbar.set_text( "Bankkonto {}/{}".format( done, total ) )
+    def _gui_stop( self, report, error ):
+        self._thread = None
+        self._set_running( False )
+        if report is None:
+            text = "Fehler: {}".format( error )
+        else:
+            lines = report.summary()
+            if report.changes:
+                lines.append( "" )
+                for change in report.changes[:self.MAX_CHANGES_SHOWN]:
+                    lines.append( "{}: {} / {} -> {} / {}".format( change.iban, change.old_bic, change.old_bank, change.new_bic, change.new_bank ) )
+                if len( report.changes ) > self.MAX_CHANGES_SHOWN:
+                    lines.append( "... und {} weitere".format( len( report.changes ) - self.MAX_CHANGES_SHOWN ) )
+            text = "\n".join( lines )
+        self.builder.get_object( "report_textview" ).get_buffer().set_text( text )
+    # Callbacks
+    def response_cb( self, dialog, response ):
+        """Response Callback of the Gtk.Dialog"""
+        if response == BankEnrichmentDialog.Response.DryRun:
+            self.start( dry_run=True )
+        elif response == BankEnrichmentDialog.Response.Apply:
+            self.start( dry_run=False )
+        elif self._thread is None:
+            self.hide()
+    def delete_event_cb( self, dialog, event ):
+        """Keeps the dialog (and its thread) alive, it is only hidden."""
+        if self._thread is None:
+            self.hide()
+        return True
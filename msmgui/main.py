@@ -22,10 +22,8 @@ from gi.repository import Gtk, Gio, GLib
 from core import paths
 import msmgui.widgets.customerwindow
 import msmgui.widgets.invoicewindow
-import msmgui.dialogs.about
-import msmgui.assistants.contractexport
-import msmgui.assistants.directdebitexport
-import msmgui.assistants.bookingimport
+# The dialogs and assistants are imported and built on first use (see the
+# properties below), so they don't slow down startup.
 class MainWindow( Gtk.ApplicationWindow ):
     def __init__( self, application ):
         """
@@ -65,10 +63,11 @@ class MainWindow( Gtk.ApplicationWindow ):
         self.builder.get_object( "invoicewindow" ).add( self._invoicewindow )
         self._invoicewindow.connect( "status-changed", self.statusbar_cb )
 
-        self._aboutdialog = msmgui.dialogs.about.AboutDialog( self )
-        self._contractexportassistant = msmgui.assistants.contractexport.ContractExportAssistant()
-        self._directdebitexportassistant = msmgui.assistants.directdebitexport.DirectDebitExportAssistant()
-        self._bookingimportassistant = msmgui.assistants.bookingimport.BookingImportAssistant()
+        self._aboutdialog = None
+        self._contractexportassistant = None
+        self._directdebitexportassistant = None
+        self._bookingimportassistant = None
+        self._bankenrichmentdialog = None
 
         # MenuBar Actions
         contractexport_action = Gio.SimpleAction.new("contractexport", None)
@@ -83,6 +82,10 @@ class MainWindow( Gtk.ApplicationWindow ):
         bookingimport_action.connect("activate", self.bookingimport_cb)
         self.add_action(bookingimport_action)
 
+        bankenrichment_action = Gio.SimpleAction.new("bankenrichment", None)
+        bankenrichment_action.connect("activate", self.bankenrichment_cb)
+        self.add_action(bankenrichment_action)
+
         about_action = Gio.SimpleAction.new("about", None)
         about_action.connect("activate", self.about_cb)
         self.add_action(about_action)
@@ -91,6 +94,36 @@ class MainWindow( Gtk.ApplicationWindow ):
         page = self.builder.get_object( "customerwindow" )
         # Call the loading routine manually for first time
         GLib.idle_add( self.notebook_switch_page_cb, notebook, page, notebook.get_current_page() )
+    @property
+    def aboutdialog( self ):
+        if self._aboutdialog is None:
+            import msmgui.dialogs.about
+            self._aboutdialog = msmgui.dialogs.about.AboutDialog( self )
+        return self._aboutdialog
+    @property
+    def contractexportassistant( self ):
+        if self._contractexportassistant is None:
+            import msmgui.assistants.contractexport
+            self._contractexportassistant = msmgui.assistants.contractexport.ContractExportAssistant()
+        return self._contractexportassistant
+    @property
+    def directdebitexportassistant( self ):
+        if self._directdebitexportassistant is None:
+            import msmgui.assistants.directdebitexport
+            self._directdebitexportassistant = msmgui.assistants.directdebitexport.DirectDebitExportAssistant()
+        return self._directdebitexportassistant
+    @property
+    def bookingimportassistant( self ):
+        if self._bookingimportassistant is None:
+            import msmgui.assistants.bookingimport
+            self._bookingimportassistant = msmgui.assistants.bookingimport.BookingImportAssistant()
+        return self._bookingimportassistant
+    @property
+    def bankenrichmentdialog( self ):
+        if self._bankenrichmentdialog is None:
+            import msmgui.dialogs.bankenrichment
+            self._bankenrichmentdialog = msmgui.dialogs.bankenrichment.BankEnrichmentDialog( self )
+        return self._bankenrichmentdialog
     def add_status_message( self, message ):
         """
         Adds a status message to the statusbar of the MainWindow.
@@ -113,8 +146,8 @@ class MainWindow( Gtk.ApplicationWindow ):
             parameter:
                 the parameter to the activation
         """
-        self._contractexportassistant.set_parent( self.get_toplevel() )
-        self._contractexportassistant.show()
+        self.contractexportassistant.set_parent( self.get_toplevel() )
+        self.contractexportassistant.show()
 
     def directdebitexport_cb(self, action, parameter):
         """
@@ -125,8 +158,8 @@ class MainWindow( Gtk.ApplicationWindow ):
             parameter:
                 the parameter to the activation
         """
-        self._directdebitexportassistant.set_parent( self.get_toplevel() )
-        self._directdebitexportassistant.show()
+        self.directdebitexportassistant.set_parent( self.get_toplevel() )
+        self.directdebitexportassistant.show()
 
     def bookingimport_cb(self, action, parameter):
         """
@@ -137,8 +170,19 @@ class MainWindow( Gtk.ApplicationWindow ):
             parameter:
                 the parameter to the activation
         """
-        self._bookingimportassistant.set_parent( self.get_toplevel() )
-        self._bookingimportassistant.show()
+        self.bookingimportassistant.set_parent( self.get_toplevel() )
+        self.bookingimportassistant.show()
+
+    def bankenrichment_cb( self, action, parameter ):
+        """
+        Callback for the "bankenrichment"-action of the MenuBar. Shows the BankEnrichment dialog.
+        Arguments:
+            action:
+                the Gio.SimpleAction that emitted the "activate" signal
+            parameter:
+                the parameter to the activation
+        """
+        self.bankenrichmentdialog.show()
 
     def about_cb( self, action, parameter ):
         """
@@ -149,7 +193,7 @@ class MainWindow( Gtk.ApplicationWindow ):
             parameter:
                 the parameter to the activation
         """
-        self._aboutdialog.show()
+        self.aboutdialog.show()
     # Callbacks
     def statusbar_cb( self, sender, message ):
         """
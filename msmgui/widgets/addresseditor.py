@@ -39,6 +39,7 @@ class AddressEditor( Gtk.Box, ScopedDatabaseObject ):
     __gsignals__ = {
         'changed': ( GObject.SIGNAL_RUN_FIRST, None, () ),
     }
+    COMPLETION_LIMIT = 10 # Number of zipcode/city suggestions
     def __init__( self, session ):
         ScopedDatabaseObject.__init__( self, session )
         Gtk.Box.__init__( self )
@@ -197,8 +198,10 @@ class AddressEditor( Gtk.Box, ScopedDatabaseObject ):
         zipcode = new_text.strip()
         city = core.autocompletion.Cities.get_by_iso_zipcode( zipcode )
         if city is None:
-            country = 'DE' # FIXME: Enable completion for other countries too
-            city = core.autocompletion.Cities.get( country, "zipcode", zipcode )
+            country = address.countrycode if address.countrycode else 'DE' # FIXME: Default country value
+            cities = core.autocompletion.Cities.get_all( country, "zipcode", zipcode )
+            # Several places may share a zipcode, keep the one that has been chosen via completion
+            city = next( ( city for city in cities if city.name == address.city ), cities[0] if cities else None )
         if city is not None:
             address.city = city.name
             address.zipcode = city.zipcode
@@ -206,6 +209,55 @@ class AddressEditor( Gtk.Box, ScopedDatabaseObject ):
         else:
             address.zipcode = zipcode
         self.emit( "changed" )
+    def addresses_zipcode_cellrenderertext_editing_started_cb( self, cellrenderer, editable, path_string ):
+        self.add_city_completion( editable, path_string, "zipcode" )
+    def addresses_city_cellrenderertext_editing_started_cb( self, cellrenderer, editable, path_string ):
+        self.add_city_completion( editable, path_string, "name" )
+    def add_city_completion( self, editable, path_string, key ):
+        """
+        Adds live completion of zipcode and city to the entry of a cell that is being edited.
+        Arguments:
+            editable:
+                the Gtk.CellEditable of the cell
+            path_string:
+                the path of the edited row
+            key:
+                "zipcode" or "name", depending on the edited column
+        """
+        if not isinstance( editable, Gtk.Entry ):
+            return
+        model = self.builder.get_object( 'addresses_liststore' )
+        address = AddressRowReference( model, Gtk.TreePath( path_string ) ).get_address()
+        liststore = Gtk.ListStore( str, str, str, str ) # Text, zipcode, city, countrycode
+        completion = Gtk.EntryCompletion()
+        completion.set_model( liststore )
+        completion.set_text_column( 0 )
+        completion.set_minimum_key_length( 1 )
+        completion.set_match_func( lambda completion, key, treeiter, data: True, None ) # liststore only contains matches
+        completion.connect( "match-selected", self.city_completion_match_selected_cb, address, key )
+        editable.set_completion( completion )
+        editable.connect( "changed", self.city_completion_entry_changed_cb, liststore, address, key )
+    def city_completion_entry_changed_cb( self, entry, liststore, address, key ):
+        text = entry.get_text()
+        country = address.countrycode if address.countrycode else 'DE' # FIXME: Default country value
+        if key == "zipcode":
+            result = core.autocompletion.Cities.iso_zipcode_split( text )
+            if result:
+                country, text = result
+            cities = core.autocompletion.Cities.complete_zipcode( country, text, self.COMPLETION_LIMIT )
+        else:
+            cities = core.autocompletion.Cities.complete_name( country, text, self.COMPLETION_LIMIT )
+        liststore.clear()
+        for city in cities:
+            liststore.append( ["{} {}".format( city.zipcode, city.name ), city.zipcode, city.name, city.country] )
+    def city_completion_match_selected_cb( self, completion, model, treeiter, address, key ):
+        text, zipcode, city, countrycode = model[treeiter]
+        address.zipcode = zipcode
+        address.city = city
+        address.countrycode = countrycode
+        completion.get_entry().set_text( zipcode if key == "zipcode" else city )
+        self.emit( "changed" )
+        return True
     def addresses_city_cellrenderertext_edited_cb( self, cellrenderer, path_string, new_text ):
         if self.signals_blocked: return
         model = self.builder.get_object( 'addresses_liststore' )
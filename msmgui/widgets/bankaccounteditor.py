@@ -38,6 +38,7 @@ class BankaccountEditor( Gtk.Box, ScopedDatabaseObject ):
     __gsignals__ = {
         'changed': ( GObject.SIGNAL_RUN_FIRST, None, () ),
     }
+    COMPLETION_LIMIT = 10 # Number of bank suggestions
     def __init__( self, session ):
         ScopedDatabaseObject.__init__( self, session )
         Gtk.Box.__init__( self )
@@ -186,6 +187,35 @@ class BankaccountEditor( Gtk.Box, ScopedDatabaseObject ):
         bankaccount = rowref.get_bankaccount()
         bankaccount.bank = new_text.strip()
         self.emit( "changed" )
+    def bankaccounts_bank_cellrenderertext_editing_started_cb( self, cellrenderer, editable, path_string ):
+        """
+        Adds live search of banks by name (in all countries) to the entry of the bank cell.
+        """
+        if not isinstance( editable, Gtk.Entry ):
+            return
+        model = self.builder.get_object( 'bankaccounts_liststore' )
+        bankaccount = BankaccountRowReference( model, Gtk.TreePath( path_string ) ).get_bankaccount()
+        liststore = Gtk.ListStore( str, str, str ) # Text, bank name, BIC
+        completion = Gtk.EntryCompletion()
+        completion.set_model( liststore )
+        completion.set_text_column( 0 )
+        completion.set_minimum_key_length( 2 )
+        completion.set_match_func( lambda completion, key, treeiter, data: True, None ) # liststore only contains matches
+        completion.connect( "match-selected", self.bank_completion_match_selected_cb, bankaccount )
+        editable.set_completion( completion )
+        editable.connect( "changed", self.bank_completion_entry_changed_cb, liststore )
+    def bank_completion_entry_changed_cb( self, entry, liststore ):
+        banks = core.autocompletion.Banks.search_name( entry.get_text(), self.COMPLETION_LIMIT )
+        liststore.clear()
+        for bank in banks:
+            liststore.append( ["{} ({}, {})".format( bank.name, bank.bic, bank.country ), bank.name, bank.bic] )
+    def bank_completion_match_selected_cb( self, completion, model, treeiter, bankaccount ):
+        text, name, bic = model[treeiter]
+        bankaccount.bank = name
+        bankaccount.bic = bic
+        completion.get_entry().set_text( name )
+        self.emit( "changed" )
+        return True
     def bankaccounts_owner_cellrenderertext_edited_cb( self, cellrenderer, path_string, new_text ):
         if self.signals_blocked: return
         model = self.builder.get_object( 'bankaccounts_liststore' )
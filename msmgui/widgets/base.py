@@ -19,8 +19,7 @@
 import logging
 logger = logging.getLogger( __name__ )
 from gi.repository import Gtk
-import sqlalchemy.orm.scoping
-import core.database
+from core.database import ScopedDatabaseObject # moved to core, kept here for the GUI modules
 class RefreshableWindow( Gtk.Overlay ):
     def __init__( self, refreshable_objects ):
         Gtk.Overlay.__init__( self )
@@ -55,21 +54,6 @@ class RefreshableWindow( Gtk.Overlay ):
             self._loadingspinner.stop()
             self._loadingspinner.hide()
 
-class ScopedDatabaseObject( object ):
-    @property
-    def session( self ):
-        return self._session
-    def _scopefunc( self ):
-        """ Needed as scopefunc argument for the scoped_session"""
-        return self
-    def __init__( self, session=None ):
-        if type( session ) is not sqlalchemy.orm.scoping.scoped_session:
-            session = core.database.Database.get_scoped_session( self._scopefunc )
-        # Store reference to the session
-        if type( session ) is not sqlalchemy.orm.scoping.scoped_session:
-            raise RuntimeError( "Can't __init__ without a session!" )
-        self._session = session
-
 class ConfirmationDialog( Gtk.MessageDialog ):
     def __init__( self, parent_window, message ):
         super().__init__( parent_window, Gtk.DialogFlags.MODAL, Gtk.MessageType.WARNING, Gtk.ButtonsType.YES_NO, "Bist du sicher?" )
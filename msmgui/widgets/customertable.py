@@ -124,8 +124,9 @@ class CustomerTable( Gtk.Box, ScopedDatabaseObject ):
         treeview.set_model( None )
         del self._customers_treemodelsort
         del self._customers_treemodelfilter
-        for i, customer in enumerate( core.database.Customer.get_all( session=self.session ) ):
-            rowref = self.add_customer( customer )
+        running_customer_ids = core.database.Customer.get_running_customer_ids_by_date( session=self.session )
+        for i, customer in enumerate( core.database.Customer.get_all( session=self.session, profile='customer-row' ) ):
+            rowref = self.add_customer( customer, has_running_contracts=( customer.id in running_customer_ids ) )
             del rowref
             # change something
             if i % step == 0:
@@ -145,20 +146,21 @@ class CustomerTable( Gtk.Box, ScopedDatabaseObject ):
     def refresh( self ):
         GLib.idle_add(self._do_refresh)
     @staticmethod
-    def convert_customer_to_rowdata( customer ):
+    def convert_customer_to_rowdata( customer, has_running_contracts=None ):
         if not isinstance( customer, core.database.Customer ):
             raise TypeError( "Expected core.database.Customer, not {}".format( type( customer ).__name__ ) )
         birthday = customer.birthday.strftime("%x") if customer.birthday else ""
-        has_running_contracts = customer.has_running_contracts()
+        if has_running_contracts is None:
+            has_running_contracts = customer.has_running_contracts()
         color = 'black' if has_running_contracts else 'gray'
         if len( customer.addresses ):
             address = customer.addresses[0]
             return [customer.id, customer.familyname, customer.prename, customer.honourific, customer.title, customer.gender, birthday, customer.company1, customer.company2, customer.department, address.co, address.street, address.zipcode, address.city, has_running_contracts, color]
         else:
             return [customer.id, customer.familyname, customer.prename, customer.honourific, customer.title, customer.gender, birthday, customer.company1, customer.company2, customer.department, "", "", "", "", has_running_contracts, color]
-    def add_customer( self, customer ):
+    def add_customer( self, customer, has_running_contracts=None ):
         model = self.builder.get_object( "customers_liststore" )
-        treeiter = model.append( CustomerTable.convert_customer_to_rowdata( customer ) )
+        treeiter = model.append( CustomerTable.convert_customer_to_rowdata( customer, has_running_contracts ) )
         return CustomerRowReference.new_by_iter( model, treeiter )
     def add_customer_by_id( self, customer_id ):
         customer = core.database.Customer.get_by_id( customer_id )
@@ -20,6 +20,7 @@ import logging
 logger = logging.getLogger( __name__ )
 from gi.repository import Gtk, GObject, GLib
 import core.database
+from core.invoicing import InvoiceDraft
 from core import paths
 from core.config import Config
 import locale
@@ -127,7 +128,7 @@ class InvoiceTable( Gtk.Box, ScopedDatabaseObject ):
         treeview.set_model( None )
         del self._invoices_treemodelsort
         del self._invoices_treemodelfilter
-        for i, invoice in enumerate( core.database.Invoice.get_all( session=self.session ) ):
+        for i, invoice in enumerate( core.database.Invoice.get_all( session=self.session, profile='invoice-row' ) ):
             rowref = self.add_invoice( invoice )
             del rowref
             # change something
@@ -322,6 +323,8 @@ class InvoiceTable( Gtk.Box, ScopedDatabaseObject ):
         model = treeview.get_model()
         rowref = InvoiceRowReference( model, path )
         invoice = rowref.get_invoice()
+        if isinstance( invoice, InvoiceDraft ):
+            invoice = invoice.to_invoice()
         letter = core.database.Letter( invoice.contract, contents=[ invoice, ] )
         watcher = LetterPreviewRenderer( letter )
         watcher.start()
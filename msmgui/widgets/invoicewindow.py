@@ -22,8 +22,6 @@ from gi.repository import GObject, Gtk
 from core.config import Config
 from core import paths
 import msmgui.widgets.invoicetable
-import msmgui.assistants.invoicing
-import msmgui.assistants.letterexport
 import msmgui.widgets.base
 class InvoiceWindow( msmgui.widgets.base.RefreshableWindow ):
     __gsignals__ = {
@@ -40,14 +38,26 @@ class InvoiceWindow( msmgui.widgets.base.RefreshableWindow ):
         self.builder.get_object( "tablebox" ).add( self._invoicetable )
         self._invoicetable.connect( "selection-changed", self.invoicetable_selection_changed_cb )
 
-        self._invoicingassistant = msmgui.assistants.invoicing.InvoicingAssistant()
-        self._invoicingassistant.connect( "saved", self.invoicingassistant_saved_cb )
-
-        self._letterexportassistant = msmgui.assistants.letterexport.LetterExportAssistant()
+        # The assistants are built on first use (see below)
+        self._invoicingassistant = None
+        self._letterexportassistant = None
 
         active_only = Config.getboolean( "Interface", "active_only" )
         if not active_only:
             self.builder.get_object( "invoices_showall_switch" ).set_active( not active_only )
+    @property
+    def invoicingassistant( self ):
+        if self._invoicingassistant is None:
+            import msmgui.assistants.invoicing
+            self._invoicingassistant = msmgui.assistants.invoicing.InvoicingAssistant()
+            self._invoicingassistant.connect( "saved", self.invoicingassistant_saved_cb )
+        return self._invoicingassistant
+    @property
+    def letterexportassistant( self ):
+        if self._letterexportassistant is None:
+            import msmgui.assistants.letterexport
+            self._letterexportassistant = msmgui.assistants.letterexport.LetterExportAssistant()
+        return self._letterexportassistant
     def invoicetable_selection_changed_cb( self, table ):
         pass
     def invoices_search_entry_changed_cb( self, entry ):
@@ -55,11 +65,11 @@ class InvoiceWindow( msmgui.widgets.base.RefreshableWindow ):
     def invoices_showall_switch_notify_active_cb( self, switch, param_spec ):
         self._invoicetable.active_only = not switch.get_active()
     def invoices_create_button_clicked_cb( self, button ):
-        self._invoicingassistant.set_parent( self.get_toplevel() )
-        self._invoicingassistant.show()
+        self.invoicingassistant.set_parent( self.get_toplevel() )
+        self.invoicingassistant.show()
     def invoices_export_button_clicked_cb( self, button ):
-        self._letterexportassistant.set_parent( self.get_toplevel() )
-        self._letterexportassistant.show()
+        self.letterexportassistant.set_parent( self.get_toplevel() )
+        self.letterexportassistant.show()
     def invoicingassistant_saved_cb( self, assistant, num_invoices ):
         if num_invoices > 0:
             self.emit( "status-changed", ( "Eine Rechnung erstellt." if num_invoices == 1 else "%d Rechnungen erstellt." % num_invoices ) )
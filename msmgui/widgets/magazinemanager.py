@@ -313,7 +313,7 @@ class SubscriptionEditor( Gtk.Box, ScopedDatabaseObject ):
     def _gui_fill( self ):
         self.signals_blocked = True
         self.builder.get_object( "subscription_name_entry" ).set_text( self._subscription.name )
-        self.builder.get_object( "subscription_value_spinbutton" ).set_value( self._subscription.value )
+        self.builder.get_object( "subscription_value_spinbutton" ).set_value( float( self._subscription.value ) )
         self.builder.get_object( "subscription_valuechangeable_checkbutton" ).set_active( self._subscription.value_changeable )
         if self._subscription.number_of_issues:
             self.builder.get_object( "subscription_numberofissues_spinbutton" ).set_value( self._subscription.number_of_issues )
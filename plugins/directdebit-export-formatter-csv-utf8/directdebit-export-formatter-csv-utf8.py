@@ -6,7 +6,7 @@ import core.plugintypes
 class DirectDebitExportFormatterCSV(core.plugintypes.DirectDebitExportFormatter):
     FILE_EXT = 'csv'
 
-    def write(self, invoices, output_file):
+    def write(self, invoices, output_file, control_sum=None):
         fieldnames = ['NAME', 'CONTRACTNUMBER', 'INVOICENUMBER', 'VALUE',
                       'CURRENCY', 'IBAN', 'BIC', 'BANK', 'DESCRIPTION',
                       'CO', 'STREET', 'CITY', 'POSTALCODE', 'COUNTRYCODE',
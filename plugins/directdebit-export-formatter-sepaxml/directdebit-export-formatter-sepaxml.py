@@ -35,8 +35,8 @@ class DirectDebitExportFormatterSEPAXML(
         core.plugintypes.DirectDebitExportFormatter):
     FILE_EXT = 'xml'
 
-    def write(self, invoices, output_file):
-        sepaddbuilder = SepaDDXMLBuilder()
+    def write(self, invoices, output_file, control_sum=None):
+        sepaddbuilder = SepaDDXMLBuilder(control_sum)
 
         for invoice in invoices:
             sepaddbuilder.transactions.append({
@@ -62,8 +62,9 @@ class DirectDebitExportFormatterSEPAXML(
 
 
 class SepaDDXMLBuilder(object):
-    def __init__(self):
+    def __init__(self, control_sum=None):
         self.transactions = []
+        self._control_sum = control_sum
         now = datetime.datetime.now()
         self.message_id = '%sX%03d' % (now.strftime('%Y%m%d%H%M%S'),
                                        random.randint(0, 999))
@@ -82,6 +83,8 @@ class SepaDDXMLBuilder(object):
         return len(self.transactions)
 
     def control_sum(self):
+        if self._control_sum is not None:
+            return self._control_sum
         return sum(t['value'] for t in self.transactions)
 
     def get_tree(self):
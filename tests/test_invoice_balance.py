@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+    This file is part of MSM.
+
+    MSM is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    MSM is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with MSM.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import datetime
+import decimal
+import unittest
+import core.database
+from core.database import Database, Magazine, Customer, Invoice, BookkeepingEntry
+class InvoiceBalanceTest( unittest.TestCase ):
+    def setUp( self ):
+        Database( 'sqlite://' )
+        self.session = core.database.Session
+        magazine = Magazine( 'Magazine', 4 )
+        for month in ( 1, 4, 7, 10 ):
+            magazine.add_issue( 2014, month, datetime.date( 2014, month, 15 ) )
+        subscription = magazine.add_subscription( 'Normal', 20.0 )
+        customer = Customer( 'Muster', 'Max' )
+        address = customer.add_address( 'Street 1', '12345', 'City' )
+        contract = customer.add_contract( subscription, datetime.date( 2014, 1, 1 ), None, 20.0, shippingaddress=address, billingaddress=address )
+        self.invoice = contract.add_invoice( date=datetime.date( 2014, 12, 31 ), accounting_enddate=datetime.date( 2014, 12, 31 ) )
+        self.session.add_all( ( magazine, customer ) )
+        self.session.commit()
+        self.invoice_id = self.invoice.id
+        self.entry = self.invoice.entries[0] # the automatic entry of 20.00
+    def tearDown( self ):
+        self.session.remove()
+    def assertBalance( self, value, value_paid, value_left ):
+        self.session.expire_all()
+        invoice = self.session.query( Invoice ).get( self.invoice_id )
+        self.assertEqual( ( invoice.value, invoice.value_paid, invoice.value_left ),
+                          ( decimal.Decimal( value ), decimal.Decimal( value_paid ), decimal.Decimal( value_left ) ) )
+    def test_add_entry( self ):
+        self.assertBalance( '20.00', '0.00', '20.00' )
+        self.invoice.add_entry( datetime.date( 2015, 1, 10 ), -7.70, 'Zahlung' )
+        self.session.commit()
+        self.assertBalance( '20.00', '-7.70', '12.30' )
+    def test_delete_entry( self ):
+        self.session.delete( self.entry )
+        self.session.commit()
+        self.assertBalance( '0.00', '0.00', '0.00' )
+    def test_delete_entry_of_unloaded_invoice( self ):
+        payment = self.invoice.add_entry( datetime.date( 2015, 1, 10 ), -5, 'Zahlung' )
+        self.session.commit()
+        payment_id = payment.id
+        self.session.expunge_all()
+        self.session.delete( self.session.query( BookkeepingEntry ).get( payment_id ) )
+        self.session.commit()
+        self.assertBalance( '20.00', '0.00', '20.00' )
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+    This file is part of MSM.
+
+    MSM is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    MSM is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with MSM.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import datetime
+import unittest
+import core.database
+from core.database import Database, Magazine, Customer, Contract
+class RunningContractsTest( unittest.TestCase ):
+    def setUp( self ):
+        Database( 'sqlite://' )
+        self.session = core.database.Session
+        magazine = Magazine( 'Magazine', 4 )
+        for month in ( 1, 4, 7, 10 ):
+            magazine.add_issue( 2014, month, datetime.date( 2014, month, 15 ) )
+        unlimited = magazine.add_subscription( 'Normal', 20.0 )
+        trial = magazine.add_subscription( 'Probe', 5.0, number_of_issues=1 )
+        twice = magazine.add_subscription( 'Kurz', 10.0, number_of_issues=2 )
+        customers = []
+        for name, subscription in ( ( 'Unlimited', unlimited ), ( 'Trial', trial ), ( 'Twice', twice ) ):
+            customer = Customer( name, 'Max' )
+            address = customer.add_address( 'Street 1', '12345', 'City' )
+            customer.add_contract( subscription, datetime.date( 2014, 1, 1 ), None, subscription.value, shippingaddress=address, billingaddress=address )
+            customers.append( customer )
+        self.session.add( magazine )
+        self.session.add_all( customers )
+        self.session.commit()
+        self.magazine = magazine
+    def tearDown( self ):
+        self.session.remove()
+    def get_shipped( self, issue ):
+        return sorted( contract.customer.familyname for contract in issue.get_contracts( session=self.session ) )
+    def test_issue_contracts( self ):
+        issues = self.magazine.issues
+        self.assertEqual( self.get_shipped( issues[0] ), ['Trial', 'Twice', 'Unlimited'] )
+        self.assertEqual( self.get_shipped( issues[1] ), ['Twice', 'Unlimited'] )
+        self.assertEqual( self.get_shipped( issues[2] ), ['Unlimited'] )
+        self.assertEqual( self.get_shipped( issues[3] ), ['Unlimited'] )
+    def test_running_criterion_matches_is_running( self ):
+        contracts = self.session.query( Contract ).all()
+        for date in ( datetime.date( 2014, 1, 1 ), datetime.date( 2014, 1, 15 ), datetime.date( 2014, 4, 15 ), datetime.date( 2014, 5, 1 ) ):
+            running = set( contract.id for contract in Contract.get_running_contracts_by_date( date, self.session ) )
+            self.assertEqual( running, set( contract.id for contract in contracts if contract.is_running( date ) ), date )
+if __name__ == '__main__':
+    unittest.main()
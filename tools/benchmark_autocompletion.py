@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    This file is part of MSM.
+
+    MSM is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    MSM is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with MSM.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import sys
+import os
+import logging
+if __name__ == "__main__":
+    logger = logging.getLogger()
+    sys.path = [os.path.abspath( os.path.join( os.path.dirname( __file__ ), os.pardir ) )] + sys.path
+else:
+    logger = logging.getLogger( __name__ )
+import argparse
+import gc
+import random
+import tempfile
+import time
+import tracemalloc
+import core.autocompletion
+from core.autocompletion import BankInfoStore, CityInfoStore
+from core.config import Config
+from core.datasetcache import DatasetCache
+
+class LegacyRecord:
+    """
+    A record as it was stored before the columnar storage: one object with a
+    __dict__ per record.
+    """
+    def __init__( self, fields, record ):
+        for field, value in zip( fields, record ):
+            setattr( self, "_" + field, value )
+
+def get_sources():
+    """
+    Returns a list of ( store class, tag, filename, encoding ) for all configured data files.
+    """
+    sources = []
+    for option in sorted( Config.options( 'Autocompletion' ) ):
+        filename = Config.getfilepath( 'Autocompletion', option )
+        if option.startswith( 'bic_file_' ) and os.path.exists( filename ):
+            sources.append( ( BankInfoStore, option[9:].upper(), filename, 'latin1' ) )
+        elif option.startswith( 'zipcode_file_' ) and os.path.exists( filename ):
+            sources.append( ( CityInfoStore, option[13:].upper(), filename, 'utf-8' ) )
+    return sources
+
+def load_legacy( sources ):
+    """
+    Builds the previous layout: one object per record and one dict per tag and indexed key.
+    """
+    data = {}
+    for cls, tag, filename, encoding in sources:
+        store = cls()
+        indexes = dict( ( key, {} ) for key in store._keys )
+        for record in store.read( tag, filename, encoding ):
+            obj = LegacyRecord( cls.FIELDS, record )
+            for key in indexes:
+                indexes[key][getattr( obj, "_" + key )] = obj
+        data[( cls.__name__, tag )] = indexes
+    return data
+
+def load_columnar( sources, cache ):
+    stores = { BankInfoStore: BankInfoStore(), CityInfoStore: CityInfoStore() }
+    for cls, tag, filename, encoding in sources:
+        stores[cls].load( tag, filename, encoding, cache )
+    # Build all indexes, so that they are included in the measurement
+    for store in stores.values():
+        store.build_indexes()
+    return stores
+
+def measure( function, *args ):
+    """
+    Returns the result of function, the memory it keeps allocated in bytes
+    and the duration in seconds (measured in a separate run, because
+    tracemalloc slows everything down).
+    """
+    gc.collect()
+    start = time.perf_counter()
+    function( *args )
+    duration = time.perf_counter() - start
+    gc.collect()
+    tracemalloc.start()
+    result = function( *args )
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, size, duration
+
+def time_lookups( stores, num_lookups ):
+    """
+    Returns the average duration of a get() in seconds.
+    """
+    rnd = random.Random( 42 )
+    lookups = []
+    for store in stores.values():
+        for tag, table in store._data.items():
+            for key in store._keys:
+                column = table._columns[store.FIELDS.index( key )]
+                lookups.extend( ( store, tag, key, column[rnd.randrange( len( column ) )] ) for i in range( num_lookups // 10 ) )
+    start = time.perf_counter()
+    for store, tag, key, value in lookups:
+        store.get( tag, key, value )
+    return ( time.perf_counter() - start ) / len( lookups )
+
+def time_typeahead( cities, num_words ):
+    """
+    Types random zipcodes and city names of every country character by
+    character and completes after each keystroke.
+    Returns:
+        a list of ( country, average, 99th percentile, maximum ) durations in seconds per keystroke
+    """
+    rnd = random.Random( 23 )
+    results = []
+    for tag, table in sorted( cities._data.items() ):
+        durations = []
+        for i in range( num_words ):
+            zipcode, name, lat, lon = table.record( rnd.randrange( len( table ) ) )
+            for function, word in ( ( cities.complete_zipcode, zipcode ), ( cities.complete_name, name ) ):
+                for length in range( 1, len( word ) + 1 ):
+                    start = time.perf_counter()
+                    function( tag, word[:length], 10 )
+                    durations.append( time.perf_counter() - start )
+        durations.sort()
+        results.append( ( tag, sum( durations ) / len( durations ), durations[int( len( durations ) * 0.99 )], durations[-1] ) )
+    return results
+
+def time_bank_search( banks, num_words ):
+    """
+    Types random bank names character by character and searches all countries after each keystroke.
+    Returns:
+        ( average, 99th percentile, maximum ) durations in seconds per keystroke
+    """
+    rnd = random.Random( 17 )
+    tables = [table for tag, table in sorted( banks._data.items() ) if len( table )]
+    name_field = banks.FIELDS.index( 'name' )
+    durations = []
+    for i in range( num_words ):
+        table = rnd.choice( tables )
+        name = table._columns[name_field][rnd.randrange( len( table ) )]
+        for length in range( 1, len( name ) + 1 ):
+            start = time.perf_counter()
+            banks.search_name( name[:length], 10 )
+            durations.append( time.perf_counter() - start )
+    durations.sort()
+    return sum( durations ) / len( durations ), durations[int( len( durations ) * 0.99 )], durations[-1]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser( description="Measures memory usage and load time of the autocompletion data." )
+    parser.add_argument( "-l", "--lookups", type=int, default=10000, help="number of lookups per tag" )
+    parser.add_argument( "-w", "--words", type=int, default=200, help="number of zipcodes/city names typed per country" )
+    args = parser.parse_args()
+    sources = get_sources()
+    core.autocompletion._data_loaded = True # don't load the global stores
+    with tempfile.TemporaryDirectory() as tmpdir:
+        cache = DatasetCache( tmpdir )
+        load_columnar( sources, cache ) # warm up the cache
+        legacy, legacy_size, legacy_time = measure( load_legacy, sources )
+        del legacy
+        stores, parsed_size, parsed_time = measure( load_columnar, sources, None )
+        del stores
+        stores, cached_size, cached_time = measure( load_columnar, sources, cache )
+        print( "{:<40}{:>12}{:>12}".format( "LAYOUT", "MEMORY", "LOAD" ) )
+        print( "{:<40}{:>10.1f}MB{:>10.1f}ms".format( "objects + dict indexes (previous)", legacy_size / 2**20, legacy_time * 1000 ) )
+        print( "{:<40}{:>10.1f}MB{:>10.1f}ms".format( "columnar, parsed", parsed_size / 2**20, parsed_time * 1000 ) )
+        print( "{:<40}{:>10.1f}MB{:>10.1f}ms".format( "columnar, warm cache", cached_size / 2**20, cached_time * 1000 ) )
+        print( "Memory saved: {:.0f}%".format( 100 * ( 1 - cached_size / legacy_size ) ) )
+        print( "Average lookup: {:.1f}us".format( time_lookups( stores, args.lookups ) * 1e6 ) )
+        print( "{:<40}{:>12}{:>12}{:>12}".format( "TYPEAHEAD PER KEYSTROKE", "AVERAGE", "99%", "MAXIMUM" ) )
+        for tag, average, percentile, maximum in time_typeahead( stores[CityInfoStore], args.words ):
+            print( "{:<40}{:>10.1f}us{:>10.1f}us{:>10.1f}us".format( tag, average * 1e6, percentile * 1e6, maximum * 1e6 ) )
+        average, percentile, maximum = time_bank_search( stores[BankInfoStore], args.words )
+        print( "{:<40}{:>10.1f}us{:>10.1f}us{:>10.1f}us".format( "bank names, all countries", average * 1e6, percentile * 1e6, maximum * 1e6 ) )
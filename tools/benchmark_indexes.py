@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    This file is part of MSM.
+
+    MSM is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    MSM is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with MSM.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import sys
+import os
+import logging
+if __name__ == "__main__":
+    logger = logging.getLogger()
+    sys.path = [os.path.abspath( os.path.join( os.path.dirname( __file__ ), os.pardir ) )] + sys.path
+else:
+    logger = logging.getLogger( __name__ )
+import argparse
+import datetime
+import random
+import tempfile
+import timeit
+from sqlalchemy import func
+import core.database
+from core.database import Base, Customer, Address, Magazine, Subscription, Issue, Contract, Invoice, BookkeepingEntry, Letter, LetterPart, bkentry_association_table, letter_association_table
+
+def populate( engine, num_customers, num_magazines=3 ):
+    """
+    Fills an empty database with random data (bulk inserts, bypassing the ORM).
+    """
+    rnd = random.Random( 42 )
+    startyear = 2010
+    endyear = datetime.date.today().year
+    with engine.begin() as connection:
+        connection.execute( Magazine.__table__.insert(), [{'id': i, 'name': 'Magazine %d' % i, 'issues_per_year': 4} for i in range( 1, num_magazines + 1 )] )
+        issues = []
+        for magazine_id in range( 1, num_magazines + 1 ):
+            for year in range( startyear, endyear + 1 ):
+                for number, month in enumerate( ( 2, 5, 8, 11 ), start=1 ):
+                    issues.append( {'magazine_id': magazine_id, 'year': year, 'number': number, 'date': datetime.date( year, month, 15 )} )
+        connection.execute( Issue.__table__.insert(), issues )
+        subscriptions = []
+        for magazine_id in range( 1, num_magazines + 1 ):
+            subscriptions.append( {'magazine_id': magazine_id, 'name': 'Normal', 'value': 20.0, 'value_changeable': False, 'number_of_issues': None} )
+            subscriptions.append( {'magazine_id': magazine_id, 'name': 'Probe', 'value': 5.0, 'value_changeable': False, 'number_of_issues': 2} )
+        connection.execute( Subscription.__table__.insert(), subscriptions )
+        connection.execute( Customer.__table__.insert(), [{'id': i, 'familyname': 'Name %d' % i, 'prename': 'Vorname', 'gender': 0} for i in range( 1, num_customers + 1 )] )
+        connection.execute( Address.__table__.insert(), [{'id': i, 'customer_id': i, 'street': 'Straße %d' % i, 'zipcode': '%05d' % rnd.randint( 1000, 99999 ), 'city': 'Stadt', 'countrycode': 'DE'} for i in range( 1, num_customers + 1 )] )
+        contracts, invoices, letterparts, entries, bkentries, letters, letterassocs = [], [], [], [], [], [], []
+        refids = set()
+        for contract_id in range( 1, num_customers + 1 ):
+            startdate = datetime.date( rnd.randint( startyear, endyear ), rnd.randint( 1, 12 ), 1 )
+            enddate = startdate + datetime.timedelta( days=rnd.randint( 30, 2000 ) ) if rnd.random() < 0.3 else None
+            refid = Contract._generate_random_refid()
+            while refid in refids:
+                refid = Contract._generate_random_refid()
+            refids.add( refid )
+            contracts.append( {'id': contract_id, 'refid': refid, 'value': 20.0, 'startdate': startdate, 'enddate': enddate, 'paymenttype': 0,
+                               'customer_id': contract_id, 'subscription_id': rnd.randint( 1, 2 * num_magazines ),
+                               'shippingaddress_id': contract_id, 'billingaddress_id': contract_id} )
+            for number in range( 1, 4 ):
+                invoice_id = len( letterparts ) + 1
+                letterparts.append( {'id': invoice_id, 'type': 'invoice'} )
+                invoices.append( {'id': invoice_id, 'contract_id': contract_id, 'accounting_startdate': startdate, 'accounting_enddate': startdate,
+                                  'date': startdate, 'maturity_date': startdate, 'number': number, 'value': 20.0, 'value_paid': 0, 'value_left': 20.0} )
+                entry_id = len( entries ) + 1
+                entries.append( {'id': entry_id, 'contract_id': contract_id, 'date': startdate, 'value': 20.0, 'description': 'Rechnung'} )
+                bkentries.append( {'invoice_id': invoice_id, 'bookkeepingentry_id': entry_id} )
+                letters.append( {'id': invoice_id, 'contract_id': contract_id, 'date': startdate} )
+                letterassocs.append( {'letter_id': invoice_id, 'letterpart_id': invoice_id} )
+        connection.execute( Contract.__table__.insert(), contracts )
+        connection.execute( LetterPart.__table__.insert(), letterparts )
+        connection.execute( Invoice.__table__.insert(), invoices )
+        connection.execute( BookkeepingEntry.__table__.insert(), entries )
+        connection.execute( bkentry_association_table.insert(), bkentries )
+        connection.execute( Letter.__table__.insert(), letters )
+        connection.execute( letter_association_table.insert(), letterassocs )
+
+def get_benchmarks( session, num_lookups ):
+    """
+    Returns a dict that maps each managed index to a function that runs a typical query depending on it.
+    """
+    rnd = random.Random( 23 )
+    num_contracts = Contract.count( session )
+    ids = [rnd.randint( 1, num_contracts ) for i in range( num_lookups )]
+    today = datetime.date.today()
+    months = [datetime.date( rnd.randint( 2010, today.year ), rnd.randint( 1, 12 ), 1 ) for i in range( 50 )]
+    def date_range( column ):
+        def run():
+            for month in months:
+                session.query( func.count( Contract.id ) ).filter( column >= month, column < month + datetime.timedelta( days=31 ) ).scalar()
+        return run
+    def running_contracts():
+        Contract.get_running_contracts_by_date( today, session ).count()
+    def lookup( column ):
+        def run():
+            for value in ids:
+                session.execute( column.table.select().where( column == value ) ).fetchall()
+        return run
+    def magazine_contracts():
+        for magazine in session.query( Magazine ):
+            magazine.get_contracts( session=session ).count()
+    def issue_count():
+        for value in ids:
+            session.query( func.count( Issue.id ) ).filter( Issue.magazine_id == 1, Issue.date >= datetime.date( 2012, 1, 1 ), Issue.date <= today ).scalar()
+    def open_invoices():
+        Invoice.get_open_invoices( session ).count()
+    return { 'ix_contracts_startdate': date_range( Contract.startdate ),
+             'ix_contracts_enddate': date_range( Contract.enddate ),
+             'ix_contracts_customer_id': lookup( Contract.__table__.c.customer_id ),
+             'ix_contracts_subscription_id': magazine_contracts,
+             'ix_invoices_contract_id': lookup( Invoice.__table__.c.contract_id ),
+             'ix_invoices_value_left': open_invoices,
+             'ix_bookkeeping_entries_contract_id': lookup( BookkeepingEntry.__table__.c.contract_id ),
+             'ix_bkentry_association_invoice_id': lookup( bkentry_association_table.c.invoice_id ),
+             'ix_bkentry_association_bookkeepingentry_id': lookup( bkentry_association_table.c.bookkeepingentry_id ),
+             'ix_letter_association_letter_id': lookup( letter_association_table.c.letter_id ),
+             'ix_letter_association_letterpart_id': lookup( letter_association_table.c.letterpart_id ),
+             'ix_issues_magazine_id_date': issue_count,
+             'running contracts (all indexes)': running_contracts }
+
+def run_benchmarks( engine, session, num_lookups, repeat ):
+    """
+    Times every benchmark with and without its index. Returns a list of (name, time_without, time_with) tuples.
+    """
+    indexes = dict( ( index.name, index ) for table in Base.metadata.sorted_tables for index in table.indexes )
+    results = []
+    for name, benchmark in sorted( get_benchmarks( session, num_lookups ).items() ):
+        dropped = [indexes[name]] if name in indexes else list( indexes.values() )
+        time_with = min( timeit.repeat( benchmark, number=1, repeat=repeat ) )
+        for index in dropped:
+            index.drop( engine )
+        time_without = min( timeit.repeat( benchmark, number=1, repeat=repeat ) )
+        for index in dropped:
+            index.create( engine )
+        results.append( ( name, time_without, time_with ) )
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser( description="Measures the effect of each managed database index on a random database." )
+    parser.add_argument( "-c", "--customers", type=int, default=40000, help="number of customers/contracts to generate" )
+    parser.add_argument( "-l", "--lookups", type=int, default=1000, help="number of single row lookups per benchmark" )
+    parser.add_argument( "-r", "--repeat", type=int, default=3, help="number of repetitions (the fastest one is reported)" )
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        database = core.database.Database( "sqlite:///{}".format( os.path.join( tmpdir, "benchmark.sqlite" ) ) )
+        engine = core.database.Database._engine
+        print( "Generating {} customers...".format( args.customers ) )
+        populate( engine, args.customers )
+        session = core.database.Database.get_scoped_session()
+        print( "{:<45}{:>12}{:>12}{:>10}".format( "INDEX", "WITHOUT", "WITH", "SPEEDUP" ) )
+        for name, time_without, time_with in run_benchmarks( engine, session, args.lookups, args.repeat ):
+            print( "{:<45}{:>11.1f}ms{:>11.1f}ms{:>9.1f}x".format( name, time_without * 1000, time_with * 1000, time_without / time_with ) )
+        session.remove()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    This file is part of MSM.
+
+    MSM is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    MSM is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with MSM.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import sys
+import os
+import logging
+if __name__ == "__main__":
+    logger = logging.getLogger()
+    sys.path = [os.path.abspath( os.path.join( os.path.dirname( __file__ ), os.pardir ) )] + sys.path
+else:
+    logger = logging.getLogger( __name__ )
+import argparse
+import locale
+import tempfile
+import time
+import core.database
+import core.letterrenderer
+from core.config import Config
+from core.database import Letter
+from benchmark_indexes import populate
+
+def set_backend( backend ):
+    """
+    Sets the backend of the renderer queues for this process only (the config file isn't saved).
+    """
+    if not Config.cp.has_section( "LetterRenderer" ):
+        Config.cp.add_section( "LetterRenderer" )
+    Config.cp.set( "LetterRenderer", "backend", backend )
+
+def prerender( letter_ids, num_workers ):
+    """
+    Prerenders the letters with a PrerenderQueue. Returns the number of letters that failed.
+    """
+    q = core.letterrenderer.PrerenderQueue( core.letterrenderer.env_latex, num_workers )
+    q.put_multiple( letter_ids )
+    q.start()
+    failed = sum( 1 for output in q.outputs() if output is None )
+    q.join()
+    return failed
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser( description="Measures the throughput of the letter prerendering with the thread and the process backend." )
+    parser.add_argument( "-l", "--letters", type=int, default=3000, help="number of letters to prerender" )
+    parser.add_argument( "-w", "--workers", default="1,2,4", help="comma separated numbers of workers" )
+    parser.add_argument( "--locale", default="", help="locale used for formatting the amounts (default: the user's locale)" )
+    args = parser.parse_args()
+    locale.setlocale( locale.LC_ALL, args.locale )
+    workers = [int( value ) for value in args.workers.split( "," )]
+    with tempfile.TemporaryDirectory() as tmpdir:
+        # The process backend needs a database file that the workers can open
+        core.database.Database( "sqlite:///{}".format( os.path.join( tmpdir, "benchmark.sqlite" ) ) )
+        print( "Generating {} letters...".format( args.letters ) )
+        populate( core.database.Database._engine, ( args.letters + 2 ) // 3 ) # three letters per customer
+        session = core.database.Database.get_scoped_session()
+        letter_ids = [letter_id for letter_id, in session.query( Letter.id ).order_by( Letter.id ).limit( args.letters )]
+        session.remove()
+        print( "{} CPU cores".format( os.cpu_count() ) )
+        print( "{:<10}{:>8}{:>12}{:>14}{:>10}".format( "BACKEND", "WORKERS", "TIME", "LETTERS/S", "FAILED" ) )
+        for backend in core.letterrenderer.BACKENDS:
+            set_backend( backend )
+            for num_workers in workers:
+                start = time.perf_counter()
+                failed = prerender( letter_ids, num_workers )
+                duration = time.perf_counter() - start
+                print( "{:<10}{:>8}{:>11.2f}s{:>14.1f}{:>10}".format( backend, num_workers, duration, len( letter_ids ) / duration, failed ) )
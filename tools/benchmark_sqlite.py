@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+    This file is part of MSM.
+
+    MSM is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    MSM is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with MSM.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import sys
+import os
+import logging
+if __name__ == "__main__":
+    logger = logging.getLogger()
+    sys.path = [os.path.abspath( os.path.join( os.path.dirname( __file__ ), os.pardir ) )] + sys.path
+else:
+    logger = logging.getLogger( __name__ )
+import argparse
+import datetime
+import random
+import tempfile
+import threading
+import time
+import sqlalchemy.exc
+from core.database import Database, Contract, BookkeepingEntry
+from tools.benchmark_indexes import populate
+
+class Worker( threading.Thread ):
+    """
+    Simulates a background job: Every iteration is a short-lived session that
+    reads a random contract, books an entry and commits.
+    """
+    def __init__( self, num_contracts, iterations, seed ):
+        threading.Thread.__init__( self )
+        self.num_contracts = num_contracts
+        self.iterations = iterations
+        self.rnd = random.Random( seed )
+        self.commits = 0
+        self.errors = 0
+    def run( self ):
+        session = Database.get_scoped_session()
+        for i in range( self.iterations ):
+            try:
+                contract = session.query( Contract ).get( self.rnd.randint( 1, self.num_contracts ) )
+                session.add( BookkeepingEntry( datetime.date.today(), 1.0, "Benchmark", contract_id=contract.id ) )
+                session.commit()
+                self.commits += 1
+            except sqlalchemy.exc.OperationalError:
+                session.rollback()
+                self.errors += 1
+            finally:
+                session.remove()
+
+class Reader( threading.Thread ):
+    """
+    Simulates the GUI reading while the workers write.
+    """
+    def __init__( self ):
+        threading.Thread.__init__( self )
+        self.stop_event = threading.Event()
+        self.reads = 0
+        self.errors = 0
+    def run( self ):
+        session = Database.get_scoped_session()
+        while not self.stop_event.is_set():
+            try:
+                Contract.get_running_contracts_by_date( session=session ).count()
+                self.reads += 1
+            except sqlalchemy.exc.OperationalError:
+                self.errors += 1
+            finally:
+                session.remove()
+
+def run_benchmark( profile, num_customers, num_workers, iterations, tmpdir=None ):
+    """
+    Runs the workers and the reader against a new database using the given SQLite profile.
+    Returns:
+        a tuple of commits per second, reads per second and failed transactions
+    """
+    with tempfile.TemporaryDirectory( dir=tmpdir ) as tmpdir:
+        Database( "sqlite:///{}".format( os.path.join( tmpdir, "benchmark.sqlite" ) ), sqlite_pragmas=Database.SQLITE_PROFILES[profile], pool_options={ 'pool_size': num_workers + 1, 'max_overflow': 0, 'pool_timeout': 30 } )
+        populate( Database._engine, num_customers )
+        workers = [Worker( num_customers, iterations, seed ) for seed in range( num_workers )]
+        reader = Reader()
+        start = time.perf_counter()
+        reader.start()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        duration = time.perf_counter() - start
+        reader.stop_event.set()
+        reader.join()
+        Database._engine.dispose()
+    commits = sum( worker.commits for worker in workers )
+    errors = sum( worker.errors for worker in workers ) + reader.errors
+    return ( commits / duration, reader.reads / duration, errors )
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser( description="Measures the write/read throughput of concurrent short-lived sessions for each SQLite profile." )
+    parser.add_argument( "-c", "--customers", type=int, default=5000, help="number of customers/contracts to generate" )
+    parser.add_argument( "-w", "--workers", type=int, default=4, help="number of worker threads" )
+    parser.add_argument( "-i", "--iterations", type=int, default=250, help="number of transactions per worker" )
+    parser.add_argument( "-d", "--dir", default=None, help="directory for the database file (should be on the disk that holds msm.sqlite)" )
+    args = parser.parse_args()
+    print( "{:<10}{:>12}{:>12}{:>10}".format( "PROFILE", "COMMITS/S", "READS/S", "ERRORS" ) )
+    for profile in sorted( Database.SQLITE_PROFILES ):
+        commits, reads, errors = run_benchmark( profile, args.customers, args.workers, args.iterations, args.dir )
+        print( "{:<10}{:>12.1f}{:>12.1f}{:>10}".format( profile, commits, reads, errors ) )
@@ -27,6 +27,7 @@ else:
 import locale
 locale.setlocale( locale.LC_ALL, 'de_DE.UTF-8' )
 import datetime
+from sqlalchemy import func
 from core.config import Config
 import core.database
 
@@ -60,15 +61,11 @@ if __name__ == "__main__":
     dateobj = datetime.date.today()
     print( 'Anzahl der Verträge am {}'.format( dateobj.strftime("%x") ) )
     contractnums = {}
-    for contract in core.database.Contract.get_all():
-        if contract.is_running( dateobj ):
-            key = contract.subscription.id
-            if key not in contractnums:
-                contractnums[key] = {'id': contract.subscription.id, 'name':contract.subscription.name, 'values':{}}
-            else:
-                value = contract.value
-                if value not in contractnums[key]['values']:
-                    contractnums[key]['values'][value] = 1
-                else:
-                    contractnums[key]['values'][value] += 1
+    Contract, Subscription = core.database.Contract, core.database.Subscription
+    q = session.query( Subscription.id, Subscription.name, Contract.value, func.count( Contract.id ) ).select_from( Contract ).join( Contract.subscription )
+    q = q.filter( Contract.running_criterion( dateobj ) ).group_by( Subscription.id, Subscription.name, Contract.value )
+    for subscription_id, subscription_name, value, number in q:
+        if subscription_id not in contractnums:
+            contractnums[subscription_id] = {'id': subscription_id, 'name':subscription_name, 'values':{}}
+        contractnums[subscription_id]['values'][value] = number
     print_table( contractnums )
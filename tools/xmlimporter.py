@@ -51,12 +51,17 @@ except ImportError:
                 except ImportError:
                     logger.debug( "Failed to import ElementTree from any known place" )
 import dateutil.parser
+import sqlalchemy.exc
 from core.config import Config
 import core.database
+IMPORT_ATTEMPTS = 3 # see RefidAllocator
 def import_xml( session, filename ):
     subscription_mapping = ( ( 1, 'Normalabo Position' ), ( 2, 'Soliabo Position' ) )
     tree = etree.parse( filename )
     root = tree.getroot()
+    # Reserve all needed contract refids at once, so that we don't need to query the database for every single contract
+    num_contracts = sum( len( el_contracts ) for el_contracts in root.iter( 'contracts' ) )
+    refids = core.database.RefidAllocator( session ).reserve( num_contracts )
     for el_customer in root:
         customer = core.database.Customer( el_customer.get( 'familyname' ), el_customer.get( 'prename' ) )
         customer.company1 = el_customer.get( 'company' )
@@ -99,7 +104,7 @@ def import_xml( session, filename ):
                     logger.warning( "Customer '%s' - Wrong contract value, using subscription value instead", customer.name )
                     value = subscription.value
                 paymenttype = core.database.PaymentType.DirectWithdrawal if bankaccount is not None else core.database.PaymentType.Invoice
-                contract = customer.add_contract( subscription, startdate, enddate , value, paymenttype, address, address, bankaccount )
+                contract = customer.add_contract( subscription, startdate, enddate , value, paymenttype, address, address, bankaccount, refid=refids.pop() )
         session.add( customer )
     session.commit()
 if __name__ == "__main__":
@@ -114,4 +119,13 @@ if __name__ == "__main__":
     db_uri = Config.get( "Database", "db_uri" )
     database = core.database.Database( db_uri )
     session = core.database.Database.get_scoped_session()
-    import_xml( session, filename )
+    for attempt in range( 1, IMPORT_ATTEMPTS + 1 ):
+        try:
+            import_xml( session, filename )
+            break
+        except sqlalchemy.exc.IntegrityError:
+            # Most likely another process took one of the reserved refids, see RefidAllocator
+            session.rollback()
+            if attempt == IMPORT_ATTEMPTS:
+                raise
+            logger.warning( "Import failed because of a conflicting refid, retrying" )